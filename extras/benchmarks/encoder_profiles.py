@@ -0,0 +1,119 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+ Encoder profiles benchmark. Generates synthetic music-like source track and encodes it with each encoder
+ profile installed ffmpeg supports, reporting encoding time, speed (times realtime) and output size.
+
+ Usage (from project root):
+
+   python extras/benchmarks/encoder_profiles.py [SECONDS [RUNS]]
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+# noinspection PyPep8
+from mp3voicestamp_app.config import Config
+# noinspection PyPep8
+from mp3voicestamp_app.encoder import Encoder
+# noinspection PyPep8
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+# noinspection PyPep8
+from mp3voicestamp_app.tools import Tools
+# noinspection PyPep8
+from mp3voicestamp_app.util import Util
+
+# bitrate of generated source MP3, which profiles derive their settings from
+SOURCE_BITRATE = '192k'
+
+
+def make_source(ffmpeg, tmp_dir, seconds):
+    """Generates stereo WAV (what mixing feeds the encoder with) and MP3 (source track) files with pink noise
+    and a few tones, which is much closer to real music, encoding-wise, than pure sine or silence.
+
+    Returns:
+        tuple (WAV file name, MP3 file name)
+    """
+    wav_file = os.path.join(tmp_dir, 'source.wav')
+    mp3_file = os.path.join(tmp_dir, 'source.mp3')
+
+    cmd = [ffmpeg, '-y',
+           '-f', 'lavfi', '-i', 'anoisesrc=color=pink:amplitude=0.2:duration={}'.format(seconds),
+           '-f', 'lavfi', '-i', 'sine=frequency=220:duration={}'.format(seconds),
+           '-f', 'lavfi', '-i', 'sine=frequency=330:duration={}'.format(seconds),
+           '-filter_complex', 'amix=inputs=3,aformat=channel_layouts=stereo',
+           '-ar', '44100', '-c:a', 'pcm_s16le', wav_file]
+    if Util.execute_rc(cmd) != 0:
+        raise RuntimeError('Failed to generate source WAV file')
+
+    cmd = [ffmpeg, '-y', '-i', wav_file, '-c:a', 'libmp3lame', '-b:a', SOURCE_BITRATE, mp3_file]
+    if Util.execute_rc(cmd) != 0:
+        raise RuntimeError('Failed to generate source MP3 file')
+
+    return wav_file, mp3_file
+
+
+def encode(ffmpeg, wav_file, file_out, output_args):
+    if Util.execute_rc([ffmpeg, '-y', '-i', wav_file, '-ac', '2'] + output_args + [file_out]) != 0:
+        raise RuntimeError('Failed to encode "{}"'.format(file_out))
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    tools = Tools()
+    tools.check_env()
+    ffmpeg = tools.get_tool(Tools.KEY_FFMPEG)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        wav_file, mp3_file = make_source(ffmpeg, tmp_dir, seconds)
+        music_track = Mp3FileInfo(mp3_file)
+
+        print('Source: {} s, {} bps, {} runs per profile'.format(seconds, music_track.bitrate, runs))
+        print('')
+        print('{:<8} {:>10} {:>10} {:>12} {:>8}'.format('Profile', 'Time [s]', 'Speed', 'Size', 'kbps'))
+
+        for profile in Config.ENCODERS:
+            encoder = Encoder(profile)
+            if not tools.has_capability(encoder.get_capability()):
+                print('{:<8} not supported by installed ffmpeg'.format(profile))
+                continue
+
+            file_out = os.path.join(tmp_dir, 'out_{}.{}'.format(profile, encoder.get_extension() or 'mp3'))
+            output_args = encoder.get_output_args(music_track)
+
+            timer = timeit.Timer(lambda: encode(ffmpeg, wav_file, file_out, output_args))
+            elapsed = min(timer.repeat(repeat=runs, number=1))
+
+            size = os.path.getsize(file_out)
+            print('{:<8} {:>10.2f} {:>9.1f}x {:>12} {:>8.0f}'.format(
+                profile, elapsed, seconds / elapsed, Util.format_size(size), size * 8 / 1000.0 / seconds))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+ Sampled loudness benchmark. For each given file, calculates music RMS amplitude from all samples and
+ estimates it from sampled windows, reporting time each took, actual difference of resulting level and
+ error estimated by sampling (which should not be lower than the actual difference).
+
+ Usage (from project root):
+
+   python extras/benchmarks/loudness_sampling.py [--windows N] [--window-length SECONDS] FILE [FILE ...]
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+# noinspection PyPep8
+from mp3voicestamp_app.audio import Audio
+# noinspection PyPep8
+from mp3voicestamp_app.config import Config
+# noinspection PyPep8
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+# noinspection PyPep8
+from mp3voicestamp_app.tools import Tools
+
+
+def to_db(amplitude):
+    return 20 * math.log10(amplitude) if amplitude > 0 else float('-inf')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--windows', type=int, default=Config.DEFAULT_LOUDNESS_WINDOWS)
+    parser.add_argument('--window-length', type=int, default=Config.DEFAULT_LOUDNESS_WINDOW_LENGTH)
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    args = parser.parse_args()
+
+    tools = Tools()
+    tools.check_env()
+    audio = Audio(tools)
+
+    print('{} windows of {} secs'.format(args.windows, args.window_length))
+    print('')
+    print('{:>8} {:>10} {:>10} {:>8} {:>10} {:>10}  {}'.format(
+        'Minutes', 'Full [s]', 'Sampled', 'Speedup', 'Diff [dB]', 'Est. [dB]', 'File'))
+
+    exceeded = 0
+    for file_name in args.files:
+        music_track = Mp3FileInfo(file_name)
+
+        started = time.time()
+        full_rms = audio.calculate_rms_amplitude_of_file(file_name)
+        full_time = time.time() - started
+
+        started = time.time()
+        sampled_rms, error_db = audio.calculate_sampled_rms_amplitude(
+            file_name, music_track.duration_seconds, args.windows, args.window_length)
+        sampled_time = time.time() - started
+
+        diff_db = abs(to_db(sampled_rms) - to_db(full_rms))
+        if diff_db > error_db:
+            exceeded += 1
+
+        print('{:>8.1f} {:>10.2f} {:>10.2f} {:>7.1f}x {:>10.2f} {:>10.2f}  {}'.format(
+            music_track.duration_seconds / 60, full_time, sampled_time, full_time / max(sampled_time, 0.001),
+            diff_db, error_db, os.path.basename(file_name)))
+
+    # with 95% confidence bound, roughly one file in twenty is expected to exceed it
+    print('')
+    print('Actual difference exceeded estimated error for {} of {} files'.format(exceeded, len(args.files)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+ Orchestration benchmark. Stamps given number of (empty) files with "fake" backends configured for all
+ the stages, so no external tools are run and no audio is processed. Track metadata is served from
+ prepopulated metadata index, so mutagen is not needed either. What is measured is overhead of Job, Scheduler
+ and Api themselves, reported as files per second and average wall time of each stage.
+
+ Usage (from project root):
+
+   python extras/benchmarks/orchestration.py [--files N] [--minutes M] [--jobs J [J ...]]
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+# noinspection PyPep8
+from mp3voicestamp_app.api import Api
+# noinspection PyPep8
+from mp3voicestamp_app.config import Config
+# noinspection PyPep8
+from mp3voicestamp_app.metadata_index import MetadataIndex
+# noinspection PyPep8
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+
+
+def create_files(src_dir, index_file, count, minutes):
+    tags = {tag: '' for tag in [Mp3FileInfo.TAG_TITLE, Mp3FileInfo.TAG_ARTIST, Mp3FileInfo.TAG_ALBUM_ARTIST,
+                                Mp3FileInfo.TAG_ALBUM_TITLE, Mp3FileInfo.TAG_COMPOSER, Mp3FileInfo.TAG_PERFORMER,
+                                Mp3FileInfo.TAG_COMMENT, Mp3FileInfo.TAG_TRACK_NUMBER]}
+
+    index = MetadataIndex(index_file)
+    try:
+        for i in range(count):
+            file_name = os.path.join(src_dir, 'track-{:05d}.mp3'.format(i))
+            open(file_name, 'wb').close()
+
+            tags[Mp3FileInfo.TAG_TITLE] = 'Track {}'.format(i)
+            index.put(file_name, {
+                'duration': minutes * 60.0,
+                'bitrate': 128000,
+                'sample_rate': 44100,
+                'channels': 2,
+                'tags': tags,
+            })
+    finally:
+        index.close()
+
+
+def run(src_dir, out_dir, index_file, jobs):
+    config = Api.build_config(backends={stage: Config.BACKEND_FAKE for stage in Config.BACKEND_STAGES},
+                              metadata_index=index_file, force_overwrite=True, jobs=jobs)
+
+    timings = {}
+    files = 0
+    failed = 0
+
+    started = time.time()
+    for result in Api.stamp_batch([src_dir], output_dir=out_dir, config=config):
+        files += 1
+        if not result.success:
+            failed += 1
+        for stage, elapsed in result.timings.items():
+            timings.setdefault(stage, []).append(elapsed)
+    elapsed = time.time() - started
+
+    return files, failed, elapsed, {stage: sum(values) / len(values) for stage, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--minutes', type=int, default=30, help='Duration of each (fake) track')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 0], help='Use 0 for as many as CPU cores')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src_dir = os.path.join(tmp_dir, 'src')
+        os.mkdir(src_dir)
+        index_file = os.path.join(tmp_dir, 'index.sqlite')
+        create_files(src_dir, index_file, args.files, args.minutes)
+
+        print('{} files, {} minutes each'.format(args.files, args.minutes))
+        for jobs in args.jobs:
+            out_dir = os.path.join(tmp_dir, 'out-{}'.format(jobs))
+            os.mkdir(out_dir)
+
+            files, failed, elapsed, timings = run(src_dir, out_dir, index_file, jobs)
+
+            print('')
+            print('jobs={}: {} files ({} failed) in {:.2f} secs, {:.1f} files/sec'.format(
+                jobs, files, failed, elapsed, files / max(elapsed, 0.001)))
+            for stage in sorted(timings.keys()):
+                print('  {:<12} {:>8.2f} ms'.format(stage, timings[stage] * 1000))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
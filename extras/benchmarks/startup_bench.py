@@ -0,0 +1,102 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+ Startup benchmark. Measures how long it takes to import the app and resolve external tools (with cold and
+ warm tool cache), and checks that heavy modules are not imported eagerly. Returns non-zero exit code on
+ regression, so it can be used in CI.
+
+ Usage (from project root):
+
+   python extras/benchmarks/startup_bench.py [RUNS]
+
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# modules that must not be loaded just by importing the app
+LAZY_MODULES = ['mutagen', 'sqlite3', 'past', 'backports.configparser', 'multiprocessing.pool']
+
+IMPORT_SNIPPET = 'import mp3voicestamp_app.mp3voicestamp'
+
+CHECK_LAZY_SNIPPET = '''
+import sys
+import mp3voicestamp_app.mp3voicestamp
+loaded = [name for name in {modules!r} if name in sys.modules]
+if loaded:
+    print(' '.join(loaded))
+    sys.exit(1)
+'''
+
+CHECK_ENV_SNIPPET = '''
+from mp3voicestamp_app.tools import Tools
+Tools().check_env()
+'''
+
+
+def run_python(snippet, env):
+    cmd = [sys.executable, '-B', '-c', snippet]
+    proc = subprocess.Popen(cmd, cwd=PROJECT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out, err
+
+
+def measure(snippet, env, runs):
+    """Returns best wall time (in ms) of running given snippet in fresh interpreter
+    """
+    timer = timeit.Timer(lambda: run_python(snippet, env))
+    return min(timer.repeat(repeat=runs, number=1)) * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    env = os.environ.copy()
+    env['PYTHONPATH'] = PROJECT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    # use private cache folder, so we can measure cold and warm tool resolution
+    env['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+
+    rc = 0
+
+    baseline = measure('pass', env, runs)
+    print('Bare interpreter start:  {:7.1f} ms'.format(baseline))
+
+    import_time = measure(IMPORT_SNIPPET, env, runs)
+    print('App import:              {:7.1f} ms (+{:.1f} ms)'.format(import_time, import_time - baseline))
+
+    # first run resolves tools and populates the cache, following ones use the cache
+    cold = measure(CHECK_ENV_SNIPPET, env, 1)
+    warm = measure(CHECK_ENV_SNIPPET, env, runs)
+    print('Tools check (cold):      {:7.1f} ms'.format(cold))
+    print('Tools check (cached):    {:7.1f} ms'.format(warm))
+
+    check_rc, out, _ = run_python(CHECK_LAZY_SNIPPET.format(modules=LAZY_MODULES), env)
+    if check_rc != 0:
+        print('REGRESSION: modules imported eagerly: {}'.format(out.decode('utf-8').strip()))
+        rc = 1
+    else:
+        print('Lazy imports:            OK')
+
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main())
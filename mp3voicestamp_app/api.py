@@ -0,0 +1,364 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from mp3voicestamp_app.backends import Backends
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.file_scanner import FileScanner
+from mp3voicestamp_app.job import Job
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.metrics import Metrics
+from mp3voicestamp_app.result_collector import ResultCollector
+from mp3voicestamp_app.tools import Tools
+
+
+class Api(object):
+    """Library interface, letting other Python code voice stamp files in-process, without the CLI.
+
+        config = Api.build_config(tick_interval=5, speech_volume_factor=1.5)
+        result = Api.stamp('track.mp3', output=Api.IN_MEMORY, config=config)
+        for result in Api.stamp_batch(['music/'], output_dir='out', config=config, jobs=0):
+            ...
+
+    Nothing is printed to stdout. Errors are reported in returned StampResult objects (and to stderr),
+    other messages are shown (on stderr) in verbose mode only. Set "log_json" option to get them all.
+    Log is process wide, so if calls overlap (i.e. from different threads), log options of the first one
+    apply until the last one is over.
+    """
+
+    # pass as "output" to get content of the output file returned in StampResult.data
+    IN_MEMORY = ':memory:'
+
+    # name used for placeholders and output file name if source is given as data
+    DEFAULT_DATA_NAME = 'input.mp3'
+
+    __tools = None
+    __tools_lock = threading.Lock()
+
+    # number of calls in progress that use the log
+    __log_users = 0
+    __log_lock = threading.Lock()
+
+    @staticmethod
+    def __apply_options(config, options):
+        for key, value in options.items():
+            # only Config's properties, not its constants or methods
+            if key.startswith('_') or key != key.lower() or not hasattr(config, key) \
+                    or callable(getattr(config, key)):
+                raise ValueError('Unknown config option "{}"'.format(key))
+            setattr(config, key, value)
+
+    @staticmethod
+    def build_config(config_file=None, **options):
+        """Builds configuration programmatically. Options are named after Config's properties
+        (i.e. tick_interval, title_format, output_mode) and validated the same way CLI arguments are.
+
+        Args:
+            :config_file optional config file to be loaded first. Given options override its values
+
+        Returns:
+            Config
+
+        Raises:
+            ValueError on unknown option or invalid value, IOError if config file does not exist
+        """
+        config = Config()
+        if config_file is not None and not config.load(config_file):
+            raise IOError('Config file "{}" not found'.format(config_file))
+        Api.__apply_options(config, options)
+
+        return config
+
+    @staticmethod
+    def __get_config(config, options):
+        # we alter the config while processing, so caller's instance is left untouched
+        config = copy.copy(config) if config is not None else Config()
+        Api.__apply_options(config, options)
+
+        return config
+
+    @staticmethod
+    def __get_tools(config):
+        """Returns Tools, checking the runtime environment once per process, unless configured backends
+        do not run any external tools
+        """
+        if not Backends.needs_tools(config):
+            return Tools()
+
+        with Api.__tools_lock:
+            if Api.__tools is None:
+                tools = Tools()
+                try:
+                    tools.check_env()
+                except SystemExit:
+                    # missing tools are already reported, but we must not exit host application
+                    raise RuntimeError('Required tools not found. See documentation for installation guidelines.')
+                Api.__tools = tools
+
+            return Api.__tools
+
+    @staticmethod
+    def __open_log(config):
+        """Configures the log, unless already done by another call in progress. Each call must be paired
+        with __close_log()
+        """
+        with Api.__log_lock:
+            if Api.__log_users == 0:
+                Log.configure(config)
+                Log.quiet = not config.verbose
+                Log.stream = sys.stderr
+            Api.__log_users += 1
+
+    @staticmethod
+    def __close_log():
+        """Closes the log sink once no other call in progress uses it
+        """
+        with Api.__log_lock:
+            Api.__log_users -= 1
+            if Api.__log_users == 0:
+                Log.close()
+
+    @staticmethod
+    def __open_metadata_index(config):
+        if config.metadata_index is None:
+            return None
+
+        from mp3voicestamp_app.metadata_index import MetadataIndex
+        return MetadataIndex(config.metadata_index)
+
+    @staticmethod
+    def __start_staging(config):
+        if config.staging_dir is None or config.dry_run_mode:
+            return None
+
+        from mp3voicestamp_app.staging import Staging
+        staging = Staging(config)
+        staging.start()
+        return staging
+
+    @staticmethod
+    def __get_listeners(collector):
+        # metrics are collected if host application started them (see Metrics.start())
+        if Metrics.enabled:
+            from mp3voicestamp_app.metrics_collector import MetricsCollector
+            return [collector, MetricsCollector()]
+        return [collector]
+
+    @staticmethod
+    def __run_job(config, tools, metadata_index, collector, file_name, out_sub_dir='', data=None, staging=None):
+        """Processes single file. Failures are reported to the collector, unless in debug mode
+        """
+        job = Job(config, tools, metadata_index, Api.__get_listeners(collector), staging)
+        success = False
+        error = None
+
+        try:
+            job.load(file_name, out_sub_dir, data)
+            if not config.dry_run_mode:
+                job.begin()
+                for stage in job.get_stages():
+                    job.run_stage(stage)
+            success = True
+        except Exception as ex:
+            if config.debug:
+                raise
+            error = ex
+        finally:
+            job.finish(success)
+            job.notify_file_finished(file_name, success, error)
+
+    @staticmethod
+    def __read_output(result, config):
+        """Moves content of the output file (and overlay sidecar) into the result
+        """
+        if result.output is None or not os.path.isfile(result.output):
+            return
+
+        with open(result.output, 'rb') as fh:
+            result.data = fh.read()
+
+        if config.output_mode == Config.OUTPUT_MODE_OVERLAY:
+            sidecar_file = os.path.splitext(result.output)[0] + '.json'
+            if os.path.isfile(sidecar_file):
+                with open(sidecar_file, 'r') as fh:
+                    result.sidecar = json.load(fh)
+
+        result.output = None
+
+    @staticmethod
+    def stamp(file_name=None, data=None, output=None, config=None, name=None, **options):
+        """Voice stamps single track.
+
+        Args:
+            :file_name source MP3 file. Either file_name or data must be given
+            :data content (bytes) of source MP3 file
+            :output output file or directory. If not given, output file is written next to the source file
+                    (as CLI does) or, for data source, returned in memory. Use IN_MEMORY to get the content
+                    returned for file source too
+            :config optional Config, i.e. made with build_config()
+            :name file name to be used for data source in placeholders and output file name
+            :options Config options, overriding the ones in config
+
+        Returns:
+            StampResult
+        """
+        if (file_name is None) == (data is None):
+            raise ValueError('Either file_name or data must be given')
+        if output == Job.STDOUT:
+            raise ValueError('Writing to stdout is not supported, use IN_MEMORY instead')
+
+        config = Api.__get_config(config, options)
+        if data is not None:
+            file_name = name if name is not None else Api.DEFAULT_DATA_NAME
+            if output is None:
+                output = Api.IN_MEMORY
+
+        tools = Api.__get_tools(config)
+        Api.__open_log(config)
+
+        in_memory = output == Api.IN_MEMORY
+        tmp_dir = None
+        metadata_index = None
+        try:
+            if in_memory:
+                tmp_dir = tempfile.mkdtemp(dir=config.scratch_dir)
+                config.file_out = tmp_dir
+            elif output is not None:
+                config.file_out = output
+
+            metadata_index = Api.__open_metadata_index(config)
+            collector = ResultCollector()
+            Api.__run_job(config, tools, metadata_index, collector, file_name, data=data)
+
+            result = collector.finished.get()
+            if in_memory:
+                Api.__read_output(result, config)
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            if metadata_index is not None:
+                metadata_index.close()
+            Api.__close_log()
+
+        return result
+
+    @staticmethod
+    def stamp_batch(paths, output_dir=None, config=None, **options):
+        """Voice stamps many files, yielding results as soon as each file is done. Directories are scanned
+        the same way CLI does it. If "jobs" option is other than 1, files are processed concurrently
+        (see Scheduler) and results are not yielded in input order. If "staging_dir" option is set, output
+        files are copied to their destination in background, and all are there once iteration is over.
+        If iteration is stopped early, files already in progress are finished, but no new ones are started.
+
+        Args:
+            :paths list of files and/or directories to process
+            :output_dir optional directory to write output files to (mirroring scanned directory tree).
+                        If not given, output files are written next to source files
+            :config optional Config, i.e. made with build_config()
+            :options Config options, overriding the ones in config
+
+        Yields:
+            StampResult
+
+        Raises:
+            IOError if any of staged output files failed to be copied to its destination
+        """
+        config = Api.__get_config(config, options)
+        if output_dir is not None:
+            if not os.path.isdir(output_dir):
+                raise ValueError('Output directory "{}" does not exist'.format(output_dir))
+            config.file_out = output_dir
+
+        tools = Api.__get_tools(config)
+        Api.__open_log(config)
+
+        scanner = FileScanner(config.include, config.exclude,
+                              config.file_out_format if config.skip_stamped else None)
+        collector = ResultCollector()
+        metadata_index = None
+        staging = None
+        scheduler = None
+        thread = None
+        try:
+            metadata_index = Api.__open_metadata_index(config)
+            staging = Api.__start_staging(config)
+            if config.jobs == 1 or config.dry_run_mode:
+                input_files = scanner.scan(paths)
+                if staging is not None:
+                    input_files = staging.prefetch(input_files)
+                for file_name, out_sub_dir in input_files:
+                    Api.__run_job(config, tools, metadata_index, collector, file_name, out_sub_dir, staging=staging)
+                    # staged files are done once committed, so these are yielded as they are, while others are run
+                    while not collector.finished.empty():
+                        yield collector.finished.get()
+                if staging is not None:
+                    staging.wait_for_commits()
+                    while not collector.finished.empty():
+                        yield collector.finished.get()
+            else:
+                from mp3voicestamp_app.scheduler import Scheduler
+
+                input_files = scanner.scan(paths)
+                scheduler = Scheduler(config, tools, metadata_index, Api.__get_listeners(collector), staging)
+                errors = []
+
+                def worker():
+                    try:
+                        scheduler.run(input_files)
+                    except Exception as ex:
+                        errors.append(ex)
+                    finally:
+                        # results of staged files come once these are committed
+                        if staging is not None:
+                            staging.wait_for_commits()
+                        # tells consumer there will be no more results
+                        collector.finished.put(None)
+
+                thread = threading.Thread(target=worker, name='Scheduler')
+                thread.daemon = True
+                thread.start()
+
+                for result in iter(collector.finished.get, None):
+                    yield result
+
+                if errors:
+                    raise errors[0]
+
+            if staging is not None:
+                failed_commits = staging.close()
+                staging = None
+                if failed_commits:
+                    raise IOError('Failed to write {} output files, i.e. "{}": {}'.format(
+                        len(failed_commits), failed_commits[0][0], failed_commits[0][1]))
+        finally:
+            # if consumer stopped early, files being processed must be finished before we close the index,
+            # but there is no point in starting any more of them
+            if thread is not None:
+                scheduler.cancel()
+                thread.join()
+            if staging is not None:
+                staging.close()
+            if metadata_index is not None:
+                metadata_index.close()
+            Api.__close_log()
@@ -18,6 +18,7 @@ from argparse import RawDescriptionHelpFormatter
 
 from mp3voicestamp_app.config import Config
 from mp3voicestamp_app.const import *
+from mp3voicestamp_app.file_scanner import FileScanner
 
 
 class Args(object):
@@ -40,18 +41,28 @@ class Args(object):
         group = parser.add_argument_group('In/Out files')
         group.add_argument(
             '-i', '--in',
-            metavar="MP3_FILE", action='store', dest="files_in", nargs='+',
-            help="On or more source MP3 files.")
+            metavar="MP3_FILE/DIR", action='store', dest="files_in", nargs='+',
+            help='On or more source MP3 files or directories to be scanned recursively. Use "-" to read from stdin.')
         group.add_argument(
             '-o', '--out',
             metavar="DIR/MP3_FILE", action='store', dest="file_out", nargs=1,
             help='Optional output file name or target directory if "-in" option used with multiple files. ' +
-                 'If not specified, file name will be generated.')
+                 'Use "-" to write to stdout. If not specified, file name will be generated.')
         group.add_argument(
             '-of', '--out-format', action='store', dest='file_out_format', nargs=1, metavar='FORMAT',
             help='Format string used to generate name of output files. ' +
                  'Default is "{}". '.format(Config.DEFAULT_FILE_OUT_FORMAT) +
                  'See docs for available placeholders.')
+        group.add_argument(
+            '--include', action='store', dest='include', nargs='+', metavar='GLOB',
+            help='When scanning directories, process only files matching any of given globs. ' +
+                 'Default is "{}".'.format(' '.join(FileScanner.DEFAULT_INCLUDE)))
+        group.add_argument(
+            '--exclude', action='store', dest='exclude', nargs='+', metavar='GLOB',
+            help='When scanning directories, skip files and directories matching any of given globs.')
+        group.add_argument(
+            '--skip-stamped', action='store_true', dest='skip_stamped',
+            help='When scanning directories, skip files which names match output file name format.')
 
         group = parser.add_argument_group('Spoken track title')
         group.add_argument(
@@ -69,6 +80,15 @@ class Args(object):
         group.add_argument(
             '-to', '--tick-offset', action='store', type=int, dest='tick_offset', nargs=1, metavar='MINUTES',
             help='Offset (in minutes) for first spoken tick. Default is {}.'.format(Config.DEFAULT_TICK_OFFSET))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--tick-interval-secs', action='store', type=int, dest='tick_interval_secs', nargs=1, metavar='SECONDS',
+            help='Interval (in seconds) between spoken ticks. Overrides --tick-interval, allowing sub-minute '
+                 'intervals.')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--tick-offset-secs', action='store', type=int, dest='tick_offset_secs', nargs=1, metavar='SECONDS',
+            help='Offset (in seconds) for first spoken tick. Overrides --tick-offset.')
         group.add_argument(
             '-ta', '--tick-add', action='store', type=int, dest='tick_add', nargs=1, metavar='MINUTES',
             help='Value (in minutes) to be added to each for spoken tick. Default is {}.'.format(
@@ -91,6 +111,65 @@ class Args(object):
             help='Speech speed in words per minute, in range from {} to {}. Default is {}.'.format(
                 Config.SPEECH_SPEED_MIN, Config.SPEECH_SPEED_MAX, Config.DEFAULT_SPEECH_SPEED))
 
+        group = parser.add_argument_group('Loudness analysis')
+        group.add_argument(
+            '--loudness', action='store', dest='loudness', nargs=1, metavar='MODE',
+            choices=Config.LOUDNESS_MODES,
+            help='How music loudness (speech volume is matched to) is calculated: "{full}" reads all samples, '.format(
+                full=Config.LOUDNESS_FULL) +
+                 '"{sampled}" decodes only evenly distributed windows of the track, '.format(
+                     sampled=Config.LOUDNESS_SAMPLED) +
+                 'which is much faster on long tracks, "{envelope}" gains each spoken segment to match '.format(
+                     envelope=Config.LOUDNESS_ENVELOPE) +
+                 'the music around it (requires NumPy). Default is "{}".'.format(Config.DEFAULT_LOUDNESS))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--loudness-windows', action='store', type=int, dest='loudness_windows', nargs=1, metavar='INTEGER',
+            help='Number of windows used by "{}" loudness mode. Default is {}.'.format(
+                Config.LOUDNESS_SAMPLED, Config.DEFAULT_LOUDNESS_WINDOWS))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--loudness-window-length', action='store', type=int, dest='loudness_window_length', nargs=1,
+            metavar='SECONDS',
+            help='Length (in seconds) of each window used by "{}" loudness mode. Default is {}.'.format(
+                Config.LOUDNESS_SAMPLED, Config.DEFAULT_LOUDNESS_WINDOW_LENGTH))
+
+        group = parser.add_argument_group('Output mode')
+        group.add_argument(
+            '-om', '--output-mode', action='store', dest='output_mode', nargs=1, metavar='MODE',
+            choices=Config.OUTPUT_MODES,
+            help='Either "{mix}" to produce MP3 with speech mixed into music, or "{overlay}" to write speech '.format(
+                mix=Config.OUTPUT_MODE_MIX, overlay=Config.OUTPUT_MODE_OVERLAY) +
+                 'overlay only, with JSON sidecar file holding the event offsets. ' +
+                 'Default is "{}".'.format(Config.DEFAULT_OUTPUT_MODE))
+        group.add_argument(
+            '--overlay-cue', action='store_true', dest='overlay_cue',
+            help='In overlay mode, additionally write CUE sheet describing speech events.')
+        group.add_argument(
+            '--overlay-chapters', action='store_true', dest='overlay_chapters',
+            help='In overlay mode, additionally write a copy of source file with speech events as ID3 chapters.')
+        group.add_argument(
+            '--pipeline', action='store', dest='pipeline', nargs=1, metavar='PIPELINE',
+            choices=Config.PIPELINES,
+            help='Processing pipeline used in "{mix}" mode: "{single}" mixes all spoken segments '.format(
+                mix=Config.OUTPUT_MODE_MIX, single=Config.PIPELINE_SINGLE_PASS) +
+                 'into music in one ffmpeg run, "{legacy}" decodes music to WAV and mixes it with '.format(
+                     legacy=Config.PIPELINE_LEGACY) +
+                 'padded speech track, "{auto}" picks one for each track, based on installed tools, '.format(
+                     auto=Config.PIPELINE_AUTO) +
+                 'size of its decoded WAV and free scratch space. ' +
+                 'Default is "{}".'.format(Config.DEFAULT_PIPELINE))
+        group.add_argument(
+            '--encoder', action='store', dest='encoder', nargs=1, metavar='PROFILE',
+            choices=Config.ENCODERS,
+            help='Encoder profile used in "{mix}" mode: "{vbr}" (MP3 VBR matching source bitrate), '.format(
+                mix=Config.OUTPUT_MODE_MIX, vbr=Config.ENCODER_VBR) +
+                 '"{fast}" (the same, with fastest LAME algorithm), "{cbr}" (MP3 CBR matching source bitrate), '.format(
+                     fast=Config.ENCODER_FAST, cbr=Config.ENCODER_CBR) +
+                 '"{archive}" (best quality MP3 VBR), "{opus}" (Opus in Ogg) or "{aac}" (AAC in M4A). '.format(
+                     archive=Config.ENCODER_ARCHIVE, opus=Config.ENCODER_OPUS, aac=Config.ENCODER_AAC) +
+                 'Default is "{}".'.format(Config.DEFAULT_ENCODER))
+
         group = parser.add_argument_group('Configuration')
         group.add_argument(
             '-c', '--config', action='store', dest='config_name', metavar='INI_FILE',
@@ -102,16 +181,118 @@ class Args(object):
             help='Name of configuration file to dump current configuration to.'
         )
 
+        group = parser.add_argument_group('Metadata index')
+        group.add_argument(
+            '--index', action='store', dest='metadata_index', metavar='DB_FILE',
+            help='Optional metadata index (SQLite database) file. If specified, metadata of files that did not '
+                 'change since last run is served from the index instead of being read from the files.')
+        group.add_argument(
+            '--reindex', action='store_true', dest='reindex',
+            help='Refreshes metadata index for all input files (in parallel) and quits. Requires "--index".')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--io-threads', action='store', type=int, dest='io_threads', nargs=1, metavar='INTEGER',
+            help='Number of threads used for parallel metadata reading. Default is {}.'.format(
+                Config.DEFAULT_IO_THREADS))
+
+        group = parser.add_argument_group('Scratch space')
+        group.add_argument(
+            '--scratch-dir', action='store', dest='scratch_dir', metavar='DIR',
+            help='Folder to create temporary files in. Default is system temp folder.')
+        group.add_argument(
+            '--scratch-tmpfs-dir', action='store', dest='scratch_tmpfs_dir', metavar='DIR',
+            help='RAM backed folder used for temporary files if these fit scratch budget. Use "" to disable. ' +
+                 'Default is "{}".'.format(Config.DEFAULT_SCRATCH_TMPFS_DIR))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--scratch-budget', action='store', type=int, dest='scratch_budget', nargs=1, metavar='MIB',
+            help='Max. estimated size (in MiB) of temporary files of single track to be kept in RAM backed ' +
+                 'folder. Use 0 to disable. Default is {}.'.format(Config.DEFAULT_SCRATCH_BUDGET))
+
+        group = parser.add_argument_group('Staging (for sources and outputs on network storage)')
+        group.add_argument(
+            '--staging-dir', action='store', dest='staging_dir', metavar='DIR',
+            help='Local folder source files are copied to (in background, ahead of processing) and output files ' +
+                 'are written to, before being copied (in background) to their destination. Disabled by default.')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--staging-prefetch', action='store', type=int, dest='staging_prefetch', nargs=1, metavar='INTEGER',
+            help='Number of source files copied ahead of the ones being processed. Use 0 to read sources ' +
+                 'directly. Default is {}.'.format(Config.DEFAULT_STAGING_PREFETCH))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--staging-bandwidth', action='store', type=int, dest='staging_bandwidth', nargs=1, metavar='KIB',
+            help='Max. transfer rate (in KiB/s) of all the copying to and from staging folder. Use 0 for no limit. ' +
+                 'Default is {}.'.format(Config.DEFAULT_STAGING_BANDWIDTH))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--staging-commit-queue', action='store', type=int, dest='staging_commit_queue', nargs=1,
+            metavar='INTEGER',
+            help='Max. number of finished files waiting to be copied to their destination. If reached, ' +
+                 'processing waits. Default is {}.'.format(Config.DEFAULT_STAGING_COMMIT_QUEUE))
+
+        group = parser.add_argument_group('Scheduling')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs', nargs=1, metavar='INTEGER',
+            help='Number of CPU cores to use. If greater than 1, processing stages of multiple files are run ' +
+                 'concurrently. Use 0 to use all the cores. Default is {}.'.format(Config.DEFAULT_JOBS))
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--memory-budget', action='store', type=int, dest='memory_budget', nargs=1, metavar='MIB',
+            help='Max. memory (in MiB) concurrently running stages can use. Default is half of available memory.')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--disk-budget', action='store', type=int, dest='disk_budget', nargs=1, metavar='MIB',
+            help='Max. size (in MiB) of temporary files of all concurrently processed files. Default is ' +
+                 'free space in scratch folder.')
+
         group = parser.add_argument_group('Misc')
         group.add_argument(
             '--dry-run', action='store_true', dest='dry_run_mode',
             help='Simulates processing of the files, printing information on how real files would be processed.')
+        group.add_argument(
+            '--estimate', action='store_true', dest='estimate_mode',
+            help='Reads metadata of all the files in parallel and reports total audio length, tick count, '
+                 'temporary disk space and output size needed and estimated processing time of the batch.')
+        group.add_argument(
+            '--cost-model', action='store', dest='cost_model', metavar='JSON_FILE',
+            help='Optional JSON file with per-stage costs overriding defaults used by "--estimate".')
+        group.add_argument(
+            '--write-plans', action='store', dest='plan_dir', metavar='DIR',
+            help='Plans processing of the files and writes render plan of each of them as JSON file to given ' +
+                 'folder, instead of processing them.')
+        group.add_argument(
+            '--run-plans', action='store_true', dest='run_plans',
+            help='Treats inputs as render plans (JSON files or directories with them) written by "--write-plans" ' +
+                 'and processes them, skipping those whose outputs are up to date.')
         group.add_argument(
             '-f', '--force', action='store_true', dest='force',
             help='Forces overwrite of existing output file.')
         group.add_argument(
             '-v', '--verbose', action='store_true', dest='verbose',
             help='Enables verbose output.')
+        group.add_argument(
+            '--progress', action='store_true', dest='progress',
+            help='Shows batch progress, throughput and ETA (weighted by audio duration) in status line on stderr.')
+        group.add_argument(
+            '--progress-file', action='store', dest='progress_file', metavar='JSON_FILE',
+            help='Periodically writes batch progress to given file as JSON.')
+        group.add_argument(
+            '--log-json', action='store', dest='log_json', metavar='FILE',
+            help='Additionally writes all log entries to given file as JSON lines. File is appended to if exists.')
+        group.add_argument(
+            '--results', action='store', dest='results_file', metavar='FILE',
+            help='Writes result of each processed file to given file as JSON line, as soon as the file is done. ' +
+                 'Use "-" to write to stdout (log is then written to stderr).')
+        group.add_argument(
+            '--metrics-file', action='store', dest='metrics_file', metavar='FILE',
+            help='Periodically writes metrics to given file in Prometheus text format (i.e. for node_exporter\'s ' +
+                 'textfile collector, which requires ".prom" extension).')
+        # noinspection PyTypeChecker
+        group.add_argument(
+            '--metrics-port', action='store', type=int, dest='metrics_port', nargs=1, metavar='PORT',
+            help='Serves metrics in Prometheus text format at http://127.0.0.1:PORT/metrics while running.')
         group.add_argument(
             '--version', action='version', version='{app} v{v} ({rd})'.format(app=APP_NAME, v=VERSION, rd=RELEASE_DATE))
 
@@ -122,6 +303,19 @@ class Args(object):
         group.add_argument(
             '-nc', '--no-cleanup', action='store_true', dest='no_cleanup',
             help='Do not remove working files and folders on exit.')
+        group.add_argument(
+            '--profile', action='store', dest='profile_dir', metavar='DIR',
+            help='Profiles the app with cProfile, writing profile of each file and merged profile of the ' +
+                 'whole batch (as .pstats files) to given folder.')
+        group.add_argument(
+            '--profile-memory', action='store_true', dest='profile_memory',
+            help='With "--profile", also writes tracemalloc snapshot at the end of each processing stage.')
+        group.add_argument(
+            '--backend', action='store', dest='backends', nargs='+', metavar='STAGE=BACKEND',
+            help='Backend doing audio work of given stage ({stages}): "{subprocess}" (default) runs external '.format(
+                stages=', '.join(Config.BACKEND_STAGES), subprocess=Config.BACKEND_SUBPROCESS) +
+                 'tools, "{fake}" only pretends to, in-process, to benchmark or test orchestration alone.'.format(
+                     fake=Config.BACKEND_FAKE))
 
         # this trick is to enforce stacktrace in case parse_args() fail (which should normally not happen)
         old_config_debug = config.debug
@@ -140,8 +334,26 @@ class Args(object):
 
         config.force_overwrite = args.force
         config.dry_run_mode = args.dry_run_mode
+        config.estimate_mode = args.estimate_mode
+        config.cost_model = args.cost_model
+        config.plan_dir = args.plan_dir
+        config.run_plans = args.run_plans
+        if config.plan_dir is not None and config.run_plans:
+            raise ValueError('"--write-plans" and "--run-plans" cannot be combined.')
+        config.log_json = args.log_json
+        config.results_file = args.results_file
+        config.progress = args.progress
+        config.progress_file = args.progress_file
+        config.metrics_file = args.metrics_file
+        config.metrics_port = args.metrics_port
         config.debug = args.debug
         config.no_cleanup = args.no_cleanup
+        config.profile_dir = args.profile_dir
+        config.profile_memory = args.profile_memory
+        if config.profile_memory and config.profile_dir is None:
+            raise ValueError('You must specify profile folder with "--profile" to use "--profile-memory".')
+        if args.backends is not None:
+            config.backends = args.backends
         config.verbose = args.verbose
 
         config.speech_volume_factor = args.speech_volume_factor
@@ -151,9 +363,44 @@ class Args(object):
         config.tick_offset = args.tick_offset
         config.tick_format = args.tick_format
         config.tick_add = args.tick_add
+        if args.tick_interval_secs is not None:
+            config.tick_interval_secs = args.tick_interval_secs
+        if args.tick_offset_secs is not None:
+            config.tick_offset_secs = args.tick_offset_secs
 
         config.title_format = args.title_format
 
+        if args.metadata_index is not None:
+            config.metadata_index = args.metadata_index
+        config.reindex = args.reindex
+        config.io_threads = args.io_threads
+
+        if args.scratch_dir is not None:
+            config.scratch_dir = args.scratch_dir
+        config.scratch_tmpfs_dir = args.scratch_tmpfs_dir
+        config.scratch_budget = args.scratch_budget
+
+        if args.staging_dir is not None:
+            config.staging_dir = args.staging_dir
+        config.staging_prefetch = args.staging_prefetch
+        config.staging_bandwidth = args.staging_bandwidth
+        config.staging_commit_queue = args.staging_commit_queue
+
+        config.jobs = args.jobs
+        config.memory_budget = args.memory_budget
+        config.disk_budget = args.disk_budget
+        if config.reindex and config.metadata_index is None:
+            raise ValueError('You must specify metadata index file with "--index" to use "--reindex".')
+
+        config.output_mode = args.output_mode
+        config.overlay_cue = args.overlay_cue
+        config.overlay_chapters = args.overlay_chapters
+        config.pipeline = args.pipeline
+        config.encoder = args.encoder
+        config.loudness = args.loudness
+        config.loudness_windows = args.loudness_windows
+        config.loudness_window_length = args.loudness_window_length
+
         # we also support globing (as Windows' cmd is lame as usual)
         config.files_in = []
         # ./mp3vs -i mp3/Olga\ Misty\ -\ Ocean\ Planet\ 086\ Part\ 1\ \[2018-08-06\]\ on\ Proton\ Radio.mp3
@@ -166,4 +413,19 @@ class Args(object):
         config.file_out = args.file_out
         config.file_out_format = args.file_out_format
 
+        if '-' in config.files_in and (config.plan_dir is not None or config.run_plans):
+            raise ValueError('Render plans cannot be used when reading from stdin ("-").')
+        if '-' in config.files_in and len(config.files_in) > 1:
+            raise ValueError('Reading from stdin ("-") cannot be combined with other inputs.')
+        if config.files_in == ['-'] and config.file_out is None:
+            raise ValueError('Output file name or "-" (stdout) must be specified when reading from stdin.')
+        if config.file_out == '-' and config.results_file == '-':
+            raise ValueError('Results cannot be written to stdout when it is used for output file.')
+        if config.file_out == '-' and config.output_mode == Config.OUTPUT_MODE_OVERLAY:
+            raise ValueError('Overlay output mode cannot write to stdout.')
+
+        config.include = args.include
+        config.exclude = args.exclude
+        config.skip_stamped = args.skip_stamped
+
         return args
@@ -15,17 +15,88 @@
 
 from __future__ import print_function
 
+import math
+import os
 import re
+import sys
+import tempfile
+import wave
 
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.loudness_envelope import LoudnessEnvelope
+from mp3voicestamp_app.pcm_buffer import PcmBuffer
+from mp3voicestamp_app.scratch import Scratch
+from mp3voicestamp_app.stage_backend import StageBackend
 from mp3voicestamp_app.util import Util
 from mp3voicestamp_app.tools import Tools
 
 
-class Audio(object):
+class Audio(StageBackend):
+    """Stage backend doing all the audio work with external tools: espeak, ffmpeg, sox and normalize
+    """
+
+    NAME = Config.BACKEND_SUBPROCESS
+
+    # speech-only overlay is mono and encoded with low, constant bitrate as it is all we need for voice
+    OVERLAY_BITRATE = '48k'
+
+    # format sampled windows are decoded to, so each window's size in bytes is known upfront
+    SAMPLING_RATE = 44100
+    SAMPLING_CHANNELS = 2
+    SAMPLE_WIDTH = 2
+
+    # z-score of reported error bound, 1.96 stands for 95% confidence
+    ERROR_CONFIDENCE_Z = 1.96
 
     def __init__(self, tools):
         self.__tools = tools
 
+    def has_capability(self, cap):
+        return self.__tools.has_capability(cap)
+
+    # *****************************************************************************************************************
+
+    def speak_to_wav(self, text, wav_file, speed, no_cleanup=False):
+        text_tmp_file = os.path.splitext(wav_file)[0] + '.txt'
+        with open(text_tmp_file, 'wb+') as fh:
+            fh.write(text.encode('utf-8') if not isinstance(text, bytes) else text)
+
+        rc = Util.execute_rc([self.__tools.get_tool(Tools.KEY_ESPEAK),
+                              '-s', str(speed),
+                              '-z',
+                              '-w', wav_file,
+                              '-f', text_tmp_file])
+        # text is kept for troubleshooting if espeak failed
+        if rc == 0 and not no_cleanup:
+            os.remove(text_tmp_file)
+
+        return rc == 0
+
+    # *****************************************************************************************************************
+
+    def decode_to_wav(self, file_name, wav_file, input_data=None, envelope=False):
+        """Converts source audio track to WAV format
+
+        convert source mp3 to wav. this is required for many reasons:
+        * we need to adjust voice overlay amplitude to match MP3 file level and to do that we use "sox" too
+          which cannot deal with MP3 directly.
+        * there are some odd issues with "ffmpeg" failing during mixing phase when source is mp3 file.
+          blind guess for now is that it's due to some structure mismatch between MP3 file (i.e. having cover
+          image) and speech segments being just plain WAV. Most likely this can be solved better way but we
+          need WAV anyway so no point wasting time at the moment for further research.
+        """
+        if envelope:
+            # envelope is calculated from the same decoding run
+            return self.calculate_loudness_envelope(file_name, input_data, wav_file)
+
+        wav_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y', '-i', file_name, wav_file]
+        if Util.execute_rc(wav_cmd, input_data=input_data) != 0:
+            raise RuntimeError('Failed to convert to WAV file')
+
+        return None
+
+    # *****************************************************************************************************************
+
     def calculate_rms_amplitude(self, wav_file):
         """Calls SOX to get the RMS amplitude of WAV file
 
@@ -45,35 +116,364 @@ class Audio(object):
                        in range(0, len(err))}
         return float(sox_results['rms_amplitude'])
 
+    def calculate_rms_amplitude_of_file(self, file_name, input_data=None):
+        """Calls ffmpeg's "astats" filter to get RMS amplitude of any supported audio file (i.e. MP3)
+        without the need of decoding it to intermediate WAV file first.
+
+        Args:
+            :file_name file name or "pipe:0" if content is given as input_data
+            :input_data optional content of the file to be fed to ffmpeg
+
+        Returns:
+            float
+        """
+        stats_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-hide_banner', '-nostats',
+                     '-i', file_name,
+                     '-af', 'astats=metadata=0',
+                     '-f', 'null', '-']
+        rc, _, err = Util.execute(stats_cmd, input_data=input_data)
+        if rc != 0:
+            raise RuntimeError('Failed to calculate RMS amplitude of "{}"'.format(file_name))
+
+        # astats reports per channel values first, followed by "Overall" section which is what we are after
+        overall_found = False
+        for line in err:
+            if not overall_found:
+                overall_found = line.strip().endswith('Overall')
+                continue
+
+            if 'RMS level dB:' in line:
+                rms_db = line.split(':')[-1].strip()
+                if rms_db in ['-inf', 'inf', 'nan']:
+                    return 0.0
+                return math.pow(10, float(rms_db) / 20)
+
+        raise RuntimeError('Unable to find RMS level in stats of "{}"'.format(file_name))
+
+    @staticmethod
+    def get_window_starts(duration, windows, window_length):
+        """Returns start offsets (in seconds) of given number of windows, evenly distributed over the track
+
+        Args:
+            :duration track duration in seconds
+            :windows number of windows
+            :window_length in seconds
+        """
+        step = float(duration) / windows
+        return [max(0.0, min(duration - window_length, step * (idx + 0.5) - window_length / 2.0))
+                for idx in range(windows)]
+
+    def calculate_sampled_rms_amplitude(self, file_name, duration, windows, window_length, buffer=None):
+        """Estimates RMS amplitude of audio file from evenly distributed windows instead of all samples.
+        Input seeking makes ffmpeg jump to the MP3 frame the window starts in, so only the windows are
+        decoded, all in single ffmpeg run.
+
+        Error is estimated from the spread of windows' mean squares (standard error of the mean, with finite
+        population correction), as 95% confidence bound of the resulting level in dB.
+
+        Args:
+            :file_name
+            :duration track duration in seconds
+            :windows number of windows
+            :window_length window length in seconds
+            :buffer optional PcmBuffer windows are to be decoded to. If not given, temporary one is used
+
+        Returns:
+            tuple (RMS amplitude, estimated error in dB)
+        """
+        starts = self.get_window_starts(duration, windows, window_length)
+
+        sample_format = 's16le' if sys.byteorder == 'little' else 's16be'
+        cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-hide_banner', '-nostats']
+        filters = []
+        concat_inputs = ''
+        for idx, start in enumerate(starts):
+            cmd.extend(['-ss', '{:.3f}'.format(start), '-t', str(window_length), '-i', file_name])
+            filters.append('[{}:a]aformat=sample_fmts=s16:sample_rates={}:channel_layouts=stereo[w{}]'.format(
+                idx, self.SAMPLING_RATE, idx))
+            concat_inputs += '[w{}]'.format(idx)
+        filters.append('{}concat=n={}:v=0:a=1[out]'.format(concat_inputs, len(starts)))
+        cmd.extend(['-filter_complex', ';'.join(filters), '-map', '[out]',
+                    '-f', sample_format, '-c:a', 'pcm_' + sample_format, 'pipe:1'])
+
+        own_buffer = buffer is None
+        if own_buffer:
+            fd, tmp_file = tempfile.mkstemp(suffix='.pcm')
+            os.close(fd)
+            buffer = PcmBuffer(tmp_file)
+
+        try:
+            with buffer.open_for_writing() as fh:
+                rc = Util.execute_rc(cmd, stdout=fh)
+            if rc != 0:
+                raise RuntimeError('Failed to decode sampled windows of "{}"'.format(file_name))
+            buffer.map()
+
+            # split decoded audio into per-window chunks, aligned to whole frames
+            frame_size = self.SAMPLING_CHANNELS * self.SAMPLE_WIDTH
+            chunk_size = (len(buffer) // len(starts)) // frame_size * frame_size
+            if chunk_size == 0:
+                raise RuntimeError('No audio decoded from sampled windows of "{}"'.format(file_name))
+            mean_squares = [buffer.get_mean_square(idx * chunk_size, (idx + 1) * chunk_size)
+                            for idx in range(len(starts))]
+        finally:
+            if own_buffer:
+                buffer.close()
+
+        mean = sum(mean_squares) / len(mean_squares)
+        if mean == 0:
+            return 0.0, 0.0
+
+        if len(mean_squares) < 2:
+            return math.sqrt(mean), 0.0
+
+        variance = sum((val - mean) ** 2 for val in mean_squares) / (len(mean_squares) - 1)
+        sampled_share = min(1.0, len(starts) * window_length / float(duration))
+        standard_error = math.sqrt(variance / len(mean_squares) * (1 - sampled_share))
+
+        # level of mean square in dB is 10 * log10(), which is the same as 20 * log10() of RMS
+        error_db = 10 * math.log10(1 + self.ERROR_CONFIDENCE_Z * standard_error / mean)
+
+        return math.sqrt(mean), error_db
+
+    def calculate_loudness_envelope(self, file_name, input_data=None, wav_file=None):
+        """Decodes audio file and calculates its loudness envelope from decoded PCM stream, as it is produced.
+        If wav_file is given, the same ffmpeg run writes decoded WAV too, so envelope costs no extra pass over
+        the audio.
+
+        Args:
+            :file_name file name or "pipe:0" if content is given as input_data
+            :input_data optional content of the file to be fed to ffmpeg
+            :wav_file optional name of WAV file to decode the track to
+
+        Returns:
+            LoudnessEnvelope
+        """
+        envelope = LoudnessEnvelope(self.SAMPLING_RATE, self.SAMPLING_CHANNELS)
+
+        sample_format = 's16le' if sys.byteorder == 'little' else 's16be'
+        cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-hide_banner', '-nostats', '-y', '-i', file_name]
+        if wav_file is not None:
+            cmd.extend(['-map', '0:a', '-c:a', 'pcm_s16le', wav_file])
+        cmd.extend(['-map', '0:a', '-ac', str(self.SAMPLING_CHANNELS), '-ar', str(self.SAMPLING_RATE),
+                    '-f', sample_format, '-c:a', 'pcm_' + sample_format, 'pipe:1'])
+
+        if Util.execute_streamed(cmd, envelope.add, input_data) != 0:
+            raise RuntimeError('Failed to calculate loudness envelope of "{}"'.format(file_name))
+        envelope.finish()
+
+        return envelope
+
+    @staticmethod
+    def get_wav_duration(wav_file):
+        """Returns duration (in seconds) of given WAV file
+
+        Args:
+            :wav_file
+
+        Returns:
+            float
+        """
+        wav = wave.open(wav_file, 'rb')
+        duration = float(wav.getnframes()) / wav.getframerate()
+        wav.close()
+
+        return duration
+
+    def concat_wav_files(self, file_out, wav_files):
+        """Joins given WAV files one after another, without any padding
+
+        Args:
+            :file_out
+            :wav_files list of WAV files to join
+        """
+        concat_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y']
+        _ = [concat_cmd.extend(['-i', wav]) for wav in wav_files]
+
+        inputs = ''.join(['[{}]'.format(idx) for idx in range(len(wav_files))])
+        concat_cmd.extend([
+            '-filter_complex', '{}concat=n={}:v=0:a=1'.format(inputs, len(wav_files)),
+            '-c:a', 'pcm_s16le',
+            file_out])
+        if Util.execute_rc(concat_cmd) != 0:
+            raise RuntimeError('Failed to join voice segments')
+
+    def concat_padded_wav_files(self, file_out, wav_files, lengths):
+        # we need to get the frequency of speech waveform generated by espeak to later be able to tell
+        # ffmpeg how to pad/clip the part
+        wav = wave.open(wav_files[0], 'rb')
+        speech_frame_rate = wav.getframerate()
+        wav.close()
+
+        # merge voice overlay segments into one file with needed padding
+        concat_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y']
+        filter_complex = ''
+        filter_complex_concat = ';'
+        separator = ''
+
+        for idx, (wav_file, length) in enumerate(zip(wav_files, lengths)):
+            concat_cmd.extend(['-i', wav_file])
+
+            # samples = rate_per_second * length_in_seconds
+            max_len = int(speech_frame_rate * length)
+            # http://ffmpeg.org/ffmpeg-filters.html#Filtergraph-description
+            filter_complex += '{}[{}]apad=whole_len={}[g{}]'.format(separator, idx, max_len, idx)
+            separator = ';'
+
+            filter_complex_concat += '[g{}]'.format(idx)
+
+        filter_complex_concat += 'concat=n={}:v=0:a=1'.format(len(wav_files))
+
+        concat_cmd.extend(['-filter_complex', filter_complex + filter_complex_concat])
+        # keep speech in its native, compact format: mono, 16 bit at espeak's sample rate
+        concat_cmd.extend(['-ac', str(Scratch.SPEECH_CHANNELS), '-ar', str(speech_frame_rate),
+                           '-c:a', Scratch.WAV_CODEC])
+        concat_cmd.append(file_out)
+
+        if Util.execute_rc(concat_cmd) != 0:
+            raise RuntimeError('Failed to merge voice segments')
+
+    def encode_overlay(self, wav_file, file_out):
+        """Encodes speech overlay WAV into compact mono MP3 file
+
+        Args:
+            :wav_file
+            :file_out
+        """
+        encode_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y',
+                      '-i', wav_file,
+                      '-ac', '1',
+                      '-c:a', 'libmp3lame',
+                      '-b:a', self.OVERLAY_BITRATE,
+                      '-f', 'mp3',
+                      file_out]
+        if Util.execute_rc(encode_cmd) != 0:
+            raise RuntimeError('Failed to encode speech overlay file')
+
     def adjust_wav_amplitude(self, wav_file, rms_amplitude):
         """Calls normalize-audio to adjust amplitude of WAV file
 
         Args:
-            :wav_file
+            :wav_file WAV file name or list of WAV files, each adjusted separately
             :rms_amplitude
         """
         if rms_amplitude > 1.0:
             rms_amplitude = 1.0
 
-        voice_gain_cmd = [self.__tools.get_tool(Tools.KEY_NORMALIZE), '-a', str(rms_amplitude), wav_file]
+        wav_files = wav_file if isinstance(wav_file, list) else [wav_file]
+        voice_gain_cmd = [self.__tools.get_tool(Tools.KEY_NORMALIZE), '-a', str(rms_amplitude)] + wav_files
         if Util.execute_rc(voice_gain_cmd) != 0:
             raise RuntimeError('Failed to adjust voice overlay volume')
 
-    def mix_wav_tracks(self, file_out, encoding_quality, wav_files):
+    def mix_wav_tracks(self, file_out, output_args, wav_files, metadata_args=None, stdout=None,
+                       metadata_input=None, input_data=None):
         """Mixes given WAV tracks together
 
         Args:
-            :file_out
-            :encoding_quality LAME encoder quality parameter
+            :file_out output file name or "-" to write to stdout
+            :output_args ffmpeg's codec and format arguments (see Encoder.get_output_args())
             :wav_files list of WAV files to mix
+            :metadata_args optional list of tagging arguments (see Mp3FileInfo.get_ffmpeg_metadata_args())
+            :stdout file object to write to if file_out is "-"
+            :metadata_input optional file name (or "pipe:0") added as last input. It is not mixed, only
+                            referred by metadata_args, to copy its tags and cover art from
+            :input_data optional content of metadata_input to be fed to ffmpeg
         """
         merge_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y']
         _ = [merge_cmd.extend(['-i', wav]) for wav in wav_files]
+        if metadata_input is not None:
+            merge_cmd.extend(['-i', metadata_input])
+        mix_inputs = ''.join('[{}:a]'.format(idx) for idx in range(len(wav_files)))
         merge_cmd.extend([
-            '-filter_complex', 'amerge',
-            '-ac', '2',
-            '-c:a', 'libmp3lame',
-            '-q:a', str(encoding_quality),
-            file_out])
-        if Util.execute_rc(merge_cmd) != 0:
-            raise RuntimeError('Failed to create final MP3 file')
+            '-filter_complex', '{}amerge=inputs={}[mix]'.format(mix_inputs, len(wav_files)),
+            '-map', '[mix]',
+            '-ac', '2'])
+        merge_cmd.extend(output_args)
+        if metadata_args:
+            merge_cmd.extend(metadata_args)
+        merge_cmd.append('pipe:1' if file_out == '-' else file_out)
+        if Util.execute_rc(merge_cmd, input_data=input_data, stdout=stdout if file_out == '-' else None) != 0:
+            raise RuntimeError('Failed to create final audio file')
+
+    @staticmethod
+    def __write_clip_list(clips):
+        """Writes ffmpeg concat demuxer script playing given clips one after another, each starting at its
+        offset, next to the first clip. Gaps between clips are left in timestamps only, to be filled with silence
+        by "aresample".
+
+        Args:
+            :clips iterable of tuples (WAV file name, offset in seconds), in offset order
+
+        Returns:
+            tuple (script file name, offset of the first clip in seconds)
+        """
+        clips = iter(clips)
+        try:
+            clip_file, first_offset = next(clips)
+        except StopIteration:
+            raise RuntimeError('No speech clips to mix')
+
+        list_file = os.path.join(os.path.dirname(os.path.abspath(clip_file)), 'clips.ffconcat')
+        with open(list_file, 'w') as fh:
+            fh.write('ffconcat version 1.0\n')
+            last_offset = first_offset
+            while True:
+                fh.write("file '{}'\n".format(os.path.abspath(clip_file).replace("'", "'\\''")))
+                try:
+                    clip_file, offset = next(clips)
+                except StopIteration:
+                    break
+                # clip lasts until the next one starts
+                fh.write('duration {:.3f}\n'.format(offset - last_offset))
+                last_offset = offset
+
+        return list_file, first_offset
+
+    def mix_speech_clips(self, file_out, music_input, output_args, clips, metadata_args=None,
+                         input_data=None, stdout=None):
+        """Mixes spoken clips into music track in single ffmpeg run. Clips are played one after another by
+        concat demuxer, with gaps between them filled with silence, and mixed directly into encoder input, so
+        neither music nor padded speech track is ever written to disk as WAV and ffmpeg has just two inputs, no
+        matter how many clips there are. Speech is mixed the same way mix_wav_tracks() does it, so levels of
+        both pipelines match.
+
+        Args:
+            :file_out output file name or "-" to write to stdout
+            :music_input music file name or "pipe:0" if content is given as input_data
+            :output_args ffmpeg's codec and format arguments (see Encoder.get_output_args())
+            :clips iterable of tuples (WAV file name, offset in seconds), in offset order
+            :metadata_args optional list of tagging arguments (see Mp3FileInfo.get_ffmpeg_metadata_args())
+            :input_data optional content of the music file to be fed to ffmpeg
+            :stdout file object to write to if file_out is "-"
+        """
+        list_file, first_offset = self.__write_clip_list(clips)
+
+        mix_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y',
+                   '-i', music_input,
+                   '-f', 'concat', '-safe', '0', '-i', list_file]
+
+        # gaps are filled with silence, then whole speech track is delayed to the first clip's offset
+        speech = '[1]aresample=async=1:first_pts=0'
+        delay_ms = int(round(first_offset * 1000))
+        if delay_ms > 0:
+            # older ffmpeg has no "all" option, so delay is given per channel (extra values are ignored)
+            adelay_all = self.__tools.has_capability(Tools.CAP_FFMPEG_ADELAY_ALL)
+            speech += ',adelay={}'.format('delays={}:all=1'.format(delay_ms) if adelay_all
+                                          else '{0}|{0}'.format(delay_ms))
+        filters = [
+            # speech is padded with silence past the last clip, so output is as long as the music
+            speech + ',apad[speech]',
+            # speech goes to its own channel and "-ac 2" downmixes it, exactly as legacy pipeline does
+            '[0][speech]amerge=inputs=2[mix]',
+        ]
+
+        mix_cmd.extend([
+            '-filter_complex', ';'.join(filters),
+            '-map', '[mix]',
+            '-ac', '2'])
+        mix_cmd.extend(output_args)
+        if metadata_args:
+            mix_cmd.extend(metadata_args)
+        mix_cmd.append('pipe:1' if file_out == '-' else file_out)
+        if Util.execute_rc(mix_cmd, input_data=input_data, stdout=stdout if file_out == '-' else None) != 0:
+            raise RuntimeError('Failed to create final audio file')
@@ -0,0 +1,60 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+from mp3voicestamp_app.audio import Audio
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.fake_audio import FakeAudio
+
+
+class Backends(object):
+    """Stage backends (see StageBackend) used by the job, as configured for each stage
+    """
+
+    CLASSES = {
+        Config.BACKEND_SUBPROCESS: Audio,
+        Config.BACKEND_FAKE: FakeAudio,
+    }
+
+    def __init__(self, config, tools):
+        """
+        Args:
+            :config
+            :tools
+        """
+        self.__backends = {}
+
+        # stages configured to use the same backend share its instance
+        instances = {}
+        for stage in Config.BACKEND_STAGES:
+            name = config.get_backend(stage)
+            if name not in instances:
+                instances[name] = self.CLASSES[name](tools)
+            self.__backends[stage] = instances[name]
+
+    def get(self, stage):
+        """Returns backend to be used by given stage (Config.BACKEND_STAGE_xxx)
+
+        Returns:
+            StageBackend
+        """
+        return self.__backends[stage]
+
+    @staticmethod
+    def needs_tools(config):
+        """Tells if any of configured backends runs external tools, which then must be checked first
+        """
+        return any(Backends.CLASSES[config.get_backend(stage)].needs_tools() for stage in Config.BACKEND_STAGES)
@@ -13,12 +13,14 @@
 
 """
 
-# noinspection PyCompatibility
-from past.builtins import basestring
-from backports import configparser
-
 import os
 
+try:
+    # noinspection PyCompatibility
+    basestring
+except NameError:
+    basestring = str
+
 from mp3voicestamp_app.const import *
 
 
@@ -38,6 +40,78 @@ class Config(object):
     SPEECH_SPEED_MIN = 80
     SPEECH_SPEED_MAX = 450
 
+    OUTPUT_MODE_MIX = 'mix'
+    OUTPUT_MODE_OVERLAY = 'overlay'
+    OUTPUT_MODES = [OUTPUT_MODE_MIX, OUTPUT_MODE_OVERLAY]
+
+    DEFAULT_OUTPUT_MODE = OUTPUT_MODE_MIX
+
+    # "auto" picks the fastest pipeline installed tools support
+    PIPELINE_AUTO = 'auto'
+    PIPELINE_SINGLE_PASS = 'single-pass'
+    PIPELINE_LEGACY = 'legacy'
+    PIPELINES = [PIPELINE_AUTO, PIPELINE_SINGLE_PASS, PIPELINE_LEGACY]
+
+    DEFAULT_PIPELINE = PIPELINE_AUTO
+
+    # output encoder profiles, see Encoder for details. "vbr" picks LAME VBR quality matching source bitrate
+    ENCODER_VBR = 'vbr'
+    ENCODER_FAST = 'fast'
+    ENCODER_CBR = 'cbr'
+    ENCODER_ARCHIVE = 'archive'
+    ENCODER_OPUS = 'opus'
+    ENCODER_AAC = 'aac'
+    ENCODERS = [ENCODER_VBR, ENCODER_FAST, ENCODER_CBR, ENCODER_ARCHIVE, ENCODER_OPUS, ENCODER_AAC]
+
+    DEFAULT_ENCODER = ENCODER_VBR
+
+    # how music loudness (speech gain is based on) is calculated: from all samples, from sampled windows or
+    # as short-term envelope, so each spoken segment is gained to match the music around it
+    LOUDNESS_FULL = 'full'
+    LOUDNESS_SAMPLED = 'sampled'
+    LOUDNESS_ENVELOPE = 'envelope'
+    LOUDNESS_MODES = [LOUDNESS_FULL, LOUDNESS_SAMPLED, LOUDNESS_ENVELOPE]
+
+    DEFAULT_LOUDNESS = LOUDNESS_FULL
+    DEFAULT_LOUDNESS_WINDOWS = 16
+    # in seconds
+    DEFAULT_LOUDNESS_WINDOW_LENGTH = 3
+    # at least two windows are needed to estimate the error
+    LOUDNESS_WINDOWS_MIN = 2
+
+    # stages which backend doing the audio work can be configured for, and available backends: real one,
+    # running external tools, and in-process fake one, useful for benchmarking and testing orchestration
+    BACKEND_STAGE_SYNTHESIZE = 'synthesize'
+    BACKEND_STAGE_DECODE = 'decode'
+    BACKEND_STAGE_ANALYZE = 'analyze'
+    BACKEND_STAGE_MIX = 'mix'
+    BACKEND_STAGES = [BACKEND_STAGE_SYNTHESIZE, BACKEND_STAGE_DECODE, BACKEND_STAGE_ANALYZE, BACKEND_STAGE_MIX]
+
+    BACKEND_SUBPROCESS = 'subprocess'
+    BACKEND_FAKE = 'fake'
+    BACKENDS = [BACKEND_SUBPROCESS, BACKEND_FAKE]
+
+    DEFAULT_BACKEND = BACKEND_SUBPROCESS
+
+    DEFAULT_IO_THREADS = 8
+
+    DEFAULT_SCRATCH_TMPFS_DIR = '/dev/shm'
+    # in MiB
+    DEFAULT_SCRATCH_BUDGET = 512
+
+    # number of input files copied to staging folder ahead of the one being processed
+    DEFAULT_STAGING_PREFETCH = 2
+    # in KiB/s, 0 stands for "unlimited"
+    DEFAULT_STAGING_BANDWIDTH = 0
+    # number of finished output files waiting to be copied to their destination before jobs must wait
+    DEFAULT_STAGING_COMMIT_QUEUE = 4
+
+    # 0 stands for number of CPU cores
+    DEFAULT_JOBS = 1
+    # in MiB, 0 stands for "auto"
+    DEFAULT_MEMORY_BUDGET = 0
+    DEFAULT_DISK_BUDGET = 0
+
     # *****************************************************************************************************************
 
     INI_SECTION_NAME = 'mp3voicestamp'
@@ -55,6 +129,31 @@ class Config(object):
     INI_KEY_TICK_OFFSET = 'tick_offset'
     INI_KEY_TICK_INTERVAL = 'tick_interval'
     INI_KEY_TICK_ADD = 'tick_add'
+    INI_KEY_TICK_INTERVAL_SECS = 'tick_interval_secs'
+    INI_KEY_TICK_OFFSET_SECS = 'tick_offset_secs'
+
+    INI_KEY_OUTPUT_MODE = 'output_mode'
+    INI_KEY_PIPELINE = 'pipeline'
+    INI_KEY_ENCODER = 'encoder'
+
+    INI_KEY_LOUDNESS = 'loudness'
+    INI_KEY_LOUDNESS_WINDOWS = 'loudness_windows'
+    INI_KEY_LOUDNESS_WINDOW_LENGTH = 'loudness_window_length'
+
+    INI_KEY_METADATA_INDEX = 'metadata_index'
+
+    INI_KEY_SCRATCH_DIR = 'scratch_dir'
+    INI_KEY_SCRATCH_TMPFS_DIR = 'scratch_tmpfs_dir'
+    INI_KEY_SCRATCH_BUDGET = 'scratch_budget'
+
+    INI_KEY_STAGING_DIR = 'staging_dir'
+    INI_KEY_STAGING_PREFETCH = 'staging_prefetch'
+    INI_KEY_STAGING_BANDWIDTH = 'staging_bandwidth'
+    INI_KEY_STAGING_COMMIT_QUEUE = 'staging_commit_queue'
+
+    INI_KEY_JOBS = 'jobs'
+
+    INI_KEY_BACKENDS = 'backends'
 
     # *****************************************************************************************************************
 
@@ -63,9 +162,21 @@ class Config(object):
 
         self.force_overwrite = False
         self.dry_run_mode = False
+        self.estimate_mode = False
+        self.cost_model = None
+        self.plan_dir = None
+        self.run_plans = False
         self.debug = False
         self.no_cleanup = False
+        self.profile_dir = None
+        self.profile_memory = False
         self.verbose = False
+        self.log_json = None
+        self.results_file = None
+        self.progress = False
+        self.progress_file = None
+        self.metrics_file = None
+        self.metrics_port = None
 
         self.speech_speed = Config.DEFAULT_SPEECH_SPEED
         self.speech_volume_factor = Config.DEFAULT_SPEECH_VOLUME_FACTOR
@@ -74,14 +185,50 @@ class Config(object):
         self.tick_interval = Config.DEFAULT_TICK_INTERVAL
         self.tick_offset = Config.DEFAULT_TICK_OFFSET
         self.tick_add = Config.DEFAULT_TICK_ADD
+        self.tick_interval_secs = None
+        self.tick_offset_secs = None
 
         self.title_format = Config.DEFAULT_TITLE_FORMAT
 
         self.files_in = []
         self.file_out = None
 
+        self.include = None
+        self.exclude = None
+        self.skip_stamped = False
+
         self.file_out_format = Config.DEFAULT_FILE_OUT_FORMAT
 
+        self.output_mode = Config.DEFAULT_OUTPUT_MODE
+        self.overlay_cue = False
+        self.overlay_chapters = False
+
+        self.pipeline = Config.DEFAULT_PIPELINE
+        self.encoder = Config.DEFAULT_ENCODER
+
+        self.loudness = Config.DEFAULT_LOUDNESS
+        self.loudness_windows = Config.DEFAULT_LOUDNESS_WINDOWS
+        self.loudness_window_length = Config.DEFAULT_LOUDNESS_WINDOW_LENGTH
+
+        self.backends = {}
+
+        self.metadata_index = None
+        self.reindex = False
+        self.io_threads = Config.DEFAULT_IO_THREADS
+
+        self.scratch_dir = None
+        self.scratch_tmpfs_dir = Config.DEFAULT_SCRATCH_TMPFS_DIR
+        self.scratch_budget = Config.DEFAULT_SCRATCH_BUDGET
+
+        self.staging_dir = None
+        self.staging_prefetch = Config.DEFAULT_STAGING_PREFETCH
+        self.staging_bandwidth = Config.DEFAULT_STAGING_BANDWIDTH
+        self.staging_commit_queue = Config.DEFAULT_STAGING_COMMIT_QUEUE
+
+        self.jobs = Config.DEFAULT_JOBS
+        self.memory_budget = Config.DEFAULT_MEMORY_BUDGET
+        self.disk_budget = Config.DEFAULT_DISK_BUDGET
+
     # *****************************************************************************************************************
 
     @property
@@ -188,6 +335,30 @@ class Config(object):
 
             self.__tick_value_offset = value
 
+    @property
+    def tick_interval_secs(self):
+        return self.__tick_interval_secs
+
+    @tick_interval_secs.setter
+    def tick_interval_secs(self, value):
+        # None means tick_interval (in minutes) is used
+        value = Config.__get_as_int(value)
+        if value is not None and value < 1:
+            raise ValueError('Tick interval value cannot be shorter than 1 second')
+        self.__tick_interval_secs = value
+
+    @property
+    def tick_offset_secs(self):
+        return self.__tick_offset_secs
+
+    @tick_offset_secs.setter
+    def tick_offset_secs(self, value):
+        # None means tick_offset (in minutes) is used
+        value = Config.__get_as_int(value)
+        if value is not None and value < 1:
+            raise ValueError('Tick offset value cannot be lower than 1 second')
+        self.__tick_offset_secs = value
+
     # *****************************************************************************************************************
 
     @property
@@ -250,6 +421,12 @@ class Config(object):
         if value is not None:
             self.__files_in = value
 
+    def is_batch_mode(self):
+        """Returns True if more than one file is to be processed, either because multiple inputs were given
+        or any of the inputs is a directory to be scanned.
+        """
+        return len(self.__files_in) > 1 or any(os.path.isdir(file_in) for file_in in self.__files_in)
+
     # *****************************************************************************************************************
 
     @property
@@ -260,7 +437,7 @@ class Config(object):
     def file_out(self, file_out):
         file_out = Config.__get_as_string(file_out, False)
         if file_out is not None:
-            if len(self.__files_in) > 1 and file_out is not None and not os.path.isdir(file_out):
+            if self.is_batch_mode() and not os.path.isdir(file_out):
                 raise ValueError('For multiple inputs, target must point to a directory')
 
         self.__file_out = file_out
@@ -279,6 +456,300 @@ class Config(object):
 
     # *****************************************************************************************************************
 
+    @property
+    def output_mode(self):
+        return self.__output_mode
+
+    @output_mode.setter
+    def output_mode(self, value):
+        value = Config.__get_as_string(value)
+        if value is not None:
+            value = value.lower()
+            if value not in Config.OUTPUT_MODES:
+                raise ValueError('Unknown output mode "{}". Supported modes: {}'.format(
+                    value, ', '.join(Config.OUTPUT_MODES)))
+            self.__output_mode = value
+
+    @property
+    def pipeline(self):
+        return self.__pipeline
+
+    @pipeline.setter
+    def pipeline(self, value):
+        value = Config.__get_as_string(value)
+        if value is not None:
+            value = value.lower()
+            if value not in Config.PIPELINES:
+                raise ValueError('Unknown pipeline "{}". Supported pipelines: {}'.format(
+                    value, ', '.join(Config.PIPELINES)))
+            self.__pipeline = value
+
+    @property
+    def backends(self):
+        """Backend names (Config.BACKEND_xxx) configured for stages (Config.BACKEND_STAGE_xxx). Stages not
+        listed use DEFAULT_BACKEND.
+
+        Returns:
+            dict
+        """
+        return self.__backends
+
+    @backends.setter
+    def backends(self, value):
+        # accepts dict, list of "stage=backend" strings or single string with comma separated entries
+        if value is None:
+            return
+
+        if not isinstance(value, dict):
+            # noinspection PyCompatibility
+            entries = value.split(',') if isinstance(value, basestring) else value
+            value = {}
+            for entry in [entry.strip() for entry in entries if entry.strip()]:
+                if '=' not in entry:
+                    raise ValueError('Backend must be given as "stage=backend", "{}" given'.format(entry))
+                stage, name = entry.split('=', 1)
+                value[stage.strip().lower()] = name.strip().lower()
+
+        for stage, name in value.items():
+            if stage not in Config.BACKEND_STAGES:
+                raise ValueError('Unknown backend stage "{}". Supported stages: {}'.format(
+                    stage, ', '.join(Config.BACKEND_STAGES)))
+            if name not in Config.BACKENDS:
+                raise ValueError('Unknown backend "{}". Supported backends: {}'.format(
+                    name, ', '.join(Config.BACKENDS)))
+
+        self.__backends = dict(value)
+
+    def get_backend(self, stage):
+        """Returns name of backend configured for given stage
+        """
+        return self.__backends.get(stage, Config.DEFAULT_BACKEND)
+
+    @property
+    def encoder(self):
+        return self.__encoder
+
+    @encoder.setter
+    def encoder(self, value):
+        value = Config.__get_as_string(value)
+        if value is not None:
+            value = value.lower()
+            if value not in Config.ENCODERS:
+                raise ValueError('Unknown encoder profile "{}". Supported profiles: {}'.format(
+                    value, ', '.join(Config.ENCODERS)))
+            self.__encoder = value
+
+    @property
+    def loudness(self):
+        return self.__loudness
+
+    @loudness.setter
+    def loudness(self, value):
+        value = Config.__get_as_string(value)
+        if value is not None:
+            value = value.lower()
+            if value not in Config.LOUDNESS_MODES:
+                raise ValueError('Unknown loudness mode "{}". Supported modes: {}'.format(
+                    value, ', '.join(Config.LOUDNESS_MODES)))
+            self.__loudness = value
+
+    @property
+    def loudness_windows(self):
+        return self.__loudness_windows
+
+    @loudness_windows.setter
+    def loudness_windows(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < Config.LOUDNESS_WINDOWS_MIN:
+                raise ValueError('Number of loudness windows cannot be lower than {}'.format(
+                    Config.LOUDNESS_WINDOWS_MIN))
+            self.__loudness_windows = value
+
+    @property
+    def loudness_window_length(self):
+        return self.__loudness_window_length
+
+    @loudness_window_length.setter
+    def loudness_window_length(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 1:
+                raise ValueError('Loudness window cannot be shorter than 1 second')
+            self.__loudness_window_length = value
+
+    @property
+    def overlay_cue(self):
+        return self.__overlay_cue
+
+    @overlay_cue.setter
+    def overlay_cue(self, value):
+        if value is not None and isinstance(value, bool):
+            self.__overlay_cue = value
+
+    @property
+    def overlay_chapters(self):
+        return self.__overlay_chapters
+
+    @overlay_chapters.setter
+    def overlay_chapters(self, value):
+        if value is not None and isinstance(value, bool):
+            self.__overlay_chapters = value
+
+    # *****************************************************************************************************************
+
+    @property
+    def metadata_index(self):
+        return self.__metadata_index
+
+    @metadata_index.setter
+    def metadata_index(self, value):
+        value = Config.__get_as_string(value, False)
+        self.__metadata_index = value if value else None
+
+    @property
+    def io_threads(self):
+        return self.__io_threads
+
+    @io_threads.setter
+    def io_threads(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 1:
+                raise ValueError('Number of I/O threads must be at least 1')
+            self.__io_threads = value
+
+    # *****************************************************************************************************************
+
+    @property
+    def scratch_dir(self):
+        return self.__scratch_dir
+
+    @scratch_dir.setter
+    def scratch_dir(self, value):
+        value = Config.__get_as_string(value, False)
+        self.__scratch_dir = os.path.expanduser(value) if value else None
+
+    @property
+    def scratch_tmpfs_dir(self):
+        return self.__scratch_tmpfs_dir
+
+    @scratch_tmpfs_dir.setter
+    def scratch_tmpfs_dir(self, value):
+        value = Config.__get_as_string(value, False)
+        if value is not None:
+            self.__scratch_tmpfs_dir = value if value else None
+
+    @property
+    def scratch_budget(self):
+        return self.__scratch_budget
+
+    @scratch_budget.setter
+    def scratch_budget(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Scratch budget cannot be negative')
+            self.__scratch_budget = value
+
+    # *****************************************************************************************************************
+
+    @property
+    def staging_dir(self):
+        return self.__staging_dir
+
+    @staging_dir.setter
+    def staging_dir(self, value):
+        value = Config.__get_as_string(value, False)
+        self.__staging_dir = os.path.expanduser(value) if value else None
+
+    @property
+    def staging_prefetch(self):
+        return self.__staging_prefetch
+
+    @staging_prefetch.setter
+    def staging_prefetch(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Number of files to prefetch cannot be negative')
+            self.__staging_prefetch = value
+
+    @property
+    def staging_bandwidth(self):
+        return self.__staging_bandwidth
+
+    @staging_bandwidth.setter
+    def staging_bandwidth(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Staging bandwidth cannot be negative')
+            self.__staging_bandwidth = value
+
+    @property
+    def staging_commit_queue(self):
+        return self.__staging_commit_queue
+
+    @staging_commit_queue.setter
+    def staging_commit_queue(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 1:
+                raise ValueError('Staging commit queue must hold at least one file')
+            self.__staging_commit_queue = value
+
+    # *****************************************************************************************************************
+
+    @property
+    def jobs(self):
+        return self.__jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Number of jobs cannot be negative')
+            self.__jobs = value
+
+    @property
+    def memory_budget(self):
+        return self.__memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Memory budget cannot be negative')
+            self.__memory_budget = value
+
+    @property
+    def disk_budget(self):
+        return self.__disk_budget
+
+    @disk_budget.setter
+    def disk_budget(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None:
+            if value < 0:
+                raise ValueError('Disk budget cannot be negative')
+            self.__disk_budget = value
+
+    @property
+    def metrics_port(self):
+        return self.__metrics_port
+
+    @metrics_port.setter
+    def metrics_port(self, value):
+        value = Config.__get_as_int(value)
+        if value is not None and not 1 <= value <= 65535:
+            raise ValueError('Metrics port must be in range from 1 to 65535')
+        self.__metrics_port = value
+
+    # *****************************************************************************************************************
+
     def load(self, file_name):
         """Load patch config file (if exists).
 
@@ -296,6 +767,9 @@ class Config(object):
         config_file_full = os.path.expanduser(file_name)
 
         if os.path.isfile(config_file_full):
+            # imported here as it is not needed unless we really have config file to load
+            from backports import configparser
+
             config = configparser.ConfigParser()
             # custom optionxform prevents keys from being lower-cased (default implementation) as CaSe matters for us
             config.optionxform = str
@@ -329,6 +803,51 @@ class Config(object):
                 self.tick_interval = config.getint(section, self.INI_KEY_TICK_INTERVAL)
             if config.has_option(section, self.INI_KEY_TICK_ADD):
                 self.tick_add = config.getint(section, self.INI_KEY_TICK_ADD)
+            if config.has_option(section, self.INI_KEY_TICK_INTERVAL_SECS):
+                self.tick_interval_secs = config.getint(section, self.INI_KEY_TICK_INTERVAL_SECS)
+            if config.has_option(section, self.INI_KEY_TICK_OFFSET_SECS):
+                self.tick_offset_secs = config.getint(section, self.INI_KEY_TICK_OFFSET_SECS)
+
+            if config.has_option(section, self.INI_KEY_OUTPUT_MODE):
+                self.output_mode = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_OUTPUT_MODE))
+            if config.has_option(section, self.INI_KEY_PIPELINE):
+                self.pipeline = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_PIPELINE))
+            if config.has_option(section, self.INI_KEY_ENCODER):
+                self.encoder = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_ENCODER))
+
+            if config.has_option(section, self.INI_KEY_LOUDNESS):
+                self.loudness = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_LOUDNESS))
+            if config.has_option(section, self.INI_KEY_LOUDNESS_WINDOWS):
+                self.loudness_windows = config.getint(section, self.INI_KEY_LOUDNESS_WINDOWS)
+            if config.has_option(section, self.INI_KEY_LOUDNESS_WINDOW_LENGTH):
+                self.loudness_window_length = config.getint(section, self.INI_KEY_LOUDNESS_WINDOW_LENGTH)
+
+            if config.has_option(section, self.INI_KEY_METADATA_INDEX):
+                self.metadata_index = Config.__strip_quotes_from_ini_string(
+                    config.get(section, self.INI_KEY_METADATA_INDEX))
+
+            if config.has_option(section, self.INI_KEY_SCRATCH_DIR):
+                self.scratch_dir = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_SCRATCH_DIR))
+            if config.has_option(section, self.INI_KEY_SCRATCH_TMPFS_DIR):
+                self.scratch_tmpfs_dir = Config.__strip_quotes_from_ini_string(
+                    config.get(section, self.INI_KEY_SCRATCH_TMPFS_DIR))
+            if config.has_option(section, self.INI_KEY_SCRATCH_BUDGET):
+                self.scratch_budget = config.getint(section, self.INI_KEY_SCRATCH_BUDGET)
+
+            if config.has_option(section, self.INI_KEY_STAGING_DIR):
+                self.staging_dir = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_STAGING_DIR))
+            if config.has_option(section, self.INI_KEY_STAGING_PREFETCH):
+                self.staging_prefetch = config.getint(section, self.INI_KEY_STAGING_PREFETCH)
+            if config.has_option(section, self.INI_KEY_STAGING_BANDWIDTH):
+                self.staging_bandwidth = config.getint(section, self.INI_KEY_STAGING_BANDWIDTH)
+            if config.has_option(section, self.INI_KEY_STAGING_COMMIT_QUEUE):
+                self.staging_commit_queue = config.getint(section, self.INI_KEY_STAGING_COMMIT_QUEUE)
+
+            if config.has_option(section, self.INI_KEY_JOBS):
+                self.jobs = config.getint(section, self.INI_KEY_JOBS)
+
+            if config.has_option(section, self.INI_KEY_BACKENDS):
+                self.backends = Config.__strip_quotes_from_ini_string(config.get(section, self.INI_KEY_BACKENDS))
 
             result = True
 
@@ -348,7 +867,7 @@ class Config(object):
     def __format_ini_entry(ini_key, val):
         result = None
 
-        if isinstance(val, (str, unicode)):
+        if isinstance(val, basestring):
             result = '"{}"'.format(val)
         if isinstance(val, (int, float)):
             result = '{}'.format(val)
@@ -386,8 +905,51 @@ class Config(object):
             Config.__format_ini_entry(self.INI_KEY_TICK_OFFSET, self.tick_offset),
             Config.__format_ini_entry(self.INI_KEY_TICK_INTERVAL, self.tick_interval),
             Config.__format_ini_entry(self.INI_KEY_TICK_ADD, self.tick_add),
-
+            '',
+            Config.__format_ini_entry(self.INI_KEY_OUTPUT_MODE, self.output_mode),
+            Config.__format_ini_entry(self.INI_KEY_PIPELINE, self.pipeline),
+            Config.__format_ini_entry(self.INI_KEY_ENCODER, self.encoder),
+            '',
+            Config.__format_ini_entry(self.INI_KEY_LOUDNESS, self.loudness),
+            Config.__format_ini_entry(self.INI_KEY_LOUDNESS_WINDOWS, self.loudness_windows),
+            Config.__format_ini_entry(self.INI_KEY_LOUDNESS_WINDOW_LENGTH, self.loudness_window_length),
+            '',
+            Config.__format_ini_entry(self.INI_KEY_SCRATCH_TMPFS_DIR,
+                                      self.scratch_tmpfs_dir if self.scratch_tmpfs_dir is not None else ''),
+            Config.__format_ini_entry(self.INI_KEY_SCRATCH_BUDGET, self.scratch_budget),
+            '',
+            Config.__format_ini_entry(self.INI_KEY_JOBS, self.jobs),
         ]
 
+        if self.scratch_dir is not None:
+            out_buffer.append(Config.__format_ini_entry(self.INI_KEY_SCRATCH_DIR, self.scratch_dir))
+
+        if self.staging_dir is not None:
+            out_buffer.extend([
+                '',
+                Config.__format_ini_entry(self.INI_KEY_STAGING_DIR, self.staging_dir),
+                Config.__format_ini_entry(self.INI_KEY_STAGING_PREFETCH, self.staging_prefetch),
+                Config.__format_ini_entry(self.INI_KEY_STAGING_BANDWIDTH, self.staging_bandwidth),
+                Config.__format_ini_entry(self.INI_KEY_STAGING_COMMIT_QUEUE, self.staging_commit_queue),
+            ])
+
+        if self.tick_interval_secs is not None:
+            out_buffer.append(Config.__format_ini_entry(self.INI_KEY_TICK_INTERVAL_SECS, self.tick_interval_secs))
+        if self.tick_offset_secs is not None:
+            out_buffer.append(Config.__format_ini_entry(self.INI_KEY_TICK_OFFSET_SECS, self.tick_offset_secs))
+
+        if self.metadata_index is not None:
+            out_buffer.extend([
+                '',
+                Config.__format_ini_entry(self.INI_KEY_METADATA_INDEX, self.metadata_index),
+            ])
+
+        if self.backends:
+            out_buffer.extend([
+                '',
+                Config.__format_ini_entry(self.INI_KEY_BACKENDS, ', '.join(
+                    '{}={}'.format(stage, self.backends[stage]) for stage in sorted(self.backends))),
+            ])
+
         with open(file_name_full, 'w+') as fh:
             fh.writelines('\n'.join(out_buffer))
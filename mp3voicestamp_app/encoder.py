@@ -0,0 +1,161 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.tools import Tools
+
+
+class Encoder(object):
+    """Output encoder profiles, trading encoding speed for quality and size:
+
+        vbr      LAME VBR with quality matching source bitrate (default)
+        fast     the same VBR quality, but with fastest LAME algorithm (noticeably quicker, slightly worse)
+        cbr      LAME CBR at standard bitrate closest to source bitrate (predictable size)
+        archive  best LAME VBR quality with slowest, most precise algorithm
+        opus     Opus in Ogg container, at bitrate derived from source bitrate
+        aac      AAC (ffmpeg's native encoder) in M4A container, at bitrate derived from source bitrate
+
+    Use extras/benchmarks/encoder_profiles.py to compare them on your hardware.
+    """
+
+    # standard MPEG-1 Layer III bitrates (kbps)
+    MP3_BITRATES_KBPS = [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+
+    # LAME's "-q" algorithm quality (ffmpeg's "-compression_level"): 0 is the best and slowest, 9 the fastest
+    LAME_ALGORITHM_FASTEST = 9
+    LAME_ALGORITHM_BEST = 0
+
+    # Opus and AAC reach the same perceived quality at lower bitrates than MP3 does
+    OPUS_BITRATE_RATIO = 0.5
+    OPUS_MIN_KBPS = 64
+    OPUS_MAX_KBPS = 160
+    AAC_BITRATE_RATIO = 0.75
+    AAC_MIN_KBPS = 96
+    AAC_MAX_KBPS = 256
+
+    # encoding time relative to default profile, used for estimates
+    RELATIVE_ENCODE_COST = {
+        Config.ENCODER_VBR: 1.0,
+        Config.ENCODER_FAST: 0.6,
+        Config.ENCODER_CBR: 1.0,
+        Config.ENCODER_ARCHIVE: 1.6,
+        Config.ENCODER_OPUS: 0.8,
+        Config.ENCODER_AAC: 0.8,
+    }
+
+    def __init__(self, profile=Config.DEFAULT_ENCODER):
+        """
+        Args:
+            :profile Config.ENCODER_xxx
+        """
+        self.profile = profile
+
+    def is_mp3(self):
+        return self.profile not in [Config.ENCODER_OPUS, Config.ENCODER_AAC]
+
+    def get_extension(self):
+        """Returns extension of the output file or None if it should be the same as source file's one
+        """
+        return {Config.ENCODER_OPUS: 'opus', Config.ENCODER_AAC: 'm4a'}.get(self.profile)
+
+    def get_format(self, streaming=False):
+        """Returns ffmpeg's output format
+
+        Args:
+            :streaming True if output is not seekable (i.e. is a pipe)
+        """
+        if self.profile == Config.ENCODER_OPUS:
+            return 'ogg'
+        if self.profile == Config.ENCODER_AAC:
+            # MP4 container needs seekable output, so raw ADTS stream is written to pipes
+            return 'adts' if streaming else 'ipod'
+        return 'mp3'
+
+    def get_capability(self):
+        """Returns Tools.CAP_xxx installed ffmpeg must have to use this profile
+        """
+        return {
+            Config.ENCODER_OPUS: Tools.CAP_FFMPEG_LIBOPUS,
+            Config.ENCODER_AAC: Tools.CAP_FFMPEG_AAC,
+        }.get(self.profile, Tools.CAP_FFMPEG_LIBMP3LAME)
+
+    @staticmethod
+    def __get_source_kbps(music_track):
+        return music_track.bitrate / 1000.0
+
+    @staticmethod
+    def __get_derived_kbps(music_track, ratio, min_kbps, max_kbps):
+        kbps = int(round(Encoder.__get_source_kbps(music_track) * ratio))
+        return max(min_kbps, min(max_kbps, kbps))
+
+    def __get_cbr_kbps(self, music_track):
+        source_kbps = self.__get_source_kbps(music_track)
+        return min(self.MP3_BITRATES_KBPS, key=lambda kbps: abs(kbps - source_kbps))
+
+    def get_bitrate_kbps(self, music_track):
+        """Returns expected average bitrate (kbps) of the output
+        """
+        if self.profile == Config.ENCODER_CBR:
+            return self.__get_cbr_kbps(music_track)
+        if self.profile == Config.ENCODER_OPUS:
+            return self.__get_derived_kbps(music_track, self.OPUS_BITRATE_RATIO, self.OPUS_MIN_KBPS,
+                                           self.OPUS_MAX_KBPS)
+        if self.profile == Config.ENCODER_AAC:
+            return self.__get_derived_kbps(music_track, self.AAC_BITRATE_RATIO, self.AAC_MIN_KBPS,
+                                           self.AAC_MAX_KBPS)
+
+        quality = 0 if self.profile == Config.ENCODER_ARCHIVE else music_track.get_encoding_quality_for_lame_encoder()
+        return Mp3FileInfo.LAME_VBR_AVERAGE_KBPS[min(quality, len(Mp3FileInfo.LAME_VBR_AVERAGE_KBPS) - 1)]
+
+    def estimate_size(self, music_track):
+        """Estimates size (in bytes) of the output file
+
+        Returns:
+            int
+        """
+        return int(music_track.duration_seconds * self.get_bitrate_kbps(music_track) * 1000 / 8)
+
+    def get_relative_encode_cost(self):
+        return self.RELATIVE_ENCODE_COST[self.profile]
+
+    def get_output_args(self, music_track, streaming=False):
+        """Returns ffmpeg's codec and format arguments for encoding mix of given track
+
+        Args:
+            :music_track Mp3FileInfo
+            :streaming True if output is not seekable (i.e. is a pipe)
+
+        Returns:
+            list
+        """
+        if self.profile == Config.ENCODER_OPUS:
+            # libopus supports 48 kHz at most, and it is what decoders expect anyway
+            args = ['-c:a', 'libopus', '-b:a', '{}k'.format(self.get_bitrate_kbps(music_track)),
+                    '-vbr', 'on', '-ar', '48000']
+        elif self.profile == Config.ENCODER_AAC:
+            args = ['-c:a', 'aac', '-b:a', '{}k'.format(self.get_bitrate_kbps(music_track))]
+        elif self.profile == Config.ENCODER_CBR:
+            args = ['-c:a', 'libmp3lame', '-b:a', '{}k'.format(self.get_bitrate_kbps(music_track))]
+        elif self.profile == Config.ENCODER_ARCHIVE:
+            args = ['-c:a', 'libmp3lame', '-q:a', '0', '-compression_level', str(self.LAME_ALGORITHM_BEST)]
+        else:
+            args = ['-c:a', 'libmp3lame', '-q:a', str(music_track.get_encoding_quality_for_lame_encoder())]
+            if self.profile == Config.ENCODER_FAST:
+                args.extend(['-compression_level', str(self.LAME_ALGORITHM_FASTEST)])
+
+        return args + ['-f', self.get_format(streaming)]
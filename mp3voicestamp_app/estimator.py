@@ -0,0 +1,195 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.encoder import Encoder
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.scratch import Scratch
+from mp3voicestamp_app.tick_plan import TickPlan
+from mp3voicestamp_app.util import Util
+
+
+class Estimator(object):
+    """Plans batch run without doing any audio processing: reads metadata of all input files in parallel
+    and reports total audio length, tick counts, temporary disk space and output size needed together
+    with estimated wall time, based on per-stage cost model.
+    """
+
+    COST_SYNTHESIZE_PER_SEGMENT = 'synthesize_per_segment'
+    COST_CONCAT_PER_MINUTE = 'concat_per_minute'
+    COST_DECODE_PER_MINUTE = 'decode_per_minute'
+    COST_ANALYZE_PER_MINUTE = 'analyze_per_minute'
+    COST_GAIN_PER_MINUTE = 'gain_per_minute'
+    COST_ENCODE_PER_MINUTE = 'encode_per_minute'
+    COST_OVERLAY_ANALYZE_PER_MINUTE = 'overlay_analyze_per_minute'
+    COST_OVERLAY_ENCODE_PER_SEGMENT = 'overlay_encode_per_segment'
+    COST_FILE_OVERHEAD = 'file_overhead'
+
+    # Wall time (in seconds) of each processing stage, per audio minute or per spoken segment, as
+    # measured on mid-range 4 core desktop. Use "--cost-model" to provide values calibrated for your
+    # hardware.
+    DEFAULT_COST_MODEL = {
+        COST_SYNTHESIZE_PER_SEGMENT: 0.08,
+        COST_CONCAT_PER_MINUTE: 0.02,
+        COST_DECODE_PER_MINUTE: 0.25,
+        COST_ANALYZE_PER_MINUTE: 0.06,
+        COST_GAIN_PER_MINUTE: 0.10,
+        COST_ENCODE_PER_MINUTE: 0.90,
+        COST_OVERLAY_ANALYZE_PER_MINUTE: 0.20,
+        COST_OVERLAY_ENCODE_PER_SEGMENT: 0.01,
+        COST_FILE_OVERHEAD: 0.15,
+    }
+
+    def __init__(self, config, metadata_index=None):
+        self.__config = config
+        self.__metadata_index = metadata_index
+        self.__cost_model = self.load_cost_model(config.cost_model)
+
+    @staticmethod
+    def load_cost_model(file_name):
+        """Returns cost model, with default values overridden by these found in given JSON file (if any)
+        """
+        cost_model = Estimator.DEFAULT_COST_MODEL.copy()
+        if file_name is not None:
+            with open(os.path.expanduser(file_name), 'r') as fh:
+                custom = json.load(fh)
+
+            for key, val in custom.items():
+                if key not in cost_model:
+                    raise ValueError('Unknown cost model key "{}" in "{}"'.format(key, file_name))
+                cost_model[key] = float(val)
+
+        return cost_model
+
+    # *****************************************************************************************************************
+
+    def estimate_track(self, music_track):
+        """Estimates resources needed to process given track
+
+        Returns:
+            dict
+        """
+        cost = self.__cost_model
+        minutes = music_track.duration_seconds / 60
+
+        tick_count = TickPlan.get_tick_count(self.__config, music_track)
+        segment_count = tick_count + 1
+
+        overlay_mode = self.__config.output_mode == Config.OUTPUT_MODE_OVERLAY
+        temp_size = Scratch.estimate_size(music_track, segment_count, overlay_mode)
+
+        stages = {'synthesize': segment_count * cost[self.COST_SYNTHESIZE_PER_SEGMENT]}
+        if overlay_mode:
+            # spoken clips only, encoded at 48 kbps
+            output_size = segment_count * Scratch.SEGMENT_SECONDS * 48000 / 8
+            stages['analyze'] = minutes * cost[self.COST_OVERLAY_ANALYZE_PER_MINUTE]
+            stages['encode'] = segment_count * cost[self.COST_OVERLAY_ENCODE_PER_SEGMENT]
+        else:
+            encoder = Encoder(self.__config.encoder)
+            output_size = encoder.estimate_size(music_track)
+            stages['concat'] = minutes * cost[self.COST_CONCAT_PER_MINUTE]
+            stages['decode'] = minutes * cost[self.COST_DECODE_PER_MINUTE]
+            stages['analyze'] = minutes * cost[self.COST_ANALYZE_PER_MINUTE]
+            stages['gain'] = minutes * cost[self.COST_GAIN_PER_MINUTE]
+            stages['encode'] = minutes * cost[self.COST_ENCODE_PER_MINUTE] * encoder.get_relative_encode_cost()
+
+        config = self.__config
+        sampled_seconds = config.loudness_windows * config.loudness_window_length
+        if config.loudness == Config.LOUDNESS_SAMPLED and music_track.duration_seconds >= 2 * sampled_seconds:
+            # only the windows are decoded and analyzed, just like in overlay mode
+            stages['analyze'] = sampled_seconds / 60.0 * cost[self.COST_OVERLAY_ANALYZE_PER_MINUTE]
+        elif config.loudness == Config.LOUDNESS_ENVELOPE and not overlay_mode:
+            # envelope is calculated by the same ffmpeg run which decodes the track
+            stages['analyze'] = 0.0
+
+        stages['overhead'] = cost[self.COST_FILE_OVERHEAD]
+
+        return {
+            'minutes': minutes,
+            'ticks': tick_count,
+            'segments': segment_count,
+            'temp_size': temp_size,
+            'output_size': output_size,
+            'stages': stages,
+            'wall_time': sum(stages.values()),
+        }
+
+    def __read_track(self, file_name):
+        try:
+            return file_name, Mp3FileInfo(file_name, self.__metadata_index), None
+        except Exception as ex:
+            return file_name, None, ex
+
+    def run(self, file_names):
+        """Reads metadata of all given files in parallel and prints the batch run estimates
+
+        Returns:
+            int number of files that failed to be read
+        """
+        totals = {
+            'files': 0,
+            'failed': 0,
+            'minutes': 0.0,
+            'ticks': 0,
+            'segments': 0,
+            'output_size': 0,
+            'wall_time': 0.0,
+        }
+        peak_temp_size = 0
+        stage_totals = {}
+
+        pool = ThreadPool(self.__config.io_threads)
+        try:
+            for file_name, music_track, ex in pool.imap_unordered(self.__read_track, file_names):
+                if ex is not None:
+                    Log.e('{}: {}'.format(file_name, ex))
+                    totals['failed'] += 1
+                    continue
+
+                estimate = self.estimate_track(music_track)
+                totals['files'] += 1
+                for key in ['minutes', 'ticks', 'segments', 'output_size', 'wall_time']:
+                    totals[key] += estimate[key]
+                peak_temp_size = max(peak_temp_size, estimate['temp_size'])
+                for stage, seconds in estimate['stages'].items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+                Log.v('"{}": {:.1f} mins, {} ticks, temp {}, output {}, est. {}'.format(
+                    file_name, estimate['minutes'], estimate['ticks'], Util.format_size(estimate['temp_size']),
+                    Util.format_size(estimate['output_size']), Util.format_duration(estimate['wall_time'])))
+        finally:
+            pool.close()
+            pool.join()
+
+        Log.i([
+            'Files: {} (unreadable: {})'.format(totals['files'], totals['failed']),
+            'Output mode: {}'.format(self.__config.output_mode),
+            'Total audio: {:.1f} mins ({})'.format(totals['minutes'], Util.format_duration(totals['minutes'] * 60)),
+            'Ticks: {}, spoken segments: {}'.format(totals['ticks'], totals['segments']),
+            'Peak temp disk space: {}'.format(Util.format_size(peak_temp_size)),
+            'Expected output size: {}'.format(Util.format_size(totals['output_size'])),
+            'Estimated wall time: {}'.format(Util.format_duration(totals['wall_time'])),
+        ])
+        Log.v(['  {}: {}'.format(stage, Util.format_duration(seconds))
+               for stage, seconds in sorted(stage_totals.items(), key=lambda item: -item[1])])
+
+        return totals['failed']
@@ -0,0 +1,129 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import sys
+import wave
+from array import array
+
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.loudness_envelope import LoudnessEnvelope
+from mp3voicestamp_app.stage_backend import StageBackend
+
+
+class FakeAudio(StageBackend):
+    """In-process stand-in for the external tools, doing no real audio work. Still, all the files stages
+    produce are created (as tiny, but valid WAV files where these are read back), so job orchestration,
+    scheduling and caching can be benchmarked or tested at thousands of files per second, without any
+    audio tool installed.
+    """
+
+    NAME = Config.BACKEND_FAKE
+
+    # sample rate of created WAV files, low as nobody listens to them
+    SAMPLE_RATE = 8000
+
+    # length of spoken clip, per character of the text
+    SPEECH_SECONDS_PER_CHAR = 0.05
+
+    # reported loudness of any track
+    RMS_AMPLITUDE = 0.1
+
+    # content of "encoded" output files
+    OUTPUT_DATA = b'\xff\xfb\x90\x64' + b'\x00' * 28
+
+    def __init__(self, tools):
+        pass
+
+    @staticmethod
+    def needs_tools():
+        return False
+
+    def has_capability(self, cap):
+        return True
+
+    @staticmethod
+    def __write_wav(file_name, seconds=0.0):
+        wav = wave.open(file_name, 'wb')
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(FakeAudio.SAMPLE_RATE)
+        wav.writeframes(b'\x00\x00' * int(seconds * FakeAudio.SAMPLE_RATE))
+        wav.close()
+
+    @staticmethod
+    def __write_output(file_out, stdout=None):
+        if file_out == '-':
+            out = stdout if stdout is not None else getattr(sys.stdout, 'buffer', sys.stdout)
+            out.write(FakeAudio.OUTPUT_DATA)
+        else:
+            with open(file_out, 'wb') as fh:
+                fh.write(FakeAudio.OUTPUT_DATA)
+
+    # *****************************************************************************************************************
+
+    def speak_to_wav(self, text, wav_file, speed, no_cleanup=False):
+        self.__write_wav(wav_file, len(text) * self.SPEECH_SECONDS_PER_CHAR)
+        return True
+
+    def decode_to_wav(self, file_name, wav_file, input_data=None, envelope=False):
+        self.__write_wav(wav_file)
+        return self.calculate_loudness_envelope(file_name, input_data) if envelope else None
+
+    # *****************************************************************************************************************
+
+    def calculate_rms_amplitude(self, wav_file):
+        return self.RMS_AMPLITUDE
+
+    def calculate_rms_amplitude_of_file(self, file_name, input_data=None):
+        return self.RMS_AMPLITUDE
+
+    def calculate_sampled_rms_amplitude(self, file_name, duration, windows, window_length, buffer=None):
+        return self.RMS_AMPLITUDE, 0.0
+
+    def calculate_loudness_envelope(self, file_name, input_data=None, wav_file=None):
+        if wav_file is not None:
+            self.__write_wav(wav_file)
+
+        # one window of constant level
+        envelope = LoudnessEnvelope(self.SAMPLE_RATE, 1)
+        samples = array('h', [int(self.RMS_AMPLITUDE * 32768)] * int(self.SAMPLE_RATE * LoudnessEnvelope.WINDOW_LENGTH))
+        envelope.add(samples.tobytes() if hasattr(samples, 'tobytes') else samples.tostring())
+        envelope.finish()
+
+        return envelope
+
+    # *****************************************************************************************************************
+
+    def adjust_wav_amplitude(self, wav_file, rms_amplitude):
+        pass
+
+    def concat_wav_files(self, file_out, wav_files):
+        self.__write_wav(file_out)
+
+    def concat_padded_wav_files(self, file_out, wav_files, lengths):
+        self.__write_wav(file_out)
+
+    def encode_overlay(self, wav_file, file_out):
+        self.__write_output(file_out)
+
+    def mix_wav_tracks(self, file_out, output_args, wav_files, metadata_args=None, stdout=None,
+                       metadata_input=None, input_data=None):
+        self.__write_output(file_out, stdout)
+
+    def mix_speech_clips(self, file_out, music_input, output_args, clips, metadata_args=None,
+                         input_data=None, stdout=None):
+        self.__write_output(file_out, stdout)
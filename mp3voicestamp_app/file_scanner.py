@@ -0,0 +1,168 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import fnmatch
+import os
+import re
+import threading
+
+try:
+    # noinspection PyCompatibility
+    from queue import Queue
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from Queue import Queue
+
+from mp3voicestamp_app.log import Log
+
+
+class FileScanner(object):
+    """Lazily discovers input files. Plain files are passed through as is, while directories are
+    scanned recursively, with files filtered by include/exclude globs.
+    """
+
+    DEFAULT_INCLUDE = ['*.mp3']
+
+    # how many discovered files scan_ahead() can queue before scanning thread waits for consumer
+    SCAN_AHEAD_QUEUE_SIZE = 1000
+
+    __END_OF_SCAN = object()
+
+    def __init__(self, include=None, exclude=None, skip_format=None):
+        """
+        Args:
+            :include list of globs file names must match to be used. Default is DEFAULT_INCLUDE
+            :exclude list of globs. Files or directories matching any of these are skipped
+            :skip_format if not None, files which names match this output file name format are skipped
+        """
+        self.__include = include if include else self.DEFAULT_INCLUDE
+        self.__exclude = exclude if exclude else []
+        self.__skip_re = self.__format_to_regex(skip_format) if skip_format is not None else None
+
+    @staticmethod
+    def __format_to_regex(fmt):
+        """Converts output file name format (i.e. "{name} (mp3voicestamp).{ext}") into regular expression
+        matching file names produced with it
+        """
+        placeholders = {
+            'name': '.+',
+            'ext': '[^.]*',
+        }
+
+        pattern = ''
+        for part in re.split(r'(\{\w+\})', fmt):
+            key = part[1:-1] if part.startswith('{') and part.endswith('}') else None
+            pattern += placeholders.get(key, '.*') if key is not None else re.escape(part)
+
+        return re.compile('^' + pattern + '$', re.IGNORECASE)
+
+    @staticmethod
+    def is_dir(path):
+        # "-" stands for stdin, even if there's directory named like that
+        return path != '-' and os.path.isdir(path)
+
+    # *****************************************************************************************************************
+
+    def __is_excluded(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.__exclude)
+
+    def __is_wanted(self, name):
+        if not any(fnmatch.fnmatch(name.lower(), pattern.lower()) for pattern in self.__include):
+            return False
+        if self.__is_excluded(name):
+            return False
+        if self.__skip_re is not None and self.__skip_re.match(name):
+            Log.v('Skipping already stamped "{}"'.format(name))
+            return False
+
+        return True
+
+    @staticmethod
+    def __list_dir(path):
+        """Yields (name, full_path, is_dir) for each entry of given directory, sorted by name
+        """
+        if hasattr(os, 'scandir'):
+            # noinspection PyUnresolvedReferences
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+            for entry in entries:
+                yield entry.name, entry.path, entry.is_dir()
+        else:
+            for name in sorted(os.listdir(path)):
+                full_path = os.path.join(path, name)
+                yield name, full_path, os.path.isdir(full_path)
+
+    def scan_dir(self, root):
+        """Recursively scans given directory
+
+        Yields:
+            tuple (file name, directory of the file relative to root)
+        """
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            try:
+                entries = list(self.__list_dir(path))
+            except OSError as ex:
+                Log.e('Failed to scan "{}": {}'.format(path, ex))
+                continue
+
+            sub_dirs = []
+            for name, full_path, is_dir in entries:
+                if is_dir:
+                    if not self.__is_excluded(name):
+                        sub_dirs.append(full_path)
+                elif self.__is_wanted(name):
+                    yield full_path, os.path.relpath(path, root) if path != root else ''
+
+            # depth-first, but keeping alphabetical order of sub directories
+            pending.extend(reversed(sub_dirs))
+
+    def scan(self, paths):
+        """Lazily yields input files for given list of paths (files or directories)
+
+        Yields:
+            tuple (file name, output sub directory)
+        """
+        for path in paths:
+            if self.is_dir(path):
+                for item in self.scan_dir(path):
+                    yield item
+            else:
+                yield path, ''
+
+    def scan_ahead(self, paths, queue_size=SCAN_AHEAD_QUEUE_SIZE):
+        """Same as scan(), but scanning is done by background thread, so discovery continues while the
+        consumer is busy processing already found files.
+        """
+        queue = Queue(maxsize=queue_size)
+
+        def worker():
+            try:
+                for item in self.scan(paths):
+                    queue.put(item)
+            finally:
+                queue.put(self.__END_OF_SCAN)
+
+        thread = threading.Thread(target=worker, name='FileScanner')
+        thread.daemon = True
+        thread.start()
+
+        while True:
+            item = queue.get()
+            if item is self.__END_OF_SCAN:
+                break
+            yield item
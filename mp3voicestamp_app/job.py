@@ -15,50 +15,213 @@
 
 from __future__ import print_function
 
+import json
+import math
 import os
 import shutil
+import sys
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
 from mp3voicestamp_app.audio import Audio
+from mp3voicestamp_app.backends import Backends
+from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.const import *
+from mp3voicestamp_app.encoder import Encoder
+from mp3voicestamp_app.job_listener import JobListener
+from mp3voicestamp_app.job_stage import JobStage
+from mp3voicestamp_app.loudness_envelope import LoudnessEnvelope
 from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.pcm_buffer import PcmBuffer
+from mp3voicestamp_app.render_plan import RenderPlan
+from mp3voicestamp_app.scratch import Scratch
+from mp3voicestamp_app.tick_plan import TickPlan
 from mp3voicestamp_app.util import Util
 from mp3voicestamp_app.tools import Tools
 from mp3voicestamp_app.log import Log
 
 
 class Job(object):
+    # output file name meaning "write to stdout"
+    STDOUT = '-'
 
-    def __init__(self, config, tools):
+    # rough memory (in bytes) used by single external tool process (ffmpeg, sox, espeak)
+    PROCESS_MEMORY = 64 * 1024 * 1024
+
+    def __init__(self, config, tools, metadata_index=None, listeners=None, staging=None):
+        """
+        Args:
+            :config
+            :tools
+            :metadata_index optional MetadataIndex
+            :listeners optional list of JobListener instances to be notified about job's progress
+            :staging optional (started) Staging, source is then read from and output committed through
+        """
         self.__config = config
+        self.__metadata_index = metadata_index
+        self.__listeners = listeners if listeners is not None else []
+        self.__staging = staging
         self.__tmp_dir = None
         self.__tmp_mp3_file = None
-        self.__tools = tools
-        self.__audio = Audio(tools)
+        # (tmp file, destination) of files to be committed along with the output one
+        self.__companion_files = []
+        self.__scratch = Scratch(config)
+        self.__backends = Backends(config, tools)
+        self.__encoder = Encoder(config.encoder)
+
+        # state of the job, filled by load() and stages as they run
+        self.__file_name = None
+        self.__music_track = None
+        self.__file_out = None
+        self.__to_stdout = False
+        # (offset in seconds, text) of segments to be spoken: TickPlan, or list if given by the render plan
+        self.__events = []
+        self.__pipeline = None
+        self.__clip_files = []
+        self.__clip_durations = []
+        self.__rms_amplitude = None
+        self.__sampled_loudness = False
+        self.__loudness_error_db = None
+        self.__envelope_loudness = False
+        self.__envelope = None
+        # PcmBuffers handed from external tools to in-process stages, closed by __cleanup()
+        self.__pcm_buffers = []
+        self.__speech_rms_amplitudes = None
+        self.__music_wav = None
+        self.__speech_wav = None
+        self.__overlay_wav = None
+        self.__render_plan = None
+        self.__up_to_date = False
+        self.__output_size = None
+        self.__error = None
+
+        # staged output is committed in background, so file is not finished until it reaches its destination
+        self.__commit_lock = threading.Lock()
+        self.__commit_pending = False
+        self.__commit_error = None
+        self.__on_committed = []
+
+    @contextmanager
+    def __stage(self, stage):
+        """Wraps processing stage, notifying listeners when it starts and finishes
+        """
+        _ = [listener.stage_started(self, stage) for listener in self.__listeners]
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            _ = [listener.stage_finished(self, stage, elapsed) for listener in self.__listeners]
+
+    def get_out_file_name(self, music_track, out_sub_dir=''):
+        """Build out file name based on provided template and music_track data. Returns "-" if output
+        is to be written to stdout.
 
-    def get_out_file_name(self, music_track):
-        """Build out file name based on provided template and music_track data
+        Args:
+            :music_track
+            :out_sub_dir sub directory (relative to scanned input directory) of the source file. Used to mirror
+                         input directory tree when output directory is specified
         """
         out_base_name, out_base_ext = Util.split_file_name(music_track.file_name)
+        if self.__config.output_mode == Config.OUTPUT_MODE_MIX and self.__encoder.get_extension() is not None:
+            out_base_ext = self.__encoder.get_extension()
         formatted_file_name = self.__config.file_out_format.format(name=out_base_name, ext=out_base_ext)
 
-        out_file_name = os.path.basename(music_track.file_name)
-        if self.__config.file_out is None:
+        if self.__config.file_out == self.STDOUT:
+            out_file_name = self.STDOUT
+        elif self.__config.file_out is None:
             out_file_name = os.path.join(os.path.dirname(music_track.file_name), formatted_file_name)
+        elif os.path.isdir(self.__config.file_out):
+            out_file_name = os.path.join(self.__config.file_out, out_sub_dir, formatted_file_name)
         else:
-            if os.path.isfile(self.__config.file_out):
-                out_file_name = self.__config.file_out
-            else:
-                if os.path.isdir(self.__config.file_out):
-                    out_file_name = os.path.join(self.__config.file_out, formatted_file_name)
+            # existing file or the one to be created
+            out_file_name = self.__config.file_out
 
         return out_file_name
 
-    def __make_temp_dir(self):
-        self.__tmp_dir = tempfile.mkdtemp()
+    @staticmethod
+    def __get_stdout():
+        # binary stream on Python 3, plain stdout on Python 2
+        return getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def select_pipeline(self, music_track=None):
+        """Picks pipeline to be used in mix mode, based on configuration and capabilities of installed tools.
+        In "auto" mode, if track is given, resources it needs are taken into account too (see
+        __select_pipeline_for_track()).
+
+        Args:
+            :music_track optional Mp3FileInfo to pick pipeline for
+
+        Returns:
+            tuple (pipeline, reason). Pipeline is "auto" only if it is to be picked for each track, but no track
+            is given
+        """
+        required = [
+            (Tools.CAP_FFMPEG_ADELAY, 'adelay filter'),
+            (Tools.CAP_FFMPEG_ASTATS, 'astats filter'),
+        ]
+
+        pipeline = self.__config.pipeline
+        if pipeline == Config.PIPELINE_LEGACY:
+            return pipeline, 'forced by configuration'
+
+        backend = self.__backends.get(Config.BACKEND_STAGE_MIX)
+        missing = [name for cap, name in required if not backend.has_capability(cap)]
+        if missing:
+            reason = 'ffmpeg lacks {}'.format(', '.join(missing))
+        else:
+            if pipeline == Config.PIPELINE_SINGLE_PASS:
+                return pipeline, 'forced by configuration'
+            if music_track is not None:
+                return self.__select_pipeline_for_track(music_track)
+            return Config.PIPELINE_AUTO, 'single-pass supported by ffmpeg, picked for each track'
+
+        if pipeline == Config.PIPELINE_SINGLE_PASS:
+            Log.w('Cannot use "{}" pipeline: {}'.format(pipeline, reason))
+        return Config.PIPELINE_LEGACY, reason
+
+    def __select_pipeline_for_track(self, music_track):
+        """Both pipelines run single ffmpeg process for the mix, with one music and one speech input, so they
+        differ in scratch space only. Legacy one decodes whole track to WAV (next to full length speech track),
+        which for compressed source takes many times its size, while single-pass one streams the music and needs
+        space for spoken clips only. Legacy pipeline is used as long as its temporary files fit free scratch
+        space and disk budget, otherwise single-pass one is.
+
+        Returns:
+            tuple (pipeline, reason)
+        """
+        config = self.__config
+        segment_count = 1 + TickPlan.get_tick_count(config, music_track)
+        scratch_size = Scratch.estimate_size(music_track, segment_count)
 
-        Log.d('Tmp dir: {}'.format(self.__tmp_dir))
+        what = '{:.0f} min of {:.0f} kbps audio needs {} of temporary files'.format(
+            music_track.duration_seconds / 60, music_track.bitrate / 1000.0, Util.format_size(scratch_size))
+        if config.disk_budget > 0 and scratch_size > config.disk_budget * 1024 * 1024:
+            return Config.PIPELINE_SINGLE_PASS, '{}, over disk budget'.format(what)
+
+        free_space = Scratch.get_free_space(config.scratch_dir if config.scratch_dir is not None
+                                            else tempfile.gettempdir())
+        if free_space is not None and scratch_size * Scratch.FREE_SPACE_MARGIN > free_space:
+            return Config.PIPELINE_SINGLE_PASS, '{}, {} of scratch space free'.format(
+                what, Util.format_size(free_space))
+
+        return Config.PIPELINE_LEGACY, '{}, fits scratch space'.format(what)
+
+    def __get_pcm_buffer(self, name):
+        """Returns PcmBuffer backed by file in job's scratch folder, owned by the job until it is cleaned up
+        """
+        buffer = PcmBuffer(os.path.join(self.__tmp_dir, name + '.pcm'))
+        self.__pcm_buffers.append(buffer)
+        return buffer
 
     def __cleanup(self):
+        # buffers must be unmapped before their files can be removed
+        for buffer in self.__pcm_buffers:
+            buffer.close(not self.__config.no_cleanup)
+        self.__pcm_buffers = []
+
         if not self.__config.no_cleanup:
             if self.__tmp_dir is not None and os.path.isdir(self.__tmp_dir):
                 shutil.rmtree(self.__tmp_dir)
@@ -66,167 +229,713 @@ class Job(object):
 
             if self.__tmp_mp3_file is not None and os.path.isfile(self.__tmp_mp3_file):
                 os.remove(self.__tmp_mp3_file)
+            for tmp_file, _ in self.__companion_files:
+                if os.path.isfile(tmp_file):
+                    os.remove(tmp_file)
         else:
-            print('Temp folder "{}" not cleared.'.format(self.__tmp_dir))
+            Log.i('Temp folder "{}" not cleared.'.format(self.__tmp_dir))
 
     def speak_to_wav(self, text, out_file_name):
-        # noinspection PyProtectedMember
-        text_tmp_file = os.path.join(self.__tmp_dir, next(tempfile._get_candidate_names()) + '.txt')
-        with open(text_tmp_file, "wb+") as fh:
-            fh.write(text)
-            fh.close()
-
-            rc = Util.execute_rc([self.__tools.get_tool(Tools.KEY_ESPEAK),
-                                  '-s', str(self.__config.speech_speed),
-                                  '-z',
-                                  '-w', out_file_name,
-                                  '-f', text_tmp_file],
-                                 debug=self.__config.debug)
+        backend = self.__backends.get(Config.BACKEND_STAGE_SYNTHESIZE)
+        return backend.speak_to_wav(text, out_file_name, self.__config.speech_speed, self.__config.no_cleanup)
 
-            if rc == 0 and not self.__config.no_cleanup:
-                os.remove(text_tmp_file)
+    def __create_voice_clips(self, events):
+        """Speaks each segment into separate WAV file
 
-            return rc == 0
-
-    def __create_voice_wav(self, segments, speech_wav_file_name):
-        for idx, segment_text in enumerate(segments):
+        Returns:
+            list of WAV file names, matching events order
+        """
+        clip_files = []
+        for idx, (_, segment_text) in enumerate(events):
             segment_file_name = os.path.join(self.__tmp_dir, '{}.wav'.format(idx))
             if not self.speak_to_wav(segment_text, segment_file_name):
                 raise RuntimeError('Failed to save speak "{0}" into "{1}".'.format(segment_text, segment_file_name))
+            clip_files.append(segment_file_name)
 
-        # we need to get the frequency of speech waveform generated by espeak to later be able to tell
-        # ffmpeg how to pad/clip the part
-        import wave
-        wav = wave.open(os.path.join(self.__tmp_dir, '0.wav'), 'rb')
-        speech_frame_rate = wav.getframerate()
-        wav.close()
+        return clip_files
 
-        # merge voice overlay segments into one file with needed padding
-        concat_cmd = [self.__tools.get_tool(Tools.KEY_FFMPEG), '-y']
-        filter_complex = ''
-        filter_complex_concat = ';'
-        separator = ''
+    def __create_voice_wav(self, clip_files, speech_wav_file_name):
+        # each clip is padded to the time the next one starts at
+        lengths = [TickPlan.get_offset_seconds(self.__config)]
+        lengths.extend([TickPlan.get_interval_seconds(self.__config)] * (len(clip_files) - 1))
+        self.__backends.get(Config.BACKEND_STAGE_MIX).concat_padded_wav_files(speech_wav_file_name, clip_files, lengths)
 
-        max_len_tick = speech_frame_rate * 60 * self.__config.tick_interval
-        max_len_title = speech_frame_rate * 60 * self.__config.tick_offset
-        for idx, _ in enumerate(segments):
-            concat_cmd.extend(['-i', os.path.join(self.__tmp_dir, '{}.wav'.format(idx))])
+    # *****************************************************************************************************************
 
-            # samples = rate_per_second * seconds * tick_interval_in_minutes
-            max_len = max_len_title if idx == 0 else max_len_tick
-            # http://ffmpeg.org/ffmpeg-filters.html#Filtergraph-description
-            filter_complex += '{}[{}]apad=whole_len={}[g{}]'.format(separator, idx, max_len, idx)
-            separator = ';'
+    def __stage_speech(self):
+        self.__clip_files = self.__create_voice_clips(self.__events)
+        self.__clip_durations = [Audio.get_wav_duration(clip_file) for clip_file in self.__clip_files]
 
-            filter_complex_concat += '[g{}]'.format(idx)
+    def __stage_decode(self):
+        # convert source music track to WAV
+        self.__music_wav = os.path.join(self.__tmp_dir, os.path.basename(self.__music_track.file_name) + '.wav')
+        self.__envelope = self.__backends.get(Config.BACKEND_STAGE_DECODE).decode_to_wav(
+            self.__music_track.get_ffmpeg_input(), self.__music_wav, self.__music_track.data, self.__envelope_loudness)
+        self.__scratch.update_high_water_mark('decode')
 
-        filter_complex_concat += 'concat=n={}:v=0:a=1'.format(len(segments))
+    def __use_sampled_loudness(self):
+        """Tells if music loudness can be estimated from sampled windows, as configured
+        """
+        config = self.__config
+        if config.loudness != Config.LOUDNESS_SAMPLED:
+            return False
 
-        concat_cmd.extend(['-filter_complex', filter_complex + filter_complex_concat])
-        concat_cmd.append(speech_wav_file_name)
+        if self.__music_track.data is not None:
+            Log.v('Sampled loudness needs seekable input, analyzing whole track')
+            return False
 
-        if Util.execute_rc(concat_cmd) != 0:
-            raise RuntimeError('Failed to merge voice segments')
+        # sampling pays off only if windows cover small part of the track
+        if self.__music_track.duration_seconds < 2 * config.loudness_windows * config.loudness_window_length:
+            Log.v('Track too short for sampled loudness, analyzing whole track')
+            return False
 
-    def voice_stamp(self, mp3_file_name):
-        result = True
+        return True
 
-        try:
-            Log.level_push('Processing "{}"'.format(mp3_file_name))
-            music_track = Mp3FileInfo(mp3_file_name)
+    def __use_envelope_loudness(self):
+        """Tells if speech is to be gained to match loudness envelope of the music, as configured
+        """
+        if self.__config.loudness != Config.LOUDNESS_ENVELOPE:
+            return False
+
+        if not LoudnessEnvelope.is_available():
+            Log.w('NumPy not found, speech gain is based on loudness of whole track')
+            return False
+
+        return True
+
+    def __get_loudness_mode(self):
+        if self.__sampled_loudness:
+            return Config.LOUDNESS_SAMPLED
+        if self.__envelope_loudness:
+            return Config.LOUDNESS_ENVELOPE
+        return Config.LOUDNESS_FULL
+
+    def __stage_analyze(self):
+        backend = self.__backends.get(Config.BACKEND_STAGE_ANALYZE)
+
+        # calculate RMS amplitude of music track as reference to gain voice to match
+        if self.__sampled_loudness:
+            config = self.__config
+            self.__rms_amplitude, self.__loudness_error_db = backend.calculate_sampled_rms_amplitude(
+                self.__music_track.get_source_file(), self.__music_track.duration_seconds,
+                config.loudness_windows, config.loudness_window_length, self.__get_pcm_buffer('windows'))
+            Log.v('RMS amplitude {:.4f} estimated from {} windows of {} secs (error +/-{:.2f} dB)'.format(
+                self.__rms_amplitude, config.loudness_windows, config.loudness_window_length,
+                self.__loudness_error_db))
+        elif self.__envelope_loudness:
+            # in single-pass pipeline and overlay mode track is not decoded to WAV, so it is just analyzed
+            if self.__envelope is None:
+                self.__envelope = backend.calculate_loudness_envelope(
+                    self.__music_track.get_ffmpeg_input(), self.__music_track.data)
+            self.__rms_amplitude = self.__envelope.get_rms()
+            Log.v('RMS amplitude {:.4f}, loudness envelope of {} windows'.format(
+                self.__rms_amplitude, len(self.__envelope)))
+        elif self.__music_wav is not None:
+            self.__rms_amplitude = backend.calculate_rms_amplitude(self.__music_wav)
+        else:
+            self.__rms_amplitude = backend.calculate_rms_amplitude_of_file(
+                self.__music_track.get_ffmpeg_input(), self.__music_track.data)
 
-            # some sanity checks first
-            min_track_length = 1 + self.__config.tick_offset
-            if music_track.duration < min_track_length:
-                raise ValueError(
-                    'Track too short (min. {}, current len {})'.format(min_track_length, music_track.duration))
+    def __get_target_speech_rms_amplitude(self):
+        return self.__rms_amplitude * self.__config.speech_volume_factor
 
-            # check if we can create output file too
-            if not self.__config.dry_run_mode:
-                if os.path.exists(self.get_out_file_name(music_track)) and not self.__config.force_overwrite:
-                    raise OSError('Target "{}" already exists. Use -f to force overwrite.'.format(
-                        self.get_out_file_name(music_track)))
+    def __stage_gain(self):
+        if self.__envelope_loudness:
+            self.__gain_clips_from_envelope()
+        else:
+            wavs = self.__overlay_wav if self.__overlay_wav is not None else self.__clip_files
+            self.__backends.get(Config.BACKEND_STAGE_MIX).adjust_wav_amplitude(
+                wavs, self.__get_target_speech_rms_amplitude())
+        self.__scratch.update_high_water_mark('speech')
+
+    def __gain_clips_from_envelope(self):
+        """Gains each spoken clip to match loudness of the music it is played over. Levels are rounded to
+        half a dB, and clips sharing the level are adjusted by single normalize run.
+        """
+        clips_by_amplitude = {}
+        amplitudes = []
+        for idx, (offset, _) in enumerate(self.__events):
+            clip_file = self.__clip_files[idx]
+            duration = self.__clip_durations[idx]
+            amplitude = self.__envelope.get_rms_between(offset, offset + duration) * self.__config.speech_volume_factor
+            if amplitude > 0:
+                amplitude = math.pow(10, round(40 * math.log10(amplitude)) / 40.0)
+            amplitudes.append(amplitude)
+            clips_by_amplitude.setdefault(amplitude, []).append(clip_file)
+
+        backend = self.__backends.get(Config.BACKEND_STAGE_MIX)
+        for amplitude, clip_files in clips_by_amplitude.items():
+            backend.adjust_wav_amplitude(clip_files, amplitude)
+        self.__speech_rms_amplitudes = amplitudes
+
+    def __stage_concat(self):
+        self.__speech_wav = os.path.join(self.__tmp_dir, 'speech.wav')
+        self.__create_voice_wav(self.__clip_files, self.__speech_wav)
+        self.__scratch.update_high_water_mark('speech')
+
+    def __stage_concat_overlay(self):
+        self.__overlay_wav = os.path.join(self.__tmp_dir, 'overlay.wav')
+        self.__backends.get(Config.BACKEND_STAGE_MIX).concat_wav_files(self.__overlay_wav, self.__clip_files)
+        self.__scratch.update_high_water_mark('speech')
+
+    def __get_mix_sources(self):
+        if self.__pipeline == Config.PIPELINE_SINGLE_PASS:
+            # clip files come in events order
+            return ((self.__clip_files[idx], offset) for idx, (offset, _) in enumerate(self.__events))
+        return [self.__music_wav, self.__speech_wav]
+
+    def __stage_mix(self):
+        music_track = self.__music_track
+        if self.__to_stdout:
+            Log.i('Writing to stdout')
+
+            self.__mix(self.__pipeline, music_track, self.STDOUT, self.__get_mix_sources(), self.__get_stdout())
+        else:
+            Log.i('Writing: "{}"'.format(self.__file_out))
 
-                # create temporary folder
-                self.__make_temp_dir()
+            self.__tmp_mp3_file = self.__get_tmp_file_name(self.__file_out)
+            self.__mix(self.__pipeline, music_track, self.__tmp_mp3_file, self.__get_mix_sources())
 
-            # let's now create WAVs with our spoken parts.
-            ticks = range(self.__config.tick_offset, music_track.duration, self.__config.tick_interval)
-            extras = {'config_name': self.__config.name}
+    def __get_tmp_file_name(self, file_out):
+        if self.__staging is not None:
+            return self.__staging.get_tmp_file_name(file_out)
+
+        # noinspection PyProtectedMember
+        return os.path.join(os.path.dirname(file_out),
+                            next(tempfile._get_candidate_names()) + os.path.splitext(file_out)[1])
+
+    def __get_companion_tmp_file_name(self, file_out):
+        """Returns name of temporary file given companion of the output file is to be written to. It is committed
+        along with the output file by __commit_tmp_mp3_file(), in the order the names were requested in.
+        """
+        tmp_file = self.__get_tmp_file_name(file_out)
+        self.__companion_files.append((tmp_file, file_out))
+        return tmp_file
+
+    def __commit_tmp_mp3_file(self):
+        self.__output_size = os.path.getsize(self.__tmp_mp3_file)
+        companion_files = self.__companion_files
+        if self.__staging is not None:
+            # copied to the destination in background
+            with self.__commit_lock:
+                self.__commit_pending = True
+            self.__staging.commit(self.__tmp_mp3_file, self.__file_out, self.__output_committed, companion_files)
+            self.__tmp_mp3_file = None
+            self.__companion_files = []
+            return
+
+        for tmp_file, file_out in [(self.__tmp_mp3_file, self.__file_out)] + companion_files:
+            if os.path.exists(file_out):
+                os.remove(file_out)
+            os.rename(tmp_file, file_out)
+        self.__tmp_mp3_file = None
+        self.__companion_files = []
+
+    def __output_committed(self, error):
+        """Called by Staging once output file reached its destination or failed to
+        """
+        with self.__commit_lock:
+            self.__commit_pending = False
+            self.__commit_error = error
+            callbacks = self.__on_committed
+            self.__on_committed = []
+
+        _ = [callback() for callback in callbacks]
+
+    def __stage_tag(self):
+        # tags are already written by the encoder, so finished file only needs to replace the target
+        self.__commit_tmp_mp3_file()
+
+    def __stage_encode_overlay(self):
+        Log.i('Writing: "{}"'.format(self.__file_out))
+
+        # committed by __stage_overlay_sidecar(), along with files describing it
+        self.__tmp_mp3_file = self.__get_tmp_file_name(self.__file_out)
+        self.__backends.get(Config.BACKEND_STAGE_MIX).encode_overlay(self.__overlay_wav, self.__tmp_mp3_file)
+
+    def __stage_overlay_sidecar(self):
+        """Writes JSON sidecar file describing where each segment of speech overlay should be played in the
+        source track, plus optional CUE sheet and copy of source track with segments as ID3 chapters. All these
+        are committed right after the overlay file, with the sidecar being the last, so its fingerprint is never
+        found next to missing or partial overlay.
+        """
+        music_track = self.__music_track
+        file_out = self.__file_out
+        target_speech_rms_amplitude = self.__get_target_speech_rms_amplitude()
+
+        events = []
+        overlay_offset = 0.0
+        for idx, (offset, segment_text) in enumerate(self.__events):
+            events.append({
+                'index': idx,
+                'text': segment_text,
+                'offset': offset,
+                'overlay_offset': round(overlay_offset, 3),
+                'duration': round(self.__clip_durations[idx], 3),
+            })
+            if self.__speech_rms_amplitudes is not None:
+                events[-1]['speech_rms_amplitude'] = min(self.__speech_rms_amplitudes[idx], 1.0)
+            overlay_offset += self.__clip_durations[idx]
+
+        out_base = os.path.splitext(file_out)[0]
+
+        sidecar = {
+            'generator': '{app} v{v}'.format(app=APP_NAME, v=VERSION),
+            'source': music_track.file_name,
+            'source_duration': round(music_track.duration_seconds, 3),
+            'overlay': os.path.basename(file_out),
+            'fingerprint': self.get_render_plan().fingerprint,
+            'gain': {
+                'source_rms_amplitude': self.__rms_amplitude,
+                'speech_volume_factor': self.__config.speech_volume_factor,
+                'speech_rms_amplitude': min(target_speech_rms_amplitude, 1.0),
+                'loudness': self.__get_loudness_mode(),
+                'loudness_error_db': self.__loudness_error_db,
+            },
+            'events': events,
+        }
+        if self.__config.overlay_cue:
+            cue_file = out_base + '.cue'
+            Log.i('Writing: "{}"'.format(cue_file))
+            self.__write_cue(self.__get_companion_tmp_file_name(cue_file), music_track, os.path.basename(file_out),
+                             events)
+
+        if self.__config.overlay_chapters:
+            chapters_file = out_base + '.chapters.' + Util.split_file_name(music_track.file_name)[1]
+            Log.i('Writing: "{}"'.format(chapters_file))
+            tmp_chapters_file = self.__get_companion_tmp_file_name(chapters_file)
+            if music_track.data is not None:
+                with open(tmp_chapters_file, 'wb') as fh:
+                    fh.write(music_track.data)
+            else:
+                shutil.copyfile(music_track.get_source_file(), tmp_chapters_file)
+            music_track.write_chapters(tmp_chapters_file, [(event['offset'], event['text']) for event in events])
+
+        sidecar_file = out_base + '.json'
+        Log.i('Writing: "{}"'.format(sidecar_file))
+        with open(self.__get_companion_tmp_file_name(sidecar_file), 'w') as fh:
+            json.dump(sidecar, fh, indent=2, sort_keys=True)
+
+        self.__commit_tmp_mp3_file()
+
+    def __mix(self, pipeline, music_track, file_out, sources, stdout=None):
+        """Mixes speech into music using given pipeline. Tags (incl. cover art) of the source track are
+        written by the encoder, so output file is written just once.
+
+        Args:
+            :sources list of (clip WAV, offset) tuples for single-pass pipeline, [music WAV, speech WAV] otherwise
+        """
+        output_args = self.__encoder.get_output_args(music_track, file_out == self.STDOUT)
+        id3 = self.__encoder.is_mp3()
+        fingerprint = self.get_render_plan().fingerprint
+        backend = self.__backends.get(Config.BACKEND_STAGE_MIX)
+        if pipeline == Config.PIPELINE_SINGLE_PASS:
+            # source track is the first input already
+            metadata_args = music_track.get_ffmpeg_metadata_args(0, id3, fingerprint)
+            backend.mix_speech_clips(file_out, music_track.get_ffmpeg_input(), output_args, sources,
+                                     metadata_args, music_track.data, stdout)
+        else:
+            # source track goes after the WAVs, just to copy tags and cover art from
+            metadata_args = music_track.get_ffmpeg_metadata_args(len(sources), id3, fingerprint)
+            backend.mix_wav_tracks(file_out, output_args, sources, metadata_args, stdout,
+                                   music_track.get_ffmpeg_input(), music_track.data)
+
+    @staticmethod
+    def __write_cue(cue_file, music_track, overlay_file_name, events):
+        """Writes CUE sheet with one track per speech event. INDEX points to position in overlay file
+        while "REM OFFSET" holds position (in seconds) the segment should be played at in the source track.
+        """
+        def cue_time(seconds):
+            # CUE uses mm:ss:ff notation, with 75 frames per second
+            frames = int(round(seconds * 75))
+            return '{:02d}:{:02d}:{:02d}'.format(frames // (60 * 75), (frames // 75) % 60, frames % 75)
+
+        lines = [
+            'REM GENERATOR "{app} v{v}"'.format(app=APP_NAME, v=VERSION),
+            'REM SOURCE "{}"'.format(os.path.basename(music_track.file_name)),
+            'FILE "{}" MP3'.format(overlay_file_name),
+        ]
+        for event in events:
+            lines.extend([
+                '  TRACK {:02d} AUDIO'.format(event['index'] + 1),
+                '    TITLE "{}"'.format(event['text'].replace('"', "'")),
+                '    REM OFFSET {:.3f}'.format(event['offset']),
+                '    INDEX 01 {}'.format(cue_time(event['overlay_offset'])),
+            ])
+
+        with open(cue_file, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+    # *****************************************************************************************************************
+
+    @property
+    def file_name(self):
+        """Name of the source file of this job
+        """
+        return self.__file_name
+
+    @property
+    def music_track(self):
+        return self.__music_track
 
+    @property
+    def file_out(self):
+        """Name of the output file (or "-" for stdout), known once load() is done
+        """
+        return self.__file_out
+
+    @property
+    def pipeline(self):
+        """Pipeline used to mix the track, None in overlay mode
+        """
+        return self.__pipeline
+
+    @property
+    def segment_count(self):
+        """Number of spoken segments (title and time ticks)
+        """
+        return len(self.__events)
+
+    @property
+    def up_to_date(self):
+        """True if output file made from the same render plan exists already, so there's nothing to do
+        """
+        return self.__up_to_date
+
+    @property
+    def output_size(self):
+        """Size (in bytes) of written output file, None if nothing was written (yet) or it went to stdout
+        """
+        return self.__output_size
+
+    @property
+    def error(self):
+        """Exception that made voice_stamp() fail, if any
+        """
+        return self.__error
+
+    @property
+    def loudness_error_db(self):
+        """Estimated error (in dB) of music loudness, if it was estimated from sampled windows, otherwise None
+        """
+        return self.__loudness_error_db
+
+    @property
+    def scratch_high_water_mark(self):
+        """Peak size (in bytes) of temporary files seen so far
+        """
+        return self.__scratch.high_water_mark
+
+    def load(self, mp3_file_name, out_sub_dir='', data=None, music_track=None, plan=None):
+        """Reads the track, builds list of segments to be spoken and checks if output file can be written.
+        In dry-run mode, it also reports what would be done.
+
+        Args:
+            :mp3_file_name
+            :out_sub_dir sub directory of the output directory the output file should be written to
+            :data optional content of the MP3 file. If given, the file itself is not accessed
+            :music_track optional, already read Mp3FileInfo of the file
+            :plan optional RenderPlan of the track to be run instead of planning it again. Job's config must
+                  have plan's settings applied (see RenderPlan.apply_to())
+        """
+        music_track = self.__read(mp3_file_name, data, music_track)
+
+        with self.__stage(JobListener.STAGE_PLAN):
+            self.__plan(music_track, out_sub_dir, plan)
+
+    def make_plan(self, mp3_file_name, out_sub_dir=''):
+        """Reads and plans the track, leaving the output file alone
+
+        Returns:
+            RenderPlan
+        """
+        music_track = self.__read(mp3_file_name)
+
+        with self.__stage(JobListener.STAGE_PLAN):
+            self.__plan(music_track, out_sub_dir, prepare_output=False)
+
+        return self.get_render_plan()
+
+    def get_render_plan(self):
+        """Returns RenderPlan of loaded track
+        """
+        if self.__render_plan is None:
+            self.__render_plan = RenderPlan.build(self.__config, self.__music_track, self.__file_out,
+                                                  self.__events)
+        return self.__render_plan
+
+    def __read(self, mp3_file_name, data=None, music_track=None):
+        self.__file_name = mp3_file_name
+        local_file = self.__staging.acquire(mp3_file_name) if self.__staging is not None and data is None else None
+        if music_track is None:
+            with self.__stage(JobListener.STAGE_READ):
+                music_track = Mp3FileInfo(mp3_file_name, self.__metadata_index, data, local_file)
+        else:
+            music_track.local_file = local_file
+        self.__music_track = music_track
+        _ = [listener.job_started(self, music_track) for listener in self.__listeners]
+
+        return music_track
+
+    def __plan(self, music_track, out_sub_dir, plan=None, prepare_output=True):
+        """Checks the track and output file and builds list of segments to be spoken and where, unless
+        these are given by the plan
+        """
+        if plan is not None:
+            if plan.source_fingerprint != RenderPlan.get_source_fingerprint(music_track):
+                raise ValueError('Source file changed since it was planned')
+            file_out = plan.output
+        else:
+            # some sanity checks first
+            min_track_length = TickPlan.get_offset_seconds(self.__config)
+            if music_track.duration_seconds <= min_track_length:
+                raise ValueError('Track too short (min. {} secs, current len {:.0f} secs)'.format(
+                    min_track_length, music_track.duration_seconds))
+
+            file_out = self.get_out_file_name(music_track, out_sub_dir)
+
+        self.__file_out = file_out
+        self.__to_stdout = file_out == self.STDOUT
+        self.__render_plan = plan
+
+        if plan is not None and not self.__to_stdout and os.path.exists(file_out) \
+                and self.__read_output_fingerprint(file_out) == plan.fingerprint:
+            Log.i('Output "{}" is up to date'.format(file_out))
+            self.__up_to_date = True
+            return
+
+        # check if we can create output file too
+        if prepare_output and not self.__config.dry_run_mode:
+            if not self.__to_stdout and os.path.exists(file_out) and not self.__config.force_overwrite:
+                raise OSError('Target "{}" already exists. Use -f to force overwrite.'.format(file_out))
+
+            # mirror input directory tree in the output directory
+            out_dir = os.path.dirname(file_out)
+            if not self.__to_stdout and out_dir and not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+
+        # offsets (in seconds) at which each of segments is to be heard in the music track, with their texts.
+        # TickPlan generates these on the fly, each time iterated, so they are never held in memory all at once
+        if plan is not None:
+            events = plan.events
+            Log.i('Announced as "{}"'.format(next(iter(events), (0, ''))[1]))
+        else:
+            # let's now create WAVs with our spoken parts.
             # First goes track title, then time ticks
             # NOTE: we will generate title WAV even if i.e. title_format is empty. This is intentional, to keep
             #       further logic simpler, because if both title and tick formats would be empty, then skipping
             #       WAV generation would left us with no speech overlay file for processing and mixing.
             #       I do not want to have the checks for such case
-            track_title_to_speak = Util.prepare_for_speak(
-                Util.process_placeholders(self.__config.title_format,
-                                          Util.merge_dicts(music_track.get_placeholders(), extras)))
-            Log.i('Announced as "{}"'.format(track_title_to_speak))
+            events = TickPlan(self.__config, music_track)
+            Log.i('Announced as "{}"'.format(events.get_title()))
             Log.v('Announcement format "{}"'.format(self.__config.title_format))
 
-            segments = [track_title_to_speak]
-
-            if self.__config.tick_format != '':
-                for time_marker in ticks:
-                    minutes = time_marker + self.__config.tick_add
-                    extras = {'minutes': minutes,
-                              'minutes_digits': Util.separate_chars(minutes),
-                              }
-                    tick_string = Util.process_placeholders(self.__config.tick_format,
-                                                            Util.merge_dicts(music_track.get_placeholders(), extras))
-                    segments.append(Util.prepare_for_speak(tick_string))
+        self.__events = events
+
+        if self.__config.dry_run_mode:
+            Log.i('Duration {} mins, tick count: {}'.format(music_track.duration, len(events) - 1))
+            Log.v('Tick format "{}"'.format(self.__config.tick_format))
+
+        overlay_mode = self.__config.output_mode == Config.OUTPUT_MODE_OVERLAY
+
+        self.__sampled_loudness = self.__use_sampled_loudness()
+        self.__envelope_loudness = self.__use_envelope_loudness()
+
+        self.__pipeline = None
+        if not overlay_mode and prepare_output:
+            if not self.__backends.get(Config.BACKEND_STAGE_MIX).has_capability(self.__encoder.get_capability()):
+                raise RuntimeError('Installed ffmpeg does not support "{}" encoder profile'.format(
+                    self.__encoder.profile))
+
+            self.__pipeline, reason = self.select_pipeline(music_track)
+            Log.v('Pipeline: {} ({}), encoder: {}'.format(self.__pipeline, reason, self.__encoder.profile))
+
+        if self.__config.dry_run_mode:
+            output_file_msg = 'Output file "{}"'.format(file_out)
+            if os.path.exists(file_out):
+                output_file_msg += ' *** TARGET FILE ALREADY EXISTS ***'
+            Log.i(output_file_msg)
+            if overlay_mode:
+                Log.i('Output mode: {}'.format(self.__config.output_mode))
+            Log.v('Output file name format "{}"'.format(self.__config.file_out_format))
+            # plans of long tracks are long too, so these are for those asking for details only
+            if Log.verbose_level >= 1:
+                Log.v('Render plan:')
+                Log.v(self.get_render_plan().to_json().split('\n'))
+            Log.i('')
+
+    def __read_output_fingerprint(self, file_out):
+        """Returns render plan fingerprint existing output file was made with, or None if unknown
+        """
+        if self.__config.output_mode != Config.OUTPUT_MODE_OVERLAY:
+            return Mp3FileInfo.read_fingerprint(file_out)
 
-            if self.__config.dry_run_mode:
-                Log.i('Duration {} mins, tick count: {}'.format(music_track.duration, (len(segments) - 1)))
-                Log.v('Tick format "{}"'.format(self.__config.tick_format))
+        sidecar_file = os.path.splitext(file_out)[0] + '.json'
+        try:
+            with open(sidecar_file, 'r') as fh:
+                return json.load(fh).get('fingerprint')
+        except (IOError, OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def estimate_scratch_size(config, music_track, pipeline=None):
+        """Returns estimated size (in bytes) of temporary files needed to process given track
+
+        Args:
+            :config
+            :music_track Mp3FileInfo
+            :pipeline Config.PIPELINE_xxx to be used in mix mode
+        """
+        segment_count = 1 + TickPlan.get_tick_count(config, music_track)
+        overlay_mode = config.output_mode == Config.OUTPUT_MODE_OVERLAY
+        single_pass = pipeline == Config.PIPELINE_SINGLE_PASS
+        return Scratch.estimate_size(music_track, segment_count, overlay_mode, single_pass)
 
-            if not self.__config.dry_run_mode:
-                speech_wav_full = os.path.join(self.__tmp_dir, 'speech.wav')
+    def get_scratch_estimate(self):
+        """Returns estimated size (in bytes) of temporary files the job needs
+        """
+        if self.__up_to_date:
+            return 0
+        return self.estimate_scratch_size(self.__config, self.__music_track, self.__pipeline)
 
-                self.__create_voice_wav(segments, speech_wav_full)
+    def begin(self):
+        """Prepares the job for running its stages. Must be called after load()
+        """
+        if self.__up_to_date:
+            return
+        self.__tmp_dir = self.__scratch.make_dir(self.get_scratch_estimate())
 
-                # convert source music track to WAV
-                music_wav_full_path = os.path.join(self.__tmp_dir, os.path.basename(music_track.file_name) + '.wav')
-                music_track.to_wav(music_wav_full_path)
+    def get_stages(self):
+        """Returns stages needed to process loaded track, in order they can be run one after another
 
-                # calculate RMS amplitude of music track as reference to gain voice to match
-                rms_amplitude = self.__audio.calculate_rms_amplitude(music_wav_full_path)
+        Returns:
+            list of JobStage
+        """
+        if self.__config.dry_run_mode or self.__up_to_date:
+            return []
+
+        mem = self.PROCESS_MEMORY
+
+        if self.__config.output_mode == Config.OUTPUT_MODE_OVERLAY and self.__envelope_loudness:
+            # each clip is gained on its own, so clips are joined once gained
+            return [
+                JobStage(JobListener.STAGE_SPEECH, self.__stage_speech, memory=mem),
+                JobStage(JobListener.STAGE_ANALYZE, self.__stage_analyze, io=1, memory=mem),
+                JobStage(JobListener.STAGE_GAIN, self.__stage_gain,
+                         [JobListener.STAGE_SPEECH, JobListener.STAGE_ANALYZE], memory=mem),
+                JobStage(JobListener.STAGE_CONCAT, self.__stage_concat_overlay, [JobListener.STAGE_GAIN],
+                         memory=mem),
+                JobStage(JobListener.STAGE_ENCODE, self.__stage_encode_overlay, [JobListener.STAGE_CONCAT],
+                         memory=mem),
+                JobStage(JobListener.STAGE_TAG, self.__stage_overlay_sidecar, [JobListener.STAGE_ENCODE],
+                         cpu=0, io=1),
+            ]
+
+        if self.__config.output_mode == Config.OUTPUT_MODE_OVERLAY:
+            return [
+                JobStage(JobListener.STAGE_SPEECH, self.__stage_speech, memory=mem),
+                JobStage(JobListener.STAGE_CONCAT, self.__stage_concat_overlay, [JobListener.STAGE_SPEECH],
+                         memory=mem),
+                JobStage(JobListener.STAGE_ANALYZE, self.__stage_analyze, io=1, memory=mem),
+                JobStage(JobListener.STAGE_GAIN, self.__stage_gain,
+                         [JobListener.STAGE_CONCAT, JobListener.STAGE_ANALYZE], memory=mem),
+                JobStage(JobListener.STAGE_ENCODE, self.__stage_encode_overlay, [JobListener.STAGE_GAIN],
+                         memory=mem),
+                JobStage(JobListener.STAGE_TAG, self.__stage_overlay_sidecar, [JobListener.STAGE_ENCODE],
+                         cpu=0, io=1),
+            ]
+
+        if self.__pipeline == Config.PIPELINE_SINGLE_PASS:
+            stages = [
+                JobStage(JobListener.STAGE_SPEECH, self.__stage_speech, memory=mem),
+                JobStage(JobListener.STAGE_ANALYZE, self.__stage_analyze, io=1, memory=mem),
+                JobStage(JobListener.STAGE_GAIN, self.__stage_gain,
+                         [JobListener.STAGE_SPEECH, JobListener.STAGE_ANALYZE], memory=mem),
+                JobStage(JobListener.STAGE_MIX, self.__stage_mix, [JobListener.STAGE_GAIN], io=1, memory=mem),
+            ]
+        else:
+            # sampled loudness analysis reads the source file, so it does not need to wait for decoded WAV
+            analyze_deps = [] if self.__sampled_loudness else [JobListener.STAGE_DECODE]
+            stages = [
+                JobStage(JobListener.STAGE_SPEECH, self.__stage_speech, memory=mem),
+                JobStage(JobListener.STAGE_DECODE, self.__stage_decode, io=1, memory=mem),
+                JobStage(JobListener.STAGE_ANALYZE, self.__stage_analyze, analyze_deps, io=1, memory=mem),
+                JobStage(JobListener.STAGE_GAIN, self.__stage_gain,
+                         [JobListener.STAGE_SPEECH, JobListener.STAGE_ANALYZE], memory=mem),
+                JobStage(JobListener.STAGE_CONCAT, self.__stage_concat, [JobListener.STAGE_GAIN], memory=mem),
+                JobStage(JobListener.STAGE_MIX, self.__stage_mix,
+                         [JobListener.STAGE_DECODE, JobListener.STAGE_CONCAT], io=1, memory=mem),
+            ]
+
+        if not self.__to_stdout:
+            stages.append(JobStage(JobListener.STAGE_TAG, self.__stage_tag, [JobListener.STAGE_MIX], cpu=0, io=1))
+
+        return stages
+
+    def run_stage(self, stage):
+        """Runs given stage, notifying listeners
+        """
+        with self.__stage(stage.name):
+            stage.func()
 
-                target_speech_rms_amplitude = rms_amplitude * self.__config.speech_volume_factor
-                self.__audio.adjust_wav_amplitude(music_wav_full_path, target_speech_rms_amplitude)
+    def finish(self, success):
+        """Cleans up after the job, no matter if it succeeded or not
+        """
+        if self.__tmp_dir is not None:
+            self.__scratch.update_high_water_mark()
+            self.__scratch.log_summary()
+        self.__cleanup()
+        if self.__staging is not None and self.__file_name is not None:
+            self.__staging.release(self.__file_name)
+        _ = [listener.job_finished(self, self.__music_track, success) for listener in self.__listeners]
+
+    def notify_file_finished(self, file_name, success, error=None):
+        """Tells listeners processing of the file is over (see JobListener.file_finished()). If output file is
+        still being committed by Staging, they are told once it is, from its thread, and failed commit makes
+        the file failed.
+
+        Args:
+            :file_name name the file is reported by
+            :success
+            :error optional exception that made processing fail
+        """
+        def notify():
+            commit_error = self.__commit_error
+            _ = [listener.file_finished(file_name, success and commit_error is None,
+                                        error if error is not None else commit_error)
+                 for listener in self.__listeners]
+
+        with self.__commit_lock:
+            if self.__commit_pending:
+                self.__on_committed.append(notify)
+                return
+        notify()
+
+    def voice_stamp(self, mp3_file_name, out_sub_dir='', data=None, plan=None):
+        """Voice stamps given MP3 file, running all the stages one after another
+
+        Args:
+            :mp3_file_name
+            :out_sub_dir sub directory of the output directory the output file should be written to
+            :data optional content of the MP3 file. If given, the file itself is not accessed
+            :plan optional RenderPlan to run (see load())
+        """
+        result = True
+        finished = False
 
-            # mix all stuff together
-            file_out = self.get_out_file_name(music_track)
+        try:
+            Log.level_push('Processing "{}"'.format(mp3_file_name))
+            self.load(mp3_file_name, out_sub_dir, data, plan=plan)
 
             if not self.__config.dry_run_mode:
-                Log.i('Writing: "{}"'.format(file_out))
-
-                # noinspection PyProtectedMember
-                self.__tmp_mp3_file = os.path.join(os.path.dirname(file_out),
-                                                   next(tempfile._get_candidate_names()) + '.mp3')
-
-                # noinspection PyUnboundLocalVariable
-                self.__audio.mix_wav_tracks(self.__tmp_mp3_file, music_track.get_encoding_quality_for_lame_encoder(),
-                                            [music_wav_full_path, speech_wav_full])
+                self.begin()
+                for stage in self.get_stages():
+                    self.run_stage(stage)
 
-                # copy some ID tags to newly create MP3 file
-                music_track.write_id3_tags(self.__tmp_mp3_file)
-
-                if os.path.exists(file_out):
-                    os.remove(file_out)
-
-                os.rename(self.__tmp_mp3_file, file_out)
-                self.__tmp_mp3_file = None
-            else:
-                output_file_msg = 'Output file "{}"'.format(file_out)
-                if os.path.exists(self.get_out_file_name(music_track)):
-                    output_file_msg += ' *** TARGET FILE ALREADY EXISTS ***'
-                Log.i(output_file_msg)
-                Log.v('Output file name format "{}"'.format(self.__config.file_out_format))
-                Log.i('')
+            finished = True
 
         except RuntimeError as ex:
+            self.__error = ex
             if not self.__config.debug:
                 Log.e(ex)
             else:
@@ -234,7 +943,7 @@ class Job(object):
             result = False
 
         finally:
+            self.finish(result and finished)
             Log.level_pop()
-            self.__cleanup()
 
         return result
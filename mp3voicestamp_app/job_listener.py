@@ -0,0 +1,69 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+
+class JobListener(object):
+    """Base class for objects interested in Job's progress. All methods are no-ops, so subclasses
+    override only what they need. Methods are called from the thread running the job.
+    """
+
+    # names of processing stages reported by Job
+    STAGE_READ = 'read'
+    STAGE_PLAN = 'plan'
+    STAGE_SPEECH = 'speech'
+    STAGE_DECODE = 'decode'
+    STAGE_ANALYZE = 'analyze'
+    STAGE_GAIN = 'gain'
+    STAGE_CONCAT = 'concat'
+    STAGE_MIX = 'mix'
+    STAGE_ENCODE = 'encode'
+    STAGE_TAG = 'tag'
+
+    def track_read(self, music_track):
+        """Called by Scheduler once metadata of the file is read, which can be long before its job is started.
+        Unlike other methods, called from the thread running the scheduler.
+        """
+        pass
+
+    def job_started(self, job, music_track):
+        pass
+
+    def stage_started(self, job, stage):
+        pass
+
+    def stage_finished(self, job, stage, elapsed):
+        """
+        Args:
+            :job
+            :stage STAGE_xxx
+            :elapsed wall time (in seconds) the stage took
+        """
+        pass
+
+    def job_finished(self, job, music_track, success):
+        pass
+
+    def file_finished(self, file_name, success, error=None):
+        """Called once processing of given file is over, no matter if succeeded or not, also if
+        no job could be even created for the file (i.e. unreadable file).
+
+        Args:
+            :file_name
+            :success
+            :error optional exception that made processing fail
+        """
+        pass
@@ -0,0 +1,43 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+
+class JobStage(object):
+    """Single processing stage of the Job, together with stages it depends on and resources it needs
+    while running. Stages of a job form a small DAG, which lets Scheduler run independent stages
+    (of the same or different files) concurrently.
+    """
+
+    def __init__(self, name, func, deps=None, cpu=1, io=0, memory=0):
+        """
+        Args:
+            :name JobListener.STAGE_xxx
+            :func callable doing the work
+            :deps list of names of stages that must be completed first
+            :cpu number of CPU cores the stage keeps busy
+            :io number of heavy I/O streams (i.e. reading whole source or writing big WAV) the stage runs
+            :memory estimated memory (in bytes) used while running
+        """
+        self.name = name
+        self.func = func
+        self.deps = deps if deps is not None else []
+        self.cpu = cpu
+        self.io = io
+        self.memory = memory
+
+    def __repr__(self):
+        return 'JobStage({})'.format(self.name)
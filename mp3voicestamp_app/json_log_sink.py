@@ -0,0 +1,80 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+try:
+    # noinspection PyCompatibility
+    from queue import Queue
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from Queue import Queue
+
+
+class JsonLogSink(object):
+    """Writes log entries to file as JSON lines (one object per entry). Entries are queued and written by
+    background thread, so logging does not wait for disk I/O unless the queue is full.
+    """
+
+    # max number of entries waiting to be written, before logging starts to block
+    QUEUE_SIZE = 10000
+
+    __STOP = object()
+
+    def __init__(self, file_name):
+        self.__fh = open(file_name, 'a')
+        self.__queue = Queue(maxsize=self.QUEUE_SIZE)
+
+        self.__thread = threading.Thread(target=self.__worker, name='JsonLogSink')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def write(self, level, message, depth=0):
+        """Queues log entry for writing
+
+        Args:
+            :level entry level (i.e. "info", "error")
+            :message plain text message, with no ANSI codes
+            :depth nesting level of the entry
+        """
+        self.__queue.put({
+            'time': round(time.time(), 3),
+            'level': level,
+            'depth': depth,
+            'message': message,
+        })
+
+    def __worker(self):
+        while True:
+            entry = self.__queue.get()
+            if entry is self.__STOP:
+                break
+
+            self.__fh.write(json.dumps(entry, sort_keys=True) + '\n')
+            # flush once we caught up, not after each entry
+            if self.__queue.empty():
+                self.__fh.flush()
+
+        self.__fh.close()
+
+    def close(self):
+        """Writes all pending entries and closes the file
+        """
+        self.__queue.put(self.__STOP)
+        self.__thread.join()
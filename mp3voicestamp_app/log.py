@@ -8,12 +8,19 @@ Marcin Orlowski <orlowskim@google.com>
 
 from __future__ import print_function
 
-import inspect
 import re
 import sys
+import threading
+from collections import deque
 
 import os
 
+try:
+    # noinspection PyCompatibility
+    basestring
+except NameError:
+    basestring = str
+
 
 # ################################# LOG ##################################### #
 
@@ -61,19 +68,47 @@ class Log(object):
     COLOR_REPO = (ANSI_BG_CYAN + ANSI_BLACK)
     COLOR_LOCAL = (ANSI_REVERSE + ANSI_WHITE_BRIGHT)
 
+    __ANSI_RE = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+    __PLACEHOLDER_RE = re.compile(r'%(\w+)%')
+    __color_map = None
+
+    __MODULE_NAME = os.path.splitext(os.path.basename(__file__))[0]
+
     # ###########################################################################
 
+    # number of most recent entries kept in history
+    HISTORY_SIZE = 1000
+
+    LEVEL_INFO = 'info'
+    LEVEL_NOTICE = 'notice'
+    LEVEL_VERBOSE = 'verbose'
+    LEVEL_WARN = 'warning'
+    LEVEL_ERROR = 'error'
+    LEVEL_DEBUG = 'debug'
+
     deferred_log_level = None
     deferred_log_entry = None
     last_log_entry_level = 0
     log_level = 0
-    log_entries = []
+    log_entries = deque(maxlen=HISTORY_SIZE)
+
+    # optional JsonLogSink all entries are also written to
+    sink = None
+    # optional object with clear() method, removing live status line from terminal before we print
+    status_line = None
 
     verbose_level = 0
     debug = False
     no_color = False
     quiet = False
     skip_empty_lines = False
+    # where log lines are printed to. Switched to stderr when stdout carries audio data
+    stream = sys.stdout
+
+    # jobs run concurrently log from worker threads, so printing and history are guarded
+    __lock = threading.RLock()
+    # per thread state, i.e. prefix set with set_thread_prefix()
+    __local = threading.local()
 
     VERBOSE_NONE = 0
     VERBOSE_NORMAL = 1
@@ -92,6 +127,11 @@ class Log(object):
         cls.debug = config.debug
         cls.no_color = False
         cls.quiet = False
+        cls.stream = sys.stderr if '-' in [config.file_out, config.results_file] else sys.stdout
+
+        if config.log_json is not None:
+            from mp3voicestamp_app.json_log_sink import JsonLogSink
+            cls.sink = JsonLogSink(config.log_json)
 
         if config.debug and os.getenv('PYTHONDONTWRITEBYTECODE') is None:
             Log.e([
@@ -103,8 +143,24 @@ class Log(object):
                 '   export PYTHONDONTWRITEBYTECODE=1',
             ])
 
+    @classmethod
+    def close(cls):
+        """Flushes and closes log sink, if any
+        """
+        if cls.sink is not None:
+            cls.sink.close()
+            cls.sink = None
+
     # ###########################################################################
 
+    @staticmethod
+    def set_thread_prefix(prefix=None):
+        """Makes all entries logged by current thread start with given prefix (i.e. name of the file the
+        thread works on), instead of being indented by the shared level, which other threads change too.
+        Use None to remove the prefix.
+        """
+        Log.__local.prefix = prefix
+
     @staticmethod
     def level_init(message=None, color=None, ignore_quiet_switch=False):
         Log.log_level = 0
@@ -118,6 +174,7 @@ class Log(object):
 
             Log.deferred_log_level = Log.log_level
             Log.deferred_log_entry = Log.__format_log_line(message, color)
+            Log.__write_to_sink(Log.LEVEL_INFO, message)
         else:
             Log.__log(message, color, ignore_quiet_switch)
 
@@ -149,33 +206,35 @@ class Log(object):
     # notice
     @staticmethod
     def n(messages=None, color=COLOR_NOTICE, ignore_quiet_switch=False, add_to_history=True):
-        Log.__log(messages, color, ignore_quiet_switch, add_to_history)
+        Log.__log(messages, color, ignore_quiet_switch, add_to_history, Log.LEVEL_NOTICE)
 
     # verbose
     @staticmethod
     def v(messages=None):
         if Log.verbose_level >= 1:
-            Log.__log(messages)
+            Log.__log(messages, level=Log.LEVEL_VERBOSE)
 
     # very verbose
     @staticmethod
     def vv(messages=None):
         if Log.verbose_level >= 2:
-            Log.__log(messages)
+            Log.__log(messages, level=Log.LEVEL_VERBOSE)
 
     # warning
     @staticmethod
     def w(message=None):
         if message is not None:
             messages = Log.__to_list(message)
-            _ = [Log.__log('**WARN** ' + Log.strip_ansi(msg), Log.COLOR_WARN, True) for msg in messages]
+            _ = [Log.__log('**WARN** ' + Log.strip_ansi(msg), Log.COLOR_WARN, True, level=Log.LEVEL_WARN)
+                 for msg in messages]
 
     # error
     @staticmethod
     def e(messages=None):
         if messages is not None:
             messages = Log.__to_list(messages)
-            _ = [Log.__log('*** ' + Log.strip_ansi(message), Log.COLOR_ERROR, True) for message in messages]
+            _ = [Log.__log('*** ' + Log.strip_ansi(message), Log.COLOR_ERROR, True, level=Log.LEVEL_ERROR)
+                 for message in messages]
 
     # debug
     # NOTE: debug entries are not stored in action log
@@ -184,14 +243,19 @@ class Log(object):
         if messages is not None and Log.debug:
             postfix = Log.__get_stacktrace_string()
             for message in Log.__to_list(messages):
+                Log.__write_to_sink(Log.LEVEL_DEBUG, message)
                 raw_msg = message + ' [DEBUG]'
                 message = Log.__format_log_line(raw_msg, Log.COLOR_DEBUG, postfix)
                 postfix = ''
-                print(message)
+                with Log.__lock:
+                    Log.__clear_status_line()
+                    print(message, file=Log.stream)
 
     @staticmethod
     def get_entries():
-        return Log.log_entries
+        """Returns most recent log entries (up to HISTORY_SIZE)
+        """
+        return list(Log.log_entries)
 
     @staticmethod
     def abort(messages=None):
@@ -209,15 +273,17 @@ class Log(object):
     def __get_stacktrace_string():
         msg = ''
         if Log.debug:
-            frames = inspect.stack()
-            for offset in range(3, len(frames)):
-                frame = frames[offset][0]
-                info = inspect.getframeinfo(frame)
-                if os.path.basename(info.filename) != os.path.basename(__file__):
-                    msg = ' %black_bright%({file}:{line})%reset%'.format(
-                        file=os.path.basename(info.filename), line=info.lineno)
+            # walking frames directly is way cheaper than inspect.stack(), which also reads source
+            # code lines of each frame on the stack
+            # noinspection PyProtectedMember
+            frame = sys._getframe(1)
+            while frame is not None:
+                file_name = os.path.basename(frame.f_code.co_filename)
+                if os.path.splitext(file_name)[0] != Log.__MODULE_NAME:
+                    msg = ' %black_bright%({file}:{line})%reset%'.format(file=file_name, line=frame.f_lineno)
                     msg = Log.substitute_ansi(msg)
                     break
+                frame = frame.f_back
 
         return msg
 
@@ -232,8 +298,7 @@ class Log(object):
           message string witn ANSI codes striped or None
         """
         if message is not None:
-            pattern = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-            return pattern.sub('', message)
+            return Log.__ANSI_RE.sub('', message)
 
         return ''
 
@@ -247,35 +312,43 @@ class Log(object):
         Returns:
           message with placeholders replaced with ANSI codes
         """
-        color_map = {
-            'reset': Log.ANSI_RESET,
-            'reverse': Log.ANSI_REVERSE,
-
-            'black': Log.ANSI_BLACK,
-            'black_bright': Log.ANSI_BLACK_BRIGHT,
-            'red': Log.ANSI_RED,
-            'green': Log.ANSI_GREEN,
-            'green_bright': Log.ANSI_GREEN_BRIGHT,
-            'yellow': Log.ANSI_YELLOW,
-            'yellow_bright': Log.ANSI_YELLOW_BRIGHT,
-            'blue': Log.ANSI_BLUE,
-            'magenta': Log.ANSI_MAGENTA,
-            'cyan': Log.ANSI_CYAN,
-            'white': Log.ANSI_WHITE,
-
-            'error': Log.ANSI_RED,
-            'warn': Log.ANSI_YELLOW,
-            'notice': Log.ANSI_CYAN,
-            'info': None,
-            'ok': Log.ANSI_GREEN,
-            'debug': Log.ANSI_REVERSE,
-            'banner': (Log.ANSI_WHITE + Log.ANSI_REVERSE),
-        }
-
-        for (key, color) in color_map.items():
-            message = re.sub('%{key}%'.format(key=key), color if color is not None else '', message)
-
-        return message
+        if '%' not in message:
+            return message
+
+        if Log.__color_map is None:
+            Log.__color_map = {
+                'reset': Log.ANSI_RESET,
+                'reverse': Log.ANSI_REVERSE,
+
+                'black': Log.ANSI_BLACK,
+                'black_bright': Log.ANSI_BLACK_BRIGHT,
+                'red': Log.ANSI_RED,
+                'green': Log.ANSI_GREEN,
+                'green_bright': Log.ANSI_GREEN_BRIGHT,
+                'yellow': Log.ANSI_YELLOW,
+                'yellow_bright': Log.ANSI_YELLOW_BRIGHT,
+                'blue': Log.ANSI_BLUE,
+                'magenta': Log.ANSI_MAGENTA,
+                'cyan': Log.ANSI_CYAN,
+                'white': Log.ANSI_WHITE,
+
+                'error': Log.ANSI_RED,
+                'warn': Log.ANSI_YELLOW,
+                'notice': Log.ANSI_CYAN,
+                'info': None,
+                'ok': Log.ANSI_GREEN,
+                'debug': Log.ANSI_REVERSE,
+                'banner': (Log.ANSI_WHITE + Log.ANSI_REVERSE),
+            }
+
+        def substitute(match):
+            key = match.group(1)
+            if key not in Log.__color_map:
+                return match.group(0)
+            color = Log.__color_map[key]
+            return color if color is not None else ''
+
+        return Log.__PLACEHOLDER_RE.sub(substitute, message)
 
     # ###########################################################################
 
@@ -292,7 +365,11 @@ class Log(object):
           Formatted log line
         """
         if message is not None:
-            message = ' ' * (Log.log_level * 2) + Log.substitute_ansi(message)
+            prefix = getattr(Log.__local, 'prefix', None)
+            if prefix is not None:
+                message = '  [{}] {}'.format(prefix, Log.substitute_ansi(message))
+            else:
+                message = ' ' * (Log.log_level * 2) + Log.substitute_ansi(message)
 
             if Log.debug:
                 message = '%d: %s' % (Log.log_level, message)
@@ -311,28 +388,43 @@ class Log(object):
         return message
 
     @staticmethod
-    def __log(messages=None, color=None, ignore_quiet_switch=False, add_to_history=True):
-        if messages is not None:
-            Log.last_log_entry_level = Log.log_level
-            Log.__flush_deferred_entry()
+    def __write_to_sink(level, message):
+        if Log.sink is not None and message is not None:
+            Log.sink.write(level, Log.strip_ansi(Log.substitute_ansi(message)), Log.log_level)
 
+    @staticmethod
+    def __log(messages=None, color=None, ignore_quiet_switch=False, add_to_history=True, level=LEVEL_INFO):
+        if messages is not None:
             postfix = Log.__get_stacktrace_string()
-            for message in Log.__to_list(Log.__dict_to_list(messages, '%green%')):
-                use_message = False if Log.skip_empty_lines and message else True
-                if use_message:
-                    message = Log.__format_log_line(message, color, postfix)
-                    Log.__log_raw(message, ignore_quiet_switch, add_to_history)
-                    postfix = ''
+            # lines of multi-line entry are kept together
+            with Log.__lock:
+                Log.last_log_entry_level = Log.log_level
+                Log.__flush_deferred_entry()
+
+                for message in Log.__to_list(Log.__dict_to_list(messages, '%green%')):
+                    use_message = False if Log.skip_empty_lines and message else True
+                    if use_message:
+                        Log.__write_to_sink(level, message)
+                        message = Log.__format_log_line(message, color, postfix)
+                        Log.__log_raw(message, ignore_quiet_switch, add_to_history)
+                        postfix = ''
 
     @staticmethod
     def __log_raw(message=None, ignore_quiet_switch=False, add_to_history=True):
         if message is not None:
-            if add_to_history:
-                Log.log_entries.append(message)
+            with Log.__lock:
+                if add_to_history:
+                    Log.log_entries.append(message)
+
+                quiet = False if ignore_quiet_switch else Log.quiet
+                if not quiet:
+                    Log.__clear_status_line()
+                    print(message.rstrip(), file=Log.stream)
 
-            quiet = False if ignore_quiet_switch else Log.quiet
-            if not quiet:
-                print(message.rstrip())
+    @staticmethod
+    def __clear_status_line():
+        if Log.status_line is not None:
+            Log.status_line.clear()
 
     @staticmethod
     def __flush_deferred_entry():
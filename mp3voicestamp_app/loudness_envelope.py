@@ -0,0 +1,129 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import math
+
+try:
+    # vectorized sample math, optional as it is only needed for loudness envelope
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class LoudnessEnvelope(object):
+    """Short-term loudness of the track, as RMS amplitude of consecutive windows (400 ms, like EBU R128's
+    momentary loudness). It is built from 16 bit PCM stream, chunk by chunk, as the track is being decoded,
+    so the audio is never held in memory as a whole.
+    """
+
+    # in seconds
+    WINDOW_LENGTH = 0.4
+
+    # speech level follows the music around it, but only within this range (in dB) around overall level
+    # of the track, so i.e. ticks said over silent intro are still audible
+    GAIN_RANGE_DB = 12
+
+    def __init__(self, sample_rate, channels, window_length=WINDOW_LENGTH):
+        """
+        Args:
+            :sample_rate of PCM stream
+            :channels number of interleaved channels of PCM stream
+            :window_length in seconds
+        """
+        if numpy is None:
+            raise RuntimeError('Loudness envelope requires NumPy')
+
+        self.__window_length = window_length
+        # number of samples (of all the channels) per window
+        self.__window_size = max(1, int(round(sample_rate * window_length))) * channels
+
+        self.__pending = b''
+        self.__chunks = []
+        self.__sum_squares = 0.0
+        self.__sample_count = 0
+        self.__mean_squares = None
+
+    @staticmethod
+    def is_available():
+        """Tells if loudness envelope can be calculated, which requires NumPy
+        """
+        return numpy is not None
+
+    @staticmethod
+    def __to_samples(pcm):
+        return numpy.frombuffer(pcm, dtype=numpy.int16).astype(numpy.float64) / 32768.0
+
+    def add(self, pcm):
+        """Adds next chunk of 16 bit PCM samples in native byte order
+
+        Args:
+            :pcm bytes
+        """
+        data = self.__pending + pcm
+        window_bytes = self.__window_size * 2
+        windows = len(data) // window_bytes
+        if windows > 0:
+            squares = numpy.square(self.__to_samples(data[:windows * window_bytes]))
+            self.__chunks.append(squares.reshape(windows, self.__window_size).mean(axis=1))
+            self.__sum_squares += float(squares.sum())
+            self.__sample_count += squares.size
+        self.__pending = data[windows * window_bytes:]
+
+    def finish(self):
+        """Processes trailing, partial window. Must be called once all the PCM data is added
+        """
+        pending = self.__pending[:len(self.__pending) // 2 * 2]
+        if pending:
+            squares = numpy.square(self.__to_samples(pending))
+            self.__chunks.append(numpy.array([squares.mean()]))
+            self.__sum_squares += float(squares.sum())
+            self.__sample_count += squares.size
+        self.__pending = b''
+
+        self.__mean_squares = numpy.concatenate(self.__chunks) if self.__chunks else numpy.zeros(0)
+        self.__chunks = []
+
+    # *****************************************************************************************************************
+
+    def __len__(self):
+        """Returns number of windows
+        """
+        return len(self.__mean_squares)
+
+    def get_rms(self):
+        """Returns RMS amplitude of the whole track
+        """
+        return math.sqrt(self.__sum_squares / self.__sample_count) if self.__sample_count else 0.0
+
+    def get_rms_between(self, start, end):
+        """Returns RMS amplitude of windows overlapping given part of the track, limited to GAIN_RANGE_DB
+        around RMS amplitude of the whole track.
+
+        Args:
+            :start in seconds
+            :end in seconds
+        """
+        rms = self.get_rms()
+
+        first = max(0, int(math.floor(start / self.__window_length)))
+        last = min(len(self.__mean_squares), int(math.ceil(end / self.__window_length)))
+        if first >= last:
+            return rms
+
+        local_rms = math.sqrt(float(self.__mean_squares[first:last].mean()))
+        ratio = math.pow(10, self.GAIN_RANGE_DB / 20.0)
+        return min(rms * ratio, max(rms / ratio, local_rms))
@@ -0,0 +1,168 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
+
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.metrics import Metrics
+
+
+class MetadataIndex(object):
+    """Persistent (SQLite backed) cache of audio file metadata, so unchanged files do not need
+    to be opened and parsed again. Entries are keyed by file path and validated against file size
+    and modification time.
+    """
+
+    SCHEMA_VERSION = 1
+
+    # how many pending writes we collect before committing
+    COMMIT_EVERY = 250
+
+    def __init__(self, file_name):
+        self.__file_name = os.path.expanduser(file_name)
+        self.__lock = threading.Lock()
+        self.__pending_writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self.__db = sqlite3.connect(self.__file_name, check_same_thread=False)
+        self.__init_schema()
+
+    def __init_schema(self):
+        with self.__lock:
+            cursor = self.__db.cursor()
+            cursor.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            cursor.execute('SELECT value FROM meta WHERE key = ?', ('schema_version',))
+            row = cursor.fetchone()
+
+            if row is None or int(row[0]) != self.SCHEMA_VERSION:
+                if row is not None:
+                    Log.v('Metadata index schema changed. Rebuilding "{}"'.format(self.__file_name))
+                cursor.execute('DROP TABLE IF EXISTS files')
+                cursor.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                               ('schema_version', str(self.SCHEMA_VERSION)))
+
+            cursor.execute('CREATE TABLE IF NOT EXISTS files ('
+                           'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, data TEXT)')
+            self.__db.commit()
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def get_key(file_name):
+        """Returns index key of given file
+
+        Returns:
+            tuple (absolute path, size, mtime)
+        """
+        stat = os.stat(file_name)
+        return os.path.abspath(file_name), stat.st_size, stat.st_mtime
+
+    def get(self, file_name):
+        """Returns cached metadata of given file or None if file is not indexed or changed since.
+
+        Returns:
+            dict or None
+        """
+        path, size, mtime = self.get_key(file_name)
+
+        with self.__lock:
+            cursor = self.__db.cursor()
+            cursor.execute('SELECT size, mtime, data FROM files WHERE path = ?', (path,))
+            row = cursor.fetchone()
+
+            if row is None or row[0] != size or row[1] != mtime:
+                self.misses += 1
+                Metrics.cache_lookup('metadata_index', False)
+                return None
+
+            self.hits += 1
+            Metrics.cache_lookup('metadata_index', True)
+
+        return json.loads(row[2])
+
+    def put(self, file_name, data):
+        """Stores metadata of given file
+
+        Args:
+            :file_name
+            :data dict with metadata (must be JSON serializable)
+        """
+        path, size, mtime = self.get_key(file_name)
+
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO files (path, size, mtime, data) VALUES (?, ?, ?, ?)',
+                              (path, size, mtime, json.dumps(data)))
+
+            self.__pending_writes += 1
+            if self.__pending_writes >= self.COMMIT_EVERY:
+                self.__db.commit()
+                self.__pending_writes = 0
+
+    def close(self):
+        with self.__lock:
+            self.__db.commit()
+            self.__db.close()
+
+    # *****************************************************************************************************************
+
+    def reindex(self, file_names, read_func, threads):
+        """Refreshes index entries for all given files, reading metadata in parallel.
+
+        Args:
+            :file_names iterable with file names to index
+            :read_func callable returning metadata dict for given file name
+            :threads number of reading threads to use
+
+        Returns:
+            tuple (number of files indexed, number of failures)
+        """
+        def read(file_name):
+            try:
+                return file_name, read_func(file_name), None
+            except Exception as ex:
+                return file_name, None, ex
+
+        indexed = 0
+        failed = 0
+
+        pool = ThreadPool(threads)
+        try:
+            # reading runs in the pool, while writing the results is done here
+            for file_name, data, ex in pool.imap_unordered(read, file_names):
+                if ex is not None:
+                    Log.e('Failed to index "{}": {}'.format(file_name, ex))
+                    failed += 1
+                    continue
+
+                self.put(file_name, data)
+                indexed += 1
+                Log.v('Indexed "{}"'.format(file_name))
+        finally:
+            pool.close()
+            pool.join()
+
+        with self.__lock:
+            self.__db.commit()
+            self.__pending_writes = 0
+
+        return indexed, failed
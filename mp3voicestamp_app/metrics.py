@@ -0,0 +1,299 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+
+class Metrics(object):
+    """Process wide registry of counters, gauges and histograms, exported in Prometheus text format, either
+    to file (for node_exporter's textfile collector) or via HTTP "/metrics" endpoint on localhost.
+
+    Instrumentation calls are no-ops unless metrics are enabled (see start()), so they cost nothing in
+    regular runs.
+    """
+
+    PREFIX = 'mp3voicestamp_'
+
+    TYPE_COUNTER = 'counter'
+    TYPE_GAUGE = 'gauge'
+    TYPE_HISTOGRAM = 'histogram'
+
+    # in seconds
+    DURATION_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+    # in bytes, 1 MiB to 4 GiB
+    SIZE_BUCKETS = [float(1024 * 1024 * 4 ** power) for power in range(7)]
+
+    FILES_PROCESSED = 'files_processed_total'
+    FILES_FAILED = 'files_failed_total'
+    AUDIO_SECONDS = 'audio_seconds_total'
+    STAGE_DURATION = 'stage_duration_seconds'
+    SUBPROCESSES = 'subprocesses_total'
+    SUBPROCESS_FAILURES = 'subprocess_failures_total'
+    SUBPROCESS_DURATION = 'subprocess_duration_seconds'
+    CACHE_REQUESTS = 'cache_requests_total'
+    BYTES_READ = 'bytes_read_total'
+    BYTES_WRITTEN = 'bytes_written_total'
+    SCRATCH_PEAK = 'scratch_peak_bytes'
+    LAST_UPDATE = 'last_update_timestamp_seconds'
+
+    # name: (type, help, histogram buckets)
+    DEFINITIONS = {
+        FILES_PROCESSED: (TYPE_COUNTER, 'Files processed successfully.', None),
+        FILES_FAILED: (TYPE_COUNTER, 'Files that failed to be processed, by exception type.', None),
+        AUDIO_SECONDS: (TYPE_COUNTER, 'Duration of processed source audio.', None),
+        STAGE_DURATION: (TYPE_HISTOGRAM, 'Wall time of processing stages.', DURATION_BUCKETS),
+        SUBPROCESSES: (TYPE_COUNTER, 'External tool runs.', None),
+        SUBPROCESS_FAILURES: (TYPE_COUNTER, 'External tool runs that returned non-zero exit code.', None),
+        SUBPROCESS_DURATION: (TYPE_HISTOGRAM, 'Wall time of external tool runs.', DURATION_BUCKETS),
+        CACHE_REQUESTS: (TYPE_COUNTER, 'Cache lookups, by cache and result (hit or miss).', None),
+        BYTES_READ: (TYPE_COUNTER, 'Size of source files read.', None),
+        BYTES_WRITTEN: (TYPE_COUNTER, 'Size of output files written.', None),
+        SCRATCH_PEAK: (TYPE_HISTOGRAM, 'Peak size of temporary files of each job.', SIZE_BUCKETS),
+        LAST_UPDATE: (TYPE_GAUGE, 'Time metrics were last written.', None),
+    }
+
+    # how often (in seconds) textfile is rewritten during the batch
+    TEXTFILE_INTERVAL = 10
+
+    enabled = False
+
+    __lock = threading.Lock()
+    # (name, labels) -> value
+    __values = {}
+    # (name, labels) -> [bucket counts, sum, count]
+    __histograms = {}
+
+    __textfile = None
+    __textfile_thread = None
+    __stop_event = None
+    __http_server = None
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __get_key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    @staticmethod
+    def inc(name, value=1, **labels):
+        """Increases counter by given value
+        """
+        if Metrics.enabled:
+            key = Metrics.__get_key(name, labels)
+            with Metrics.__lock:
+                Metrics.__values[key] = Metrics.__values.get(key, 0) + value
+
+    @staticmethod
+    def set(name, value, **labels):
+        """Sets gauge value
+        """
+        if Metrics.enabled:
+            with Metrics.__lock:
+                Metrics.__values[Metrics.__get_key(name, labels)] = value
+
+    @staticmethod
+    def observe(name, value, **labels):
+        """Records value in histogram
+        """
+        if Metrics.enabled:
+            buckets = Metrics.DEFINITIONS[name][2]
+            key = Metrics.__get_key(name, labels)
+            with Metrics.__lock:
+                histogram = Metrics.__histograms.get(key)
+                if histogram is None:
+                    histogram = [[0] * len(buckets), 0.0, 0]
+                    Metrics.__histograms[key] = histogram
+
+                for idx, bound in enumerate(buckets):
+                    if value <= bound:
+                        histogram[0][idx] += 1
+                histogram[1] += value
+                histogram[2] += 1
+
+    @staticmethod
+    def subprocess_finished(cmd, rc, elapsed):
+        """Records run of external tool
+
+        Args:
+            :cmd executed binary
+            :rc its exit code
+            :elapsed wall time (in seconds)
+        """
+        if Metrics.enabled:
+            tool = os.path.basename(cmd)
+            if tool.lower().endswith('.exe'):
+                tool = tool[:-4]
+
+            Metrics.inc(Metrics.SUBPROCESSES, tool=tool)
+            if rc != 0:
+                Metrics.inc(Metrics.SUBPROCESS_FAILURES, tool=tool)
+            Metrics.observe(Metrics.SUBPROCESS_DURATION, elapsed, tool=tool)
+
+    @staticmethod
+    def cache_lookup(cache, hit):
+        Metrics.inc(Metrics.CACHE_REQUESTS, cache=cache, result='hit' if hit else 'miss')
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __format_labels(labels, extra=None):
+        labels = list(labels) + ([extra] if extra is not None else [])
+        if not labels:
+            return ''
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        return '{' + ','.join('{}="{}"'.format(key, escape(val)) for key, val in labels) + '}'
+
+    @staticmethod
+    def __format_value(value):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    @staticmethod
+    def render():
+        """Returns all metrics in Prometheus text exposition format
+        """
+        with Metrics.__lock:
+            values = dict(Metrics.__values)
+            histograms = {key: [list(val[0]), val[1], val[2]] for key, val in Metrics.__histograms.items()}
+
+        lines = []
+        for name in sorted(Metrics.DEFINITIONS.keys()):
+            metric_type, help_text, buckets = Metrics.DEFINITIONS[name]
+            full_name = Metrics.PREFIX + name
+            lines.append('# HELP {} {}'.format(full_name, help_text))
+            lines.append('# TYPE {} {}'.format(full_name, metric_type))
+
+            if metric_type == Metrics.TYPE_HISTOGRAM:
+                for (key_name, labels), (counts, total, count) in sorted(histograms.items()):
+                    if key_name != name:
+                        continue
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append('{}_bucket{} {}'.format(
+                            full_name, Metrics.__format_labels(labels, ('le', Metrics.__format_value(bound))),
+                            bucket_count))
+                    lines.append('{}_bucket{} {}'.format(full_name, Metrics.__format_labels(labels, ('le', '+Inf')),
+                                                         count))
+                    lines.append('{}_sum{} {}'.format(full_name, Metrics.__format_labels(labels),
+                                                      Metrics.__format_value(total)))
+                    lines.append('{}_count{} {}'.format(full_name, Metrics.__format_labels(labels), count))
+            else:
+                for (key_name, labels), value in sorted(values.items()):
+                    if key_name == name:
+                        lines.append('{}{} {}'.format(full_name, Metrics.__format_labels(labels),
+                                                      Metrics.__format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def write_textfile(file_name):
+        """Writes metrics to given file. File is replaced atomically, so collectors never see partial content
+        """
+        Metrics.set(Metrics.LAST_UPDATE, time.time())
+
+        tmp_file_name = '{}.{}'.format(file_name, os.getpid())
+        with open(tmp_file_name, 'w') as fh:
+            fh.write(Metrics.render())
+        if os.path.exists(file_name) and sys.platform == 'win32':
+            os.remove(file_name)
+        os.rename(tmp_file_name, file_name)
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __textfile_writer():
+        while not Metrics.__stop_event.wait(Metrics.TEXTFILE_INTERVAL):
+            try:
+                Metrics.write_textfile(Metrics.__textfile)
+            except (IOError, OSError):
+                # next attempt may succeed and final write reports the problem anyway
+                pass
+
+    @staticmethod
+    def __start_http_server(port):
+        try:
+            # noinspection PyCompatibility
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            # noinspection PyCompatibility,PyUnresolvedReferences
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = Metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # requests must not end up in our output
+                pass
+
+        # localhost only, metrics are not meant to be exposed to the network directly
+        server = HTTPServer(('127.0.0.1', port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, name='MetricsHttpServer')
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+    @staticmethod
+    def start(textfile=None, port=None):
+        """Enables metrics collection and starts exporting them
+
+        Args:
+            :textfile optional file name metrics are periodically written to
+            :port optional port of localhost HTTP server serving "/metrics"
+        """
+        Metrics.enabled = True
+
+        if textfile is not None:
+            Metrics.__textfile = textfile
+            Metrics.__stop_event = threading.Event()
+            Metrics.__textfile_thread = threading.Thread(target=Metrics.__textfile_writer, name='MetricsTextfile')
+            Metrics.__textfile_thread.daemon = True
+            Metrics.__textfile_thread.start()
+
+        if port is not None:
+            Metrics.__http_server = Metrics.__start_http_server(port)
+
+    @staticmethod
+    def stop():
+        """Stops exporters, writing final state of metrics to textfile (if used)
+        """
+        if Metrics.__textfile_thread is not None:
+            Metrics.__stop_event.set()
+            Metrics.__textfile_thread.join()
+            Metrics.__textfile_thread = None
+            Metrics.write_textfile(Metrics.__textfile)
+
+        if Metrics.__http_server is not None:
+            Metrics.__http_server.shutdown()
+            Metrics.__http_server.server_close()
+            Metrics.__http_server = None
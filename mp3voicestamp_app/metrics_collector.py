@@ -0,0 +1,48 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import os
+
+from mp3voicestamp_app.job_listener import JobListener
+from mp3voicestamp_app.metrics import Metrics
+
+
+class MetricsCollector(JobListener):
+    """Feeds job's progress into Metrics
+    """
+
+    def job_started(self, job, music_track):
+        Metrics.inc(Metrics.AUDIO_SECONDS, music_track.duration_seconds)
+        if music_track.data is not None:
+            Metrics.inc(Metrics.BYTES_READ, len(music_track.data))
+        elif os.path.isfile(music_track.file_name):
+            Metrics.inc(Metrics.BYTES_READ, os.path.getsize(music_track.file_name))
+
+    def stage_finished(self, job, stage, elapsed):
+        Metrics.observe(Metrics.STAGE_DURATION, elapsed, stage=stage)
+
+    def job_finished(self, job, music_track, success):
+        if job.scratch_high_water_mark > 0:
+            Metrics.observe(Metrics.SCRATCH_PEAK, job.scratch_high_water_mark)
+        if success and job.output_size is not None:
+            Metrics.inc(Metrics.BYTES_WRITTEN, job.output_size)
+
+    def file_finished(self, file_name, success, error=None):
+        if success:
+            Metrics.inc(Metrics.FILES_PROCESSED)
+        else:
+            Metrics.inc(Metrics.FILES_FAILED, reason=type(error).__name__ if error is not None else 'unknown')
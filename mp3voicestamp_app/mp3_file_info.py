@@ -16,11 +16,9 @@
 from __future__ import print_function
 
 import os
+from io import BytesIO
 
-from mutagen.mp3 import MP3
-# noinspection PyProtectedMember
-from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TALB, TPE1, TPE2, TCOM, TSSE, TOFN, TRCK
-
+# NOTE: mutagen is imported lazily, where needed, so it does not slow down app start when it is not used at all
 from mp3voicestamp_app.const import *
 from mp3voicestamp_app.util import Util
 
@@ -36,34 +34,92 @@ class Mp3FileInfo(object):
     TAG_COMMENT = 'COMM::XXX:'
     TAG_TRACK_NUMBER = 'TRCK'
 
+    # file name used for audio read from stdin
+    STDIN = '-'
+    STDIN_BASE_NAME = 'stdin'
+
     TAG_SOFTWARE = 'TSSE'
     TAG_ORIGINAL_FILENAME = 'TOFN'
+    # custom (TXXX in ID3) tag holding fingerprint of the render plan output file was made with
+    TAG_FINGERPRINT = 'mp3voicestamp_fingerprint'
+
+    # average bitrates (kbps) of LAME VBR presets, indexed by "-q:a" value
+    # https://trac.ffmpeg.org/wiki/Encode/MP3
+    LAME_VBR_AVERAGE_KBPS = [245, 225, 190, 175, 165, 130, 115, 100, 85, 65]
 
     # *****************************************************************************************************************
 
-    def __init__(self, file_name):
-        if not os.path.isfile(file_name):
-            raise OSError('File not found: "{}"'.format(file_name))
+    def __init__(self, file_name, index=None, data=None, local_file=None):
+        """Reads audio file information and tags.
 
-        mp3 = MP3(file_name)
+        Args:
+            :file_name
+            :index optional MetadataIndex instance. If given, metadata of unchanged files is served from it
+            :data optional content (bytes) of the file. If given, file_name is used for naming purposes only
+                  and the file is not accessed at all
+            :local_file optional local copy of the file (see Staging), read instead of the file itself
+        """
+        self.data = data
+        self.local_file = local_file
+
+        if data is None:
+            if not os.path.isfile(file_name):
+                raise OSError('File not found: "{}"'.format(file_name))
+            base_name, _ = Util.split_file_name(file_name)
+        else:
+            base_name = self.STDIN_BASE_NAME if file_name == self.STDIN else Util.split_file_name(file_name)[0]
+            index = None
 
-        base_name, _ = Util.split_file_name(file_name)
         self.base_name = base_name
         self.file_name = file_name
 
+        info = index.get(file_name) if index is not None else None
+        if info is None:
+            info = Mp3FileInfo.read_info(self.get_source_file() if data is None else BytesIO(data))
+            if index is not None:
+                index.put(file_name, info)
+
         # we round up duration to full minutes
-        self.duration = mp3.info.length
-        self.bitrate = mp3.info.bitrate
+        self.duration = info['duration']
+        self.bitrate = info['bitrate']
+        self.sample_rate = info['sample_rate']
+        self.channels = info['channels']
 
         # get track title either from tag, or from filename
-        self.title = self.__get_tag(mp3, self.TAG_TITLE)
-        self.artist = self.__get_tag(mp3, self.TAG_ARTIST)
-        self.album_artist = self.__get_tag(mp3, self.TAG_ALBUM_ARTIST)
-        self.album_title = self.__get_tag(mp3, self.TAG_ALBUM_TITLE)
-        self.composer = self.__get_tag(mp3, self.TAG_COMPOSER)
-        self.performer = self.__get_tag(mp3, self.TAG_PERFORMER)
-        self.comment = self.__get_tag(mp3, self.TAG_COMMENT)
-        self.track_number = self.__get_tag(mp3, self.TAG_TRACK_NUMBER)
+        tags = info['tags']
+        self.title = tags[self.TAG_TITLE]
+        self.artist = tags[self.TAG_ARTIST]
+        self.album_artist = tags[self.TAG_ALBUM_ARTIST]
+        self.album_title = tags[self.TAG_ALBUM_TITLE]
+        self.composer = tags[self.TAG_COMPOSER]
+        self.performer = tags[self.TAG_PERFORMER]
+        self.comment = tags[self.TAG_COMMENT]
+        self.track_number = tags[self.TAG_TRACK_NUMBER]
+
+    @staticmethod
+    def read_info(file_name):
+        """Opens given MP3 file (file name or file object) and reads all the information we need from it.
+
+        Returns:
+            dict with stream info and raw tag values, suitable for storing in MetadataIndex
+        """
+        from mutagen.mp3 import MP3
+
+        mp3 = MP3(file_name)
+
+        tags = {}
+        for tag in [Mp3FileInfo.TAG_TITLE, Mp3FileInfo.TAG_ARTIST, Mp3FileInfo.TAG_ALBUM_ARTIST,
+                    Mp3FileInfo.TAG_ALBUM_TITLE, Mp3FileInfo.TAG_COMPOSER, Mp3FileInfo.TAG_PERFORMER,
+                    Mp3FileInfo.TAG_COMMENT, Mp3FileInfo.TAG_TRACK_NUMBER]:
+            tags[tag] = Mp3FileInfo.__get_tag(mp3, tag)
+
+        return {
+            'duration': mp3.info.length,
+            'bitrate': mp3.info.bitrate,
+            'sample_rate': mp3.info.sample_rate,
+            'channels': mp3.info.channels,
+            'tags': tags,
+        }
 
     # *****************************************************************************************************************
 
@@ -75,6 +131,10 @@ class Mp3FileInfo(object):
     def duration(self, value):
         self.__duration = value
 
+    @property
+    def duration_seconds(self):
+        return self.__duration
+
     @property
     def bitrate(self):
         return self.__bitrate
@@ -141,20 +201,16 @@ class Mp3FileInfo(object):
 
     # *****************************************************************************************************************
 
-    def to_wav(self, output_file_name):
-        """ Converts source audio track to WAV format
+    def get_source_file(self):
+        """Returns name of the file track content is to be read from: local copy, if there is one
+        """
+        return self.local_file if self.local_file is not None else self.file_name
 
-        convert source mp3 to wav. this is required for many reasons:
-        * we need to adjust voice overlay amplitude to match MP3 file level and to do that we use "sox" too
-          which cannot deal with MP3 directly.
-        * there are some odd issues with "ffmpeg" failing during mixing phase when source is mp3 file.
-          blind guess for now is that it's due to some structure mismatch between MP3 file (i.e. having cover
-          image) and speech segments being just plain WAV. Most likely this can be solved better way but we
-          need WAV anyway so no point wasting time at the moment for further research.
+    def get_ffmpeg_input(self):
+        """Returns value to be used as ffmpeg's input ("-i") for this track. If track content is held
+        in memory, it must be then fed to ffmpeg's stdin.
         """
-        wav_cmd = ['ffmpeg', '-i', self.file_name, output_file_name]
-        if Util.execute_rc(wav_cmd) != 0:
-            raise RuntimeError('Failed to convert to WAV file')
+        return self.get_source_file() if self.data is None else 'pipe:0'
 
     # *****************************************************************************************************************
 
@@ -164,7 +220,7 @@ class Mp3FileInfo(object):
            Based on https://trac.ffmpeg.org/wiki/Encode/MP3
         """
         quality = 0
-        for avg in [245, 225, 190, 175, 165, 130, 115, 100, 85, 65]:
+        for avg in self.LAME_VBR_AVERAGE_KBPS:
             if self.bitrate >= avg * 1000:
                 break
             else:
@@ -174,26 +230,107 @@ class Mp3FileInfo(object):
 
     # *****************************************************************************************************************
 
-    def write_id3_tags(self, file_name):
-        """Writes ID3 tags from out music file into given MP3 file
+    def get_ffmpeg_metadata_args(self, source_index=None, id3=True, fingerprint=None):
+        """Returns ffmpeg arguments making the muxer write output file tags while encoding, so the file
+        does not need to be rewritten once encoded.
+
+        Args:
+            :source_index optional index of ffmpeg input holding this track. If given, all its tags are
+                          copied to the output and, for ID3 tagged output, its cover art (APIC) too
+            :id3 True if output is MP3 (ID3 tagged) file
+            :fingerprint optional fingerprint of the render plan (see RenderPlan) to be stored in the tags
+
+        Returns:
+            list
+        """
+        metadata = [
+            ('title', '{} (Mp3VoiceStamp)'.format(self.title)),
+            ('album', self.album_title),
+            ('album_artist', self.album_artist),
+            ('artist', self.artist),
+            ('composer', self.composer),
+            ('track', self.track_number),
+            (self.TAG_ORIGINAL_FILENAME, self.file_name),
+        ]
+        software = '{app} v{v} {url}'.format(app=APP_NAME, v=VERSION, url=APP_URL)
+
+        args = []
+        if source_index is not None:
+            args.extend(['-map_metadata', str(source_index)])
+            if id3:
+                # cover art is stored as (optional) video stream, which we copy as is
+                args.extend(['-map', '{}:v?'.format(source_index), '-c:v', 'copy'])
+
+        if id3:
+            # muxer would otherwise replace our TSSE frame with its own "encoder" tag
+            metadata.append((self.TAG_SOFTWARE, software))
+            args.extend(['-fflags', '+bitexact'])
+        else:
+            metadata.append(('encoder', software))
+
+        if fingerprint is not None:
+            metadata.append((self.TAG_FINGERPRINT, fingerprint))
+
+        for key, val in metadata:
+            args.extend(['-metadata', '{}={}'.format(key, val)])
+
+        return args
+
+    @staticmethod
+    def read_fingerprint(file_name):
+        """Returns render plan fingerprint stored in tags of given (output) file, or None if there is none
+        or the file cannot be read. ID3 (MP3) and Vorbis comments (Opus) tags are supported.
+        """
+        from mutagen import File, MutagenError
+
+        try:
+            audio = File(file_name)
+        except (MutagenError, IOError, OSError):
+            return None
+        if audio is None or audio.tags is None:
+            return None
+
+        if hasattr(audio.tags, 'getall'):
+            for frame in audio.tags.getall('TXXX'):
+                if frame.desc.lower() == Mp3FileInfo.TAG_FINGERPRINT and frame.text:
+                    return frame.text[0]
+            return None
+
+        values = audio.tags.get(Mp3FileInfo.TAG_FINGERPRINT) if hasattr(audio.tags, 'get') else None
+        return values[0] if values else None
+
+    # *****************************************************************************************************************
+
+    def write_chapters(self, file_name, events):
+        """Writes given speech events as ID3 chapter frames (CHAP + CTOC) into given MP3 file
 
         Args:
             :file_name
+            :events list of (offset_seconds, text) tuples, sorted by offset
         """
+        from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, CHAP, CTOC, CTOCFlags
+
         try:
             tags = ID3(file_name)
         except ID3NoHeaderError:
-            # Adding ID3 header
             tags = ID3()
 
-        tags[self.TAG_TITLE] = TIT2(encoding=3, text='{} (Mp3VoiceStamp)'.format(self.title))
-        tags[self.TAG_ALBUM_TITLE] = TALB(encoding=3, text=self.album_title)
-        tags[self.TAG_ALBUM_ARTIST] = TPE2(encoding=3, text=self.album_artist)
-        tags[self.TAG_ARTIST] = TPE1(encoding=3, text=self.artist)
-        tags[self.TAG_COMPOSER] = TCOM(encoding=3, text=self.composer)
-        tags[self.TAG_TRACK_NUMBER] = TRCK(encoding=3, text=self.track_number)
+        tags.delall('CHAP')
+        tags.delall('CTOC')
+
+        track_end_ms = int(self.duration_seconds * 1000)
+        element_ids = []
+        for idx, (offset, text) in enumerate(events):
+            element_id = u'chp{}'.format(idx)
+            element_ids.append(element_id)
+
+            start_ms = int(offset * 1000)
+            end_ms = int(events[idx + 1][0] * 1000) if idx + 1 < len(events) else track_end_ms
+            tags.add(CHAP(element_id=element_id, start_time=start_ms, end_time=max(start_ms, end_ms),
+                          sub_frames=[TIT2(encoding=3, text=text)]))
 
-        tags[self.TAG_ORIGINAL_FILENAME] = TOFN(encoding=3, text=self.file_name)
-        tags[self.TAG_SOFTWARE] = TSSE(encoding=3, text='{app} v{v} {url}'.format(app=APP_NAME, v=VERSION, url=APP_URL))
+        tags.add(CTOC(element_id=u'toc', flags=CTOCFlags.TOP_LEVEL | CTOCFlags.ORDERED,
+                      child_element_ids=element_ids,
+                      sub_frames=[TIT2(encoding=3, text=APP_NAME)]))
 
         tags.save(file_name)
@@ -17,13 +17,19 @@ from __future__ import print_function
 
 import sys
 from mp3voicestamp_app.args import Args
+from mp3voicestamp_app.backends import Backends
 from mp3voicestamp_app.config import Config
+from mp3voicestamp_app.file_scanner import FileScanner
 from mp3voicestamp_app.job import Job
+from mp3voicestamp_app.metrics import Metrics
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.render_plan import RenderPlan
+from mp3voicestamp_app.tick_plan import TickPlan
 from mp3voicestamp_app.tools import Tools
 from mp3voicestamp_app.const import *
 from mp3voicestamp_app.log import Log
 
-from mutagen import MutagenError
+# NOTE: heavier modules (mutagen, sqlite3, multiprocessing) are imported lazily, only when really needed
 
 
 class App(object):
@@ -33,41 +39,153 @@ class App(object):
         rc = 0
 
         config = Config()
+        metadata_index = None
+        progress = None
+        staging = None
+        profiler = None
+        results = None
 
         try:
             # parse common line arguments
             args = Args.parse_args(config)
 
+            # configure first, so nothing gets printed to stdout if it is used for audio output
+            Log.configure(config)
+
+            if config.profile_dir is not None:
+                from mp3voicestamp_app.profiler import Profiler
+                profiler = Profiler(config.profile_dir, config.profile_memory)
+                profiler.start()
+
+            # started early, so tool and cache lookups are counted too
+            if config.metrics_file is not None or config.metrics_port is not None:
+                Metrics.start(config.metrics_file, config.metrics_port)
+
             Log.i(['{app} v{v} by Marcin Orlowski <{e}>'.format(app=APP_NAME, v=VERSION, e=APP_EMAIL),
                    APP_URL,
                    ''
                    ])
 
-            Log.configure(config)
-
-            # check runtime environment
+            # check runtime environment, unless all the audio work is faked
             tools = Tools()
-            tools.check_env()
+            if Backends.needs_tools(config):
+                tools.check_env()
+
+            if config.metadata_index is not None:
+                from mp3voicestamp_app.metadata_index import MetadataIndex
+                metadata_index = MetadataIndex(config.metadata_index)
+
+            # directories given as input are scanned lazily, so processing starts as soon as first file is found
+            if config.run_plans:
+                scanner = FileScanner(['*.json'], config.exclude, None)
+            else:
+                scanner = FileScanner(config.include, config.exclude,
+                                      config.file_out_format if config.skip_stamped else None)
+            input_files = scanner.scan_ahead(config.files_in)
 
             if args.config_save_name is not None:
                 config.save(args.config_save_name)
+            elif config.reindex:
+                indexed, failed = metadata_index.reindex((file_name for file_name, _ in input_files),
+                                                         Mp3FileInfo.read_info, config.io_threads)
+                Log.i('Files indexed: {}, failed: {}'.format(indexed, failed))
+                if failed:
+                    rc = 1
+            elif config.estimate_mode:
+                from mp3voicestamp_app.estimator import Estimator
+                if Estimator(config, metadata_index).run(file_name for file_name, _ in input_files) > 0:
+                    rc = 1
+            elif config.plan_dir is not None:
+                from mutagen import MutagenError
+
+                written = 0
+                failed = 0
+                for file_name, out_sub_dir in input_files:
+                    try:
+                        plan = Job(config, tools, metadata_index).make_plan(file_name, out_sub_dir)
+                        Log.v('Plan of "{}" written to "{}"'.format(file_name, plan.save(config.plan_dir, out_sub_dir)))
+                        written += 1
+                    except (MutagenError, ValueError, IOError, OSError) as ex:
+                        if config.debug:
+                            raise
+                        Log.e('{}: {}'.format(file_name, ex))
+                        failed += 1
+                Log.i('Plans written: {}, failed: {}'.format(written, failed))
+                if failed:
+                    rc = 1
             else:
-                batch_mode = len(config.files_in) > 1
+                from mutagen import MutagenError
+
+                batch_mode = config.is_batch_mode()
+
+                listeners = []
+                if profiler is not None:
+                    listeners.append(profiler)
+                if config.progress or config.progress_file is not None:
+                    from mp3voicestamp_app.progress import Progress
+                    # progress is weighted by duration, so we need to know all the files upfront
+                    input_files = list(input_files)
+                    progress = Progress([file_name for file_name, _ in input_files], config.progress,
+                                        config.progress_file, metadata_index)
+                    progress.start()
+                    listeners.append(progress)
+                if Metrics.enabled:
+                    from mp3voicestamp_app.metrics_collector import MetricsCollector
+                    listeners.append(MetricsCollector())
+                if config.results_file is not None:
+                    from mp3voicestamp_app.results_writer import ResultsWriter
+                    results = ResultsWriter(config.results_file)
+                    listeners.append(results)
 
                 if config.dry_run_mode and config.files_in and batch_mode:
                     Log.i([
-                        'Files to process: {}'.format(len(config.files_in)),
+                        'Inputs to process: {}'.format(len(config.files_in)),
                         'Title format: "{}"'.format(config.title_format),
                         'Tick format: "{}"'.format(config.tick_format),
-                        'Ticks interval {freq} mins, start offset: {offset} mins'.format(freq=config.tick_interval,
-                                                                                         offset=config.tick_offset),
+                        'Ticks interval {freq} secs, start offset: {offset} secs'.format(
+                            freq=TickPlan.get_interval_seconds(config), offset=TickPlan.get_offset_seconds(config)),
                         '',
                     ])
 
-                for file_name in config.files_in:
+                if config.staging_dir is not None and not config.dry_run_mode:
+                    from mp3voicestamp_app.staging import Staging
+                    staging = Staging(config)
+                    staging.start()
+
+                # stages of many files can run concurrently, unless we deal with streams, plans or just simulate
+                use_scheduler = config.jobs != 1 and not config.dry_run_mode and config.file_out != Job.STDOUT \
+                    and Mp3FileInfo.STDIN not in config.files_in and not config.run_plans
+
+                if use_scheduler:
+                    from mp3voicestamp_app.scheduler import Scheduler
+                    if Scheduler(config, tools, metadata_index, listeners, staging).run(input_files) > 0:
+                        rc = 1
+                    input_files = []
+                elif staging is not None and not config.run_plans:
+                    input_files = staging.prefetch(input_files)
+
+                for file_name, out_sub_dir in input_files:
+                    job = None
+                    success = False
+                    error = None
                     try:
-                        Job(config, tools).voice_stamp(file_name)
+                        data = None
+                        if file_name == Mp3FileInfo.STDIN:
+                            # binary stream on Python 3, plain stdin on Python 2
+                            data = getattr(sys.stdin, 'buffer', sys.stdin).read()
+
+                        if config.run_plans:
+                            plan = RenderPlan.load(file_name)
+                            # reported to listeners by its source file name
+                            file_name = plan.source
+                            job = Job(plan.apply_to(config), tools, metadata_index, listeners, staging)
+                            success = job.voice_stamp(plan.source, plan=plan)
+                        else:
+                            job = Job(config, tools, metadata_index, listeners, staging)
+                            success = job.voice_stamp(file_name, out_sub_dir, data)
+                        error = job.error
                     except MutagenError as ex:
+                        error = ex
                         if not config.debug:
                             Log.e(ex)
                             if batch_mode:
@@ -78,6 +196,7 @@ class App(object):
                         else:
                             raise
                     except OSError as ex:
+                        error = ex
                         if not config.debug:
                             Log.e(ex)
                             if batch_mode:
@@ -87,12 +206,39 @@ class App(object):
                                 rc = 1
                         else:
                             raise
+                    finally:
+                        if job is not None:
+                            job.notify_file_finished(file_name, success, error)
+                        else:
+                            _ = [listener.file_finished(file_name, success, error) for listener in listeners]
         except (ValueError, IOError) as ex:
             if not config.debug:
                 Log.e(str(ex))
                 rc = 1
             else:
                 raise
+        finally:
+            # waits for all the output files to reach their destination, and these to be reported
+            if staging is not None and staging.close():
+                rc = 1
+            # must be stopped before index is closed, as it reads durations using it
+            if progress is not None:
+                progress.stop()
+            if results is not None:
+                results.close()
+            try:
+                Metrics.stop()
+            except (IOError, OSError) as ex:
+                Log.e('Failed to write metrics: {}'.format(ex))
+            if metadata_index is not None:
+                Log.v('Metadata index hits: {}, misses: {}'.format(metadata_index.hits, metadata_index.misses))
+                metadata_index.close()
+            if profiler is not None:
+                try:
+                    profiler.stop()
+                except (IOError, OSError) as ex:
+                    Log.e('Failed to write profile: {}'.format(ex))
+            Log.close()
 
         sys.exit(rc)
 
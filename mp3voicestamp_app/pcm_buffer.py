@@ -0,0 +1,145 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import mmap
+import os
+from array import array
+
+try:
+    # zero-copy views of the samples, optional as plain bytes work too
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    # C implementation of sample math, gone in Python 3.13
+    import audioop
+except ImportError:
+    audioop = None
+
+
+class PcmBuffer(object):
+    """Raw 16 bit PCM audio (native byte order) handed over from external tool to in-process stage through
+    memory-mapped file, so it is neither read into memory as a whole nor copied. Backing file lives in job's
+    scratch folder, so if it is RAM backed (see Scratch), the buffer is effectively shared memory.
+
+    Usage: write the file (i.e. let ffmpeg write to file object returned by open_for_writing()), then map()
+    it and read it with get_samples(), get_bytes() or get_mean_square(). Buffer must be closed once no longer
+    needed.
+    """
+
+    SAMPLE_WIDTH = 2
+
+    def __init__(self, file_name):
+        """
+        Args:
+            :file_name backing file, created (or overwritten) by open_for_writing() and removed by close()
+        """
+        self.__file_name = file_name
+        self.__fh = None
+        self.__mmap = None
+        self.__size = 0
+
+    @property
+    def file_name(self):
+        return self.__file_name
+
+    def open_for_writing(self):
+        """Returns file object PCM data is to be written to. Caller closes it once done.
+        """
+        return open(self.__file_name, 'wb')
+
+    def map(self):
+        """Maps written file into memory
+        """
+        self.__fh = open(self.__file_name, 'rb')
+        self.__size = os.fstat(self.__fh.fileno()).st_size
+        # empty file cannot be mapped
+        if self.__size > 0:
+            self.__mmap = mmap.mmap(self.__fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self
+
+    def __len__(self):
+        """Returns size of mapped data, in bytes
+        """
+        return self.__size
+
+    def get_sample_count(self):
+        return self.__size // self.SAMPLE_WIDTH
+
+    def get_samples(self, start=0, end=None):
+        """Returns samples (of all the channels) in given range, as NumPy int16 array viewing mapped memory
+
+        Args:
+            :start index of the first sample
+            :end index of the sample past the last one, or None for the end of the buffer
+
+        NOTE: returned array must not be used (nor referenced) once the buffer is closed
+        """
+        if numpy is None:
+            raise RuntimeError('Sample views require NumPy')
+
+        end = self.get_sample_count() if end is None else min(end, self.get_sample_count())
+        if self.__mmap is None or end <= start:
+            return numpy.zeros(0, dtype=numpy.int16)
+
+        return numpy.frombuffer(self.__mmap, dtype=numpy.int16, count=end - start, offset=start * self.SAMPLE_WIDTH)
+
+    def get_bytes(self, start, end):
+        """Returns copy of given range of the buffer (in bytes)
+        """
+        return self.__mmap[start:end] if self.__mmap is not None else b''
+
+    def get_mean_square(self, start, end):
+        """Returns mean square of samples in given range (in bytes) of the buffer, normalized to 0-1 range
+        """
+        if numpy is not None:
+            samples = self.get_samples(start // self.SAMPLE_WIDTH, end // self.SAMPLE_WIDTH)
+            if not samples.size:
+                return 0.0
+            samples = samples.astype(numpy.float64)
+            return float(numpy.dot(samples, samples)) / (samples.size * 32768.0 ** 2)
+
+        pcm = self.get_bytes(start, end)
+        if not pcm:
+            return 0.0
+
+        if audioop is not None:
+            rms = audioop.rms(pcm, self.SAMPLE_WIDTH)
+            return (rms / 32768.0) ** 2
+
+        samples = array('h')
+        if hasattr(samples, 'frombytes'):
+            samples.frombytes(pcm)
+        else:
+            samples.fromstring(pcm)
+        return sum(sample * sample for sample in samples) / (len(samples) * 32768.0 ** 2)
+
+    def close(self, remove=True):
+        """Unmaps the buffer and removes its backing file, unless told otherwise
+        """
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+        if self.__fh is not None:
+            self.__fh.close()
+            self.__fh = None
+        self.__size = 0
+
+        if remove and os.path.isfile(self.__file_name):
+            os.remove(self.__file_name)
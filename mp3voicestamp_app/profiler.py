@@ -0,0 +1,224 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import cProfile
+import os
+import pstats
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from mp3voicestamp_app.job_listener import JobListener
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.util import Util
+
+
+class Profiler(JobListener):
+    """Profiles Python side of the app with cProfile, to find where its own overhead (planning, bookkeeping,
+    logging) goes. Batch profile covers the thread running the app, while each stage of each job is profiled
+    separately, in whatever thread runs it, and written as per job profile once the job is finished. Once
+    the batch is over, all the profiles are merged into single batch profile.
+
+    Optionally, tracemalloc snapshots are taken at the end of each stage.
+
+    NOTE: since Python 3.12 only one profiler can be active at a time, so per job profiles are not written
+    there and batch profile covers all the threads instead.
+    """
+
+    BATCH_FILE_NAME = 'batch.pstats'
+    # per job profiles are named after the job number and source file name
+    JOB_FILE_NAME_FORMAT = '{:04d}-{}.pstats'
+    SNAPSHOT_FILE_NAME_FORMAT = '{:04d}-{}.{:02d}-{}.snapshot'
+
+    # number of frames stored with each traced memory allocation
+    TRACEMALLOC_FRAMES = 10
+
+    def __init__(self, out_dir, memory=False):
+        """
+        Args:
+            :out_dir folder to write profiles to
+            :memory if True, tracemalloc snapshot is taken at the end of each stage
+        """
+        self.__out_dir = out_dir
+        self.__memory = memory
+
+        self.__lock = threading.Lock()
+        # profiles active in each thread, the last one is the one running
+        self.__local = threading.local()
+        self.__batch = cProfile.Profile()
+        self.__per_job = True
+
+        # job -> dict with job number, stage profiles collected so far and number of snapshots taken
+        self.__jobs = {}
+        self.__job_count = 0
+        self.__job_files = []
+
+    # *****************************************************************************************************************
+
+    def start(self):
+        if not os.path.isdir(self.__out_dir):
+            os.makedirs(self.__out_dir)
+
+        if self.__memory:
+            if tracemalloc is None:
+                Log.w('Memory profiling needs Python 3.4 or newer')
+                self.__memory = False
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACEMALLOC_FRAMES)
+
+        self.__push(self.__batch)
+
+    def stop(self):
+        """Stops profiling and writes batch profile, with all per job profiles merged in
+        """
+        self.__pop()
+
+        if self.__memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        stats = pstats.Stats(self.__batch)
+        for file_name in self.__job_files:
+            stats.add(file_name)
+
+        batch_file = os.path.join(self.__out_dir, self.BATCH_FILE_NAME)
+        stats.dump_stats(batch_file)
+        Log.i('Profile written to "{}" ({} jobs merged)'.format(batch_file, len(self.__job_files)))
+
+    # *****************************************************************************************************************
+
+    def __get_stack(self):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def __push(self, profile):
+        """Makes given profile the active one in current thread, pausing the one active so far
+        """
+        stack = self.__get_stack()
+        if stack:
+            stack[-1].disable()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: another profiler is already active, which then covers this thread as well
+            if self.__per_job:
+                self.__per_job = False
+                Log.d('Concurrent profilers are not supported, per job profiles are not written')
+            if stack:
+                stack[-1].enable()
+            return False
+
+        stack.append(profile)
+        return True
+
+    def __pop(self):
+        stack = self.__get_stack()
+        if stack:
+            stack.pop().disable()
+        if stack:
+            stack[-1].enable()
+
+    @contextmanager
+    def __paused(self):
+        """Pauses profile active in current thread, so profiler's own work is not included
+        """
+        stack = self.__get_stack()
+        if stack:
+            stack[-1].disable()
+        try:
+            yield
+        finally:
+            if stack:
+                stack[-1].enable()
+
+    def __get_job_state(self, job):
+        with self.__lock:
+            state = self.__jobs.get(job)
+            if state is None:
+                self.__job_count += 1
+                state = {'number': self.__job_count, 'profiles': [], 'snapshots': 0}
+                self.__jobs[job] = state
+
+            return state
+
+    @staticmethod
+    def __get_job_name(job):
+        base_name = os.path.basename(job.file_name) if job.file_name is not None else 'job'
+        # keep file names portable
+        return re.sub(r'[^\w.-]+', '_', base_name)
+
+    # *****************************************************************************************************************
+
+    def stage_started(self, job, stage):
+        state = self.__get_job_state(job)
+        if not self.__per_job:
+            return
+
+        profile = cProfile.Profile()
+        if self.__push(profile):
+            with self.__lock:
+                state['profiles'].append(profile)
+
+    def stage_finished(self, job, stage, elapsed):
+        state = self.__get_job_state(job)
+        if self.__per_job:
+            stack = self.__get_stack()
+            if stack and stack[-1] in state['profiles']:
+                self.__pop()
+
+        if self.__memory:
+            current, peak = tracemalloc.get_traced_memory()
+            with self.__lock:
+                state['snapshots'] += 1
+                snapshot_number = state['snapshots']
+            snapshot_file = os.path.join(self.__out_dir, self.SNAPSHOT_FILE_NAME_FORMAT.format(
+                state['number'], self.__get_job_name(job), snapshot_number, stage))
+            with self.__paused():
+                tracemalloc.take_snapshot().dump(snapshot_file)
+            Log.d('Traced memory after {}: {} (peak {})'.format(
+                stage, Util.format_size(current), Util.format_size(peak)))
+
+    def job_finished(self, job, music_track, success):
+        with self.__lock:
+            state = self.__jobs.pop(job, None)
+        if state is None or not state['profiles']:
+            return
+
+        with self.__paused():
+            stats = None
+            for profile in state['profiles']:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profile)
+                    else:
+                        stats.add(profile)
+                except TypeError:
+                    # profile of the stage that did not call anything
+                    pass
+
+            if stats is not None:
+                job_file = os.path.join(self.__out_dir, self.JOB_FILE_NAME_FORMAT.format(
+                    state['number'], self.__get_job_name(job)))
+                stats.dump_stats(job_file)
+                with self.__lock:
+                    self.__job_files.append(job_file)
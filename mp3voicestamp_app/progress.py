@@ -0,0 +1,299 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+import time
+
+from mp3voicestamp_app.job_listener import JobListener
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.util import Util
+
+
+class Progress(JobListener):
+    """Tracks progress of the batch and reports it as status line (on stderr) and/or periodically rewritten
+    JSON status file.
+
+    Progress, throughput and ETA are weighted by audio duration, not by file count. Durations of files not
+    processed yet are only taken from where they are cheap to get: metadata index (looked up by background
+    thread) and tracks read ahead by the scheduler. Until duration of a file is known, average of durations
+    known so far is assumed for it.
+    """
+
+    # how often (in seconds) status line and status file are refreshed
+    UPDATE_INTERVAL = 1.0
+
+    DEFAULT_LINE_WIDTH = 120
+
+    def __init__(self, file_names, status_line=True, status_file=None, metadata_index=None):
+        """
+        Args:
+            :file_names list of all files to be processed
+            :status_line if True, status line is printed to stderr
+            :status_file optional name of JSON file to write status to
+            :metadata_index optional MetadataIndex durations of files are looked up in
+        """
+        self.__file_names = list(file_names)
+        self.__status_line = status_line
+        self.__status_file = status_file
+        self.__metadata_index = metadata_index
+
+        self.__is_tty = hasattr(sys.stderr, 'isatty') and sys.stderr.isatty()
+        self.__line_shown = False
+
+        self.__lock = threading.RLock()
+        self.__stop = threading.Event()
+        self.__threads = []
+
+        # file name -> duration in seconds
+        self.__durations = {}
+        # nothing to look up without the index
+        self.__sizing_finished = metadata_index is None
+        self.__files_done = 0
+        self.__files_failed = 0
+        self.__done_seconds = 0.0
+        # worker (thread) name -> dict with file and stage it's busy with
+        self.__workers = {}
+
+        self.__started = time.time()
+
+    # *****************************************************************************************************************
+
+    def start(self):
+        self.__started = time.time()
+
+        targets = [(self.__ticker, 'ProgressTicker')]
+        if self.__metadata_index is not None:
+            targets.append((self.__sizer, 'ProgressSizer'))
+        for target, name in targets:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+        if self.__status_line and self.__is_tty:
+            Log.status_line = self
+
+    def stop(self):
+        """Stops background threads and writes final status
+        """
+        self.__stop.set()
+        _ = [thread.join() for thread in self.__threads]
+        self.__threads = []
+
+        if Log.status_line is self:
+            Log.status_line = None
+
+        self.__update(final=True)
+
+    def __sizer(self):
+        for file_name in self.__file_names:
+            if self.__stop.is_set():
+                break
+
+            with self.__lock:
+                if file_name in self.__durations or file_name == Mp3FileInfo.STDIN:
+                    continue
+            try:
+                # files not indexed are not opened here, as that would compete with processing for I/O
+                info = self.__metadata_index.get(file_name)
+            except (IOError, OSError):
+                # unreadable files are reported once we get to process them
+                continue
+
+            if info is not None:
+                with self.__lock:
+                    self.__durations.setdefault(file_name, info['duration'])
+
+        with self.__lock:
+            self.__sizing_finished = True
+
+    def __ticker(self):
+        while not self.__stop.wait(self.UPDATE_INTERVAL):
+            self.__update()
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __worker_name():
+        return threading.current_thread().name
+
+    def track_read(self, music_track):
+        with self.__lock:
+            self.__durations.setdefault(music_track.file_name, music_track.duration_seconds)
+
+    def job_started(self, job, music_track):
+        with self.__lock:
+            self.__durations[music_track.file_name] = music_track.duration_seconds
+
+    def stage_started(self, job, stage):
+        # stages of the same job can be run by different workers, so we track workers, not jobs.
+        # Status is refreshed by the ticker, so busy workers do not fight for the lock to redraw it
+        with self.__lock:
+            self.__workers[self.__worker_name()] = {'file': job.file_name, 'stage': stage, 'since': time.time()}
+
+    def stage_finished(self, job, stage, elapsed):
+        with self.__lock:
+            self.__workers.pop(self.__worker_name(), None)
+
+    def file_finished(self, file_name, success, error=None):
+        with self.__lock:
+            self.__files_done += 1
+            if not success:
+                self.__files_failed += 1
+
+            duration = self.__durations.get(file_name)
+            if duration is None:
+                duration = self.__get_average_duration()
+            self.__done_seconds += duration if duration is not None else 0
+
+        if self.__status_line and not self.__is_tty:
+            # no status line to redraw, so we report after each file instead
+            Log.i(self.format_status(self.get_status()))
+        else:
+            self.__update()
+
+    # *****************************************************************************************************************
+
+    def __get_average_duration(self):
+        if not self.__durations:
+            return None
+        return sum(self.__durations.values()) / len(self.__durations)
+
+    def get_status(self):
+        """Returns snapshot of batch progress
+
+        Returns:
+            dict
+        """
+        with self.__lock:
+            now = time.time()
+            elapsed = now - self.__started
+
+            known = [self.__durations[file_name] for file_name in self.__file_names if file_name in self.__durations]
+            average = self.__get_average_duration()
+            total_seconds = sum(known)
+            if average is not None:
+                total_seconds += average * (len(self.__file_names) - len(known))
+
+            done_seconds = min(self.__done_seconds, total_seconds)
+
+            # audio minutes per wall clock second
+            throughput = (done_seconds / 60) / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if done_seconds > 0 and average is not None:
+                eta = (total_seconds - done_seconds) / (done_seconds / elapsed)
+
+            workers = {}
+            for name, worker in self.__workers.items():
+                workers[name] = {
+                    'file': worker['file'],
+                    'stage': worker['stage'],
+                    'stage_elapsed': round(now - worker['since'], 1) if worker['since'] is not None else None,
+                }
+
+            return {
+                'started': round(self.__started, 3),
+                'updated': round(now, 3),
+                'elapsed': round(elapsed, 1),
+                'files': {
+                    'total': len(self.__file_names),
+                    'done': self.__files_done,
+                    'failed': self.__files_failed,
+                },
+                'audio_minutes': {
+                    'total': round(total_seconds / 60, 2),
+                    'done': round(done_seconds / 60, 2),
+                    # False while durations of some files are still guessed
+                    'total_exact': self.__sizing_finished and len(known) == len(self.__file_names),
+                },
+                'throughput': round(throughput, 3),
+                'eta': round(eta, 1) if eta is not None else None,
+                'workers': workers,
+            }
+
+    @staticmethod
+    def format_status(status):
+        """Formats status as single, human readable line
+        """
+        files = status['files']
+        minutes = status['audio_minutes']
+        percent = 100.0 * minutes['done'] / minutes['total'] if minutes['total'] > 0 else 0.0
+        eta = Util.format_duration(status['eta']) if status['eta'] is not None else '--'
+
+        parts = [
+            '[{}/{}]'.format(files['done'], files['total']),
+            '{:.1f}%'.format(percent),
+            '{:.1f}/{}{:.1f} min'.format(minutes['done'], '' if minutes['total_exact'] else '~', minutes['total']),
+            '{:.2f} min/s'.format(status['throughput']),
+            'ETA {}'.format(eta),
+        ]
+        if files['failed']:
+            parts.insert(1, 'failed: {}'.format(files['failed']))
+        for name, worker in sorted(status['workers'].items()):
+            if worker['stage'] is not None:
+                parts.append('{}: {} "{}"'.format(name, worker['stage'], os.path.basename(worker['file'] or '')))
+
+        return ' | '.join(parts)
+
+    # *****************************************************************************************************************
+
+    def clear(self):
+        """Removes status line from the terminal, so regular log entry can be printed. Called by Log.
+        """
+        with self.__lock:
+            if self.__line_shown:
+                sys.stderr.write('\r\x1b[K')
+                sys.stderr.flush()
+                self.__line_shown = False
+
+    def __get_line_width(self):
+        try:
+            # noinspection PyUnresolvedReferences
+            from shutil import get_terminal_size
+            return get_terminal_size((self.DEFAULT_LINE_WIDTH, 24)).columns - 1
+        except ImportError:
+            return self.DEFAULT_LINE_WIDTH
+
+    def __write_status_file(self, status):
+        tmp_file_name = '{}.{}'.format(self.__status_file, os.getpid())
+        try:
+            with open(tmp_file_name, 'w') as fh:
+                json.dump(status, fh, indent=2, sort_keys=True)
+            if os.path.exists(self.__status_file) and sys.platform == 'win32':
+                os.remove(self.__status_file)
+            os.rename(tmp_file_name, self.__status_file)
+        except (IOError, OSError) as ex:
+            Log.d('Failed to write status file: {}'.format(ex))
+
+    def __update(self, final=False):
+        # called by both ticker and worker threads
+        with self.__lock:
+            status = self.get_status()
+            status['finished'] = final
+
+            if self.__status_file is not None:
+                self.__write_status_file(status)
+
+            if self.__status_line and self.__is_tty:
+                line = self.format_status(status)[:self.__get_line_width()]
+                sys.stderr.write('\r\x1b[K' + line + ('\n' if final else ''))
+                sys.stderr.flush()
+                self.__line_shown = not final
@@ -0,0 +1,210 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import copy
+import hashlib
+import json
+import os
+
+from mp3voicestamp_app.const import *
+from mp3voicestamp_app.util import Util
+
+
+class RenderPlan(object):
+    """Everything needed to voice stamp single track, once it is planned: source file, output file, what
+    is to be spoken and when, and how speech is to be gained and output encoded. Plans can be saved as JSON
+    files and run later, or elsewhere (see Job.load()), as long as source and output paths are valid there.
+
+    Fingerprint of the plan covers its source content and all the settings affecting the output, and it is
+    written to output file's tags (or overlay's JSON sidecar file), so outputs that are up to date can be
+    told apart without processing them again.
+    """
+
+    VERSION = 1
+
+    # Config properties stored with the plan, grouped by purpose
+    GAIN_SETTINGS = ['loudness', 'loudness_windows', 'loudness_window_length', 'speech_volume_factor']
+    ENCODER_SETTINGS = ['output_mode', 'encoder', 'pipeline', 'overlay_cue', 'overlay_chapters']
+    SPEECH_SETTINGS = ['speech_speed']
+
+    # how much (in bytes) of the source file beginning and end is hashed for the fingerprint
+    FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+    def __init__(self, source, output, duration, events, gain, encoder, speech, source_fingerprint):
+        """
+        Args:
+            :source source file name
+            :output output file name
+            :duration duration of the source track, in seconds
+            :events list of (offset in seconds, text) tuples, or TickPlan generating them. Events are only
+                    listed when the plan is serialized or fingerprinted
+            :gain dict with GAIN_SETTINGS values
+            :encoder dict with ENCODER_SETTINGS values
+            :speech dict with SPEECH_SETTINGS values
+            :source_fingerprint fingerprint of the source file content (see get_source_fingerprint())
+        """
+        self.source = source
+        self.output = output
+        self.duration = duration
+        self.events = events
+        self.gain = gain
+        self.encoder = encoder
+        self.speech = speech
+        self.source_fingerprint = source_fingerprint
+
+        self.__fingerprint = None
+
+    @staticmethod
+    def build(config, music_track, output, events):
+        """Builds plan for given track, with settings taken from the config
+
+        Args:
+            :config
+            :music_track Mp3FileInfo
+            :output output file name
+            :events list of (offset in seconds, text) tuples, or TickPlan
+        """
+        def get_settings(keys):
+            return {key: getattr(config, key) for key in keys}
+
+        return RenderPlan(music_track.file_name, output, music_track.duration_seconds, events,
+                          get_settings(RenderPlan.GAIN_SETTINGS), get_settings(RenderPlan.ENCODER_SETTINGS),
+                          get_settings(RenderPlan.SPEECH_SETTINGS), RenderPlan.get_source_fingerprint(music_track))
+
+    @staticmethod
+    def get_source_fingerprint(music_track):
+        """Returns fingerprint of track's content: its size and hash of its beginning and end, which is
+        enough to tell changed (i.e. re-encoded or retagged) file apart, with no need to read it all.
+        """
+        digest = hashlib.sha1()
+        if music_track.data is not None:
+            size = len(music_track.data)
+            digest.update(music_track.data[:RenderPlan.FINGERPRINT_SAMPLE_SIZE])
+            digest.update(music_track.data[-RenderPlan.FINGERPRINT_SAMPLE_SIZE:])
+        else:
+            file_name = music_track.get_source_file()
+            size = os.path.getsize(file_name)
+            with open(file_name, 'rb') as fh:
+                digest.update(fh.read(RenderPlan.FINGERPRINT_SAMPLE_SIZE))
+                fh.seek(max(0, size - RenderPlan.FINGERPRINT_SAMPLE_SIZE))
+                digest.update(fh.read(RenderPlan.FINGERPRINT_SAMPLE_SIZE))
+
+        return '{}:{}'.format(size, digest.hexdigest())
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of the source content and everything affecting the output made out of it
+        """
+        if self.__fingerprint is None:
+            content = {
+                'source': self.source_fingerprint,
+                'events': [[offset, text] for offset, text in self.events],
+                'gain': self.gain,
+                'encoder': self.encoder,
+                'speech': self.speech,
+                'version': self.VERSION,
+            }
+            self.__fingerprint = hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+        return self.__fingerprint
+
+    def apply_to(self, config):
+        """Returns copy of given config with plan's settings applied
+        """
+        config = copy.copy(config)
+        for settings in [self.gain, self.encoder, self.speech]:
+            for key, value in settings.items():
+                setattr(config, key, value)
+
+        return config
+
+    # *****************************************************************************************************************
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'generator': '{app} v{v}'.format(app=APP_NAME, v=VERSION),
+            'fingerprint': self.fingerprint,
+            'source': self.source,
+            'source_fingerprint': self.source_fingerprint,
+            'source_duration': round(self.duration, 3),
+            'output': self.output,
+            'events': [{'offset': offset, 'text': text} for offset, text in self.events],
+            'gain': self.gain,
+            'encoder': self.encoder,
+            'speech': self.speech,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        """Builds plan from its dict representation (see to_dict())
+
+        Raises:
+            ValueError if the data is not a valid plan
+        """
+        if data.get('version') != RenderPlan.VERSION:
+            raise ValueError('Unsupported render plan version "{}"'.format(data.get('version')))
+
+        try:
+            events = [(event['offset'], event['text']) for event in data['events']]
+            plan = RenderPlan(data['source'], data['output'], data['source_duration'], events, data['gain'],
+                              data['encoder'], data['speech'], data['source_fingerprint'])
+        except (KeyError, TypeError) as ex:
+            raise ValueError('Invalid render plan: {}'.format(ex))
+
+        for settings, keys in [(plan.gain, RenderPlan.GAIN_SETTINGS), (plan.encoder, RenderPlan.ENCODER_SETTINGS),
+                               (plan.speech, RenderPlan.SPEECH_SETTINGS)]:
+            unknown = [key for key in settings if key not in keys]
+            if unknown:
+                raise ValueError('Unknown render plan settings: {}'.format(', '.join(unknown)))
+
+        return plan
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def save(self, out_dir, out_sub_dir=''):
+        """Writes the plan as JSON file named after the source file, mirroring input directory tree
+
+        Returns:
+            name of written file
+        """
+        base_name, ext = Util.split_file_name(self.source)
+        file_name = os.path.join(out_dir, out_sub_dir, '{}.{}.json'.format(base_name, ext))
+
+        plan_dir = os.path.dirname(file_name)
+        if plan_dir and not os.path.isdir(plan_dir):
+            os.makedirs(plan_dir)
+
+        with open(file_name, 'w') as fh:
+            fh.write(self.to_json())
+
+        return file_name
+
+    @staticmethod
+    def load(file_name):
+        """Reads plan from JSON file
+
+        Raises:
+            ValueError if file does not contain valid plan, IOError if it cannot be read
+        """
+        with open(file_name, 'r') as fh:
+            try:
+                data = json.load(fh)
+            except ValueError as ex:
+                raise ValueError('"{}" is not a valid render plan: {}'.format(file_name, ex))
+
+        return RenderPlan.from_dict(data)
@@ -0,0 +1,88 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import threading
+import time
+
+try:
+    # noinspection PyCompatibility
+    from queue import Queue
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from Queue import Queue
+
+from mp3voicestamp_app.job_listener import JobListener
+from mp3voicestamp_app.stamp_result import StampResult
+
+
+class ResultCollector(JobListener):
+    """Builds StampResult of each processed file from job's events. Once file is done, its result is put
+    into "finished" queue, so it can be consumed while other files are still being processed.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__results = {}
+        self.__started = {}
+
+        self.finished = Queue()
+
+    def __get_result(self, file_name):
+        # must be called with the lock held
+        result = self.__results.get(file_name)
+        if result is None:
+            result = StampResult(file_name)
+            self.__results[file_name] = result
+            self.__started[file_name] = time.time()
+        return result
+
+    def job_started(self, job, music_track):
+        with self.__lock:
+            self.__get_result(job.file_name).duration = music_track.duration_seconds
+
+    def stage_started(self, job, stage):
+        with self.__lock:
+            self.__get_result(job.file_name)
+
+    def stage_finished(self, job, stage, elapsed):
+        with self.__lock:
+            timings = self.__get_result(job.file_name).timings
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def job_finished(self, job, music_track, success):
+        with self.__lock:
+            result = self.__get_result(job.file_name)
+            result.output = job.file_out
+            result.output_size = job.output_size
+            result.skipped = job.up_to_date
+            result.stats = {
+                'pipeline': job.pipeline,
+                'segments': job.segment_count,
+                'scratch_high_water_mark': job.scratch_high_water_mark,
+                'loudness_error_db': job.loudness_error_db,
+            }
+
+    def file_finished(self, file_name, success, error=None):
+        with self.__lock:
+            result = self.__get_result(file_name)
+            result.success = success
+            result.error = str(error) if error is not None else None
+            result.error_type = type(error).__name__ if error is not None else None
+            result.wall_time = time.time() - self.__started.pop(file_name)
+            del self.__results[file_name]
+
+        self.finished.put(result)
@@ -0,0 +1,58 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import threading
+
+from mp3voicestamp_app.result_collector import ResultCollector
+
+
+class ResultsWriter(ResultCollector):
+    """Writes result of each processed file (see StampResult.to_dict()) to file as JSON line, as soon as
+    the file is done, so results of huge batches can be consumed while they are still running.
+    """
+
+    # file name meaning "write to stdout"
+    STDOUT = '-'
+
+    def __init__(self, file_name):
+        """
+        Args:
+            :file_name name of the file to write to, overwritten if exists, or "-" for stdout
+        """
+        super(ResultsWriter, self).__init__()
+
+        self.__to_stdout = file_name == self.STDOUT
+        self.__fh = sys.stdout if self.__to_stdout else open(file_name, 'w')
+        self.__write_lock = threading.Lock()
+        self.count = 0
+
+    def file_finished(self, file_name, success, error=None):
+        super(ResultsWriter, self).file_finished(file_name, success, error)
+
+        # files can be finished by many threads, so we write whatever is finished, not just this file
+        with self.__write_lock:
+            while not self.finished.empty():
+                result = self.finished.get()
+                self.__fh.write(json.dumps(result.to_dict(), sort_keys=True) + '\n')
+                self.count += 1
+            self.__fh.flush()
+
+    def close(self):
+        if not self.__to_stdout:
+            self.__fh.close()
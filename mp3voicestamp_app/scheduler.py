@@ -0,0 +1,356 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import traceback
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+try:
+    # noinspection PyCompatibility
+    from queue import Queue
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from Queue import Queue
+
+from mp3voicestamp_app.job import Job
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.mp3_file_info import Mp3FileInfo
+from mp3voicestamp_app.scratch import Scratch
+from mp3voicestamp_app.util import Util
+
+
+class Scheduler(object):
+    """Processes many files concurrently, at stage level.
+
+    Job of each file is split into stages (see Job.get_stages()), which form small DAG. Stages of all the
+    admitted jobs are dispatched as soon as stages they depend on are completed and there are enough CPU,
+    I/O and memory resources left. Files are read (and their metadata too) as they come from the input, so
+    processing starts while directories are still being scanned. Out of a window of files read ahead, jobs are
+    admitted longest track first, as long as their temporary files fit the disk budget, so i.e. decoding of
+    the next file overlaps with encoding of the current one, while the longest tracks are not processed last.
+    """
+
+    # how many jobs (per CPU slot) can be in progress at once, so there is always some stage ready to run
+    ACTIVE_JOBS_PER_CPU = 2
+    # how many files (per CPU slot) are read ahead, for jobs to be picked from, longest track first
+    LOOKAHEAD_PER_CPU = 8
+
+    # share of available memory used as the budget, unless configured
+    MEMORY_BUDGET_SHARE = 0.5
+
+    def __init__(self, config, tools, metadata_index=None, listeners=None, staging=None):
+        """
+        Args:
+            :config
+            :tools
+            :metadata_index optional MetadataIndex
+            :listeners optional list of JobListener instances
+            :staging optional (started) Staging
+        """
+        self.__config = config
+        self.__tools = tools
+        self.__metadata_index = metadata_index
+        self.__listeners = listeners if listeners is not None else []
+        self.__staging = staging
+
+        self.__cpu_slots = config.jobs if config.jobs > 0 else multiprocessing.cpu_count()
+        # heavy I/O (decoding whole source, writing big WAVs) does not scale with cores
+        self.__io_slots = max(2, self.__cpu_slots // 2)
+        self.__memory_budget = self.__get_memory_budget(config)
+        self.__disk_budget = self.__get_disk_budget(config)
+
+        self.__cpu_used = 0
+        self.__io_used = 0
+        self.__memory_used = 0
+        self.__disk_used = 0
+        self.__running = 0
+        self.__free_worker_ids = deque(range(self.__cpu_slots + self.__io_slots))
+
+        self.__completed = Queue()
+        self.__cancelled = threading.Event()
+
+    def __get_memory_budget(self, config):
+        if config.memory_budget > 0:
+            return config.memory_budget * 1024 * 1024
+
+        available = Util.get_available_memory()
+        return int(available * self.MEMORY_BUDGET_SHARE) if available is not None else None
+
+    @staticmethod
+    def __get_disk_budget(config):
+        if config.disk_budget > 0:
+            return config.disk_budget * 1024 * 1024
+
+        free_space = Scratch.get_free_space(config.scratch_dir if config.scratch_dir is not None
+                                            else tempfile.gettempdir())
+        return int(free_space / Scratch.FREE_SPACE_MARGIN) if free_space is not None else None
+
+    # *****************************************************************************************************************
+
+    def cancel(self):
+        """Stops admitting new jobs, so run() returns as soon as jobs already in progress are finished.
+        Can be called from any thread.
+        """
+        self.__cancelled.set()
+
+    def __notify_file_finished(self, file_name, success, error=None):
+        _ = [listener.file_finished(file_name, success, error) for listener in self.__listeners]
+
+    def __report_failure(self, file_name, ex, trace=None):
+        Log.e('"{}": {}'.format(file_name, ex))
+        if trace is not None:
+            Log.d(trace)
+
+    def __read_track(self, item):
+        file_name, out_sub_dir = item
+        try:
+            return file_name, out_sub_dir, Mp3FileInfo(file_name, self.__metadata_index), None
+        except Exception as ex:
+            return file_name, out_sub_dir, None, ex
+
+    def __read_tracks(self, input_files, read_ahead):
+        """Reads metadata of the files in parallel, as they come, keeping at most given number of reads
+        in progress
+
+        Yields:
+            tuples (file name, out sub dir, Mp3FileInfo or None, exception or None), in input order
+        """
+        pool = ThreadPool(self.__config.io_threads)
+        in_progress = deque()
+        try:
+            for item in input_files:
+                in_progress.append(pool.apply_async(self.__read_track, (item,)))
+                if len(in_progress) >= read_ahead:
+                    yield in_progress.popleft().get()
+
+            while in_progress:
+                yield in_progress.popleft().get()
+        finally:
+            pool.close()
+            pool.join()
+
+    # *****************************************************************************************************************
+
+    def __admit(self, file_name, out_sub_dir, music_track, disk):
+        """Creates and prepares the job for given track
+
+        Returns:
+            dict with job state or None if job could not be prepared
+        """
+        job = Job(self.__config, self.__tools, self.__metadata_index, self.__listeners, self.__staging)
+        Log.level_push('Processing "{}"'.format(file_name))
+        try:
+            job.load(file_name, out_sub_dir, music_track=music_track)
+            job.begin()
+        except Exception as ex:
+            if self.__config.debug:
+                raise
+            self.__report_failure(file_name, ex)
+            job.finish(False)
+            self.__notify_file_finished(file_name, False, ex)
+            return None
+        finally:
+            Log.level_pop()
+
+        self.__disk_used += disk
+        return {
+            'job': job,
+            'stages': job.get_stages(),
+            'done': set(),
+            'running': set(),
+            'failed': False,
+            'error': None,
+            'disk': disk,
+        }
+
+    def __fits(self, stage):
+        if self.__running == 0:
+            # whatever the stage needs, it must be able to run at some point
+            return True
+
+        if self.__cpu_used + stage.cpu > self.__cpu_slots:
+            return False
+        if self.__io_used + stage.io > self.__io_slots:
+            return False
+        if self.__memory_budget is not None and self.__memory_used + stage.memory > self.__memory_budget:
+            return False
+
+        return True
+
+    def __start(self, state, stage):
+        state['running'].add(stage.name)
+        self.__cpu_used += stage.cpu
+        self.__io_used += stage.io
+        self.__memory_used += stage.memory
+        self.__running += 1
+
+        worker_id = self.__free_worker_ids.popleft() if self.__free_worker_ids else self.__running
+
+        def worker():
+            # stages of many files log at once, so entries tell which file they are about
+            Log.set_thread_prefix(os.path.basename(state['job'].file_name))
+            try:
+                state['job'].run_stage(stage)
+                self.__completed.put((state, stage, worker_id, None, None))
+            except Exception as ex:
+                self.__completed.put((state, stage, worker_id, ex, traceback.format_exc()))
+            finally:
+                Log.set_thread_prefix()
+
+        thread = threading.Thread(target=worker, name='worker-{}'.format(worker_id))
+        thread.daemon = True
+        thread.start()
+
+    def __dispatch(self, active):
+        for state in active:
+            if state['failed']:
+                continue
+
+            for stage in state['stages']:
+                if stage.name in state['done'] or stage.name in state['running']:
+                    continue
+                if any(dep not in state['done'] for dep in stage.deps):
+                    continue
+                if self.__fits(stage):
+                    self.__start(state, stage)
+
+    def __wait_for_stage(self):
+        state, stage, worker_id, ex, trace = self.__completed.get()
+
+        state['running'].discard(stage.name)
+        self.__cpu_used -= stage.cpu
+        self.__io_used -= stage.io
+        self.__memory_used -= stage.memory
+        self.__running -= 1
+        self.__free_worker_ids.append(worker_id)
+
+        if ex is None:
+            state['done'].add(stage.name)
+        else:
+            if self.__config.debug:
+                Log.e(trace)
+                raise ex
+            # remaining stages of this job are not run, but the ones already running must finish first
+            state['failed'] = True
+            state['error'] = ex
+            self.__report_failure(state['job'].file_name, ex, trace)
+
+    def __finish(self, state):
+        success = not state['failed']
+        job = state['job']
+        job.finish(success)
+        self.__disk_used -= state['disk']
+        job.notify_file_finished(job.file_name, success, state['error'])
+
+        return success
+
+    def run(self, input_files):
+        """Processes given files
+
+        Args:
+            :input_files iterable of (file name, output sub directory) tuples
+
+        Returns:
+            int number of files that failed to be processed
+        """
+        failed = 0
+        max_active = self.__cpu_slots * self.ACTIVE_JOBS_PER_CPU
+        lookahead = max(max_active, self.__cpu_slots * self.LOOKAHEAD_PER_CPU)
+        tracks = self.__read_tracks(input_files, lookahead)
+
+        # pipeline can be picked for each track (see Job.select_pipeline()), reported is the configured one
+        probe = Job(self.__config, self.__tools)
+        pipeline, reason = probe.select_pipeline()
+        Log.v([
+            'Scheduling files: {} CPU slots, {} I/O slots, {} files read ahead'.format(
+                self.__cpu_slots, self.__io_slots, lookahead),
+            'Memory budget: {}, disk budget: {}'.format(
+                Util.format_size(self.__memory_budget) if self.__memory_budget is not None else 'unlimited',
+                Util.format_size(self.__disk_budget) if self.__disk_budget is not None else 'unlimited'),
+            'Pipeline: {} ({})'.format(pipeline, reason),
+        ])
+
+        # files read, but not admitted yet, longest track first
+        pending = []
+        exhausted = False
+
+        active = []
+        while pending or active or not exhausted:
+            if self.__cancelled.is_set() and (pending or not exhausted):
+                Log.v('Cancelled, {} files read ahead are not processed'.format(len(pending)))
+                pending = []
+                exhausted = True
+                tracks.close()
+
+            # keep the window full, so we do not end up waiting for a single long track at the end
+            refilled = False
+            while not exhausted and len(pending) < lookahead:
+                try:
+                    file_name, out_sub_dir, music_track, ex = next(tracks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if ex is not None:
+                    self.__report_failure(file_name, ex)
+                    self.__notify_file_finished(file_name, False, ex)
+                    failed += 1
+                else:
+                    _ = [listener.track_read(music_track) for listener in self.__listeners]
+                    pending.append((file_name, out_sub_dir, music_track))
+                    refilled = True
+            if refilled:
+                pending.sort(key=lambda item: -item[2].duration_seconds)
+
+            while pending and len(active) < max_active:
+                if self.__staging is not None:
+                    # files are prefetched in order they are admitted in, which changes as pending is re-sorted
+                    ahead = [item[0] for item in islice(pending, self.__config.staging_prefetch)]
+                    _ = [self.__staging.plan(file_name) for file_name in ahead]
+                    self.__staging.reorder(ahead)
+
+                file_name, out_sub_dir, music_track = pending[0]
+                disk = Job.estimate_scratch_size(self.__config, music_track, probe.select_pipeline(music_track)[0])
+                if active and self.__disk_budget is not None and self.__disk_used + disk > self.__disk_budget:
+                    break
+                # source still being copied, so job would wait for it while other stages could be dispatched
+                if active and self.__staging is not None and not self.__staging.is_ready(file_name):
+                    break
+
+                pending.pop(0)
+                state = self.__admit(file_name, out_sub_dir, music_track, disk)
+                if state is None:
+                    failed += 1
+                else:
+                    active.append(state)
+
+            self.__dispatch(active)
+
+            if self.__running > 0:
+                self.__wait_for_stage()
+
+            for state in [state for state in active if not state['running']]:
+                if state['failed'] or len(state['done']) == len(state['stages']):
+                    active.remove(state)
+                    if not self.__finish(state):
+                        failed += 1
+
+        return failed
@@ -0,0 +1,165 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import os
+import tempfile
+
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.util import Util
+
+
+class Scratch(object):
+    """Decides where temporary (scratch) files of the job are stored and keeps track of how much space they use.
+
+    RAM backed file system (tmpfs) is used if available and estimated size of intermediate files fits
+    the configured budget. Otherwise configured scratch directory (or system default temp folder) is used.
+    """
+
+    # espeak produces 16 bit mono WAVs at this rate
+    SPEECH_SAMPLE_RATE = 22050
+    SPEECH_CHANNELS = 1
+    # intermediate WAVs are 16 bit PCM
+    WAV_BYTES_PER_SAMPLE = 2
+    WAV_CODEC = 'pcm_s16le'
+
+    # rough length (in seconds) of single spoken segment, used for overlay-only mode estimates
+    SEGMENT_SECONDS = 3
+
+    # we want some headroom on tmpfs, so estimated size is multiplied by this factor when checking free space
+    FREE_SPACE_MARGIN = 1.2
+
+    def __init__(self, config):
+        self.__config = config
+        self.__dir = None
+        self.__estimated_size = 0
+        self.high_water_mark = 0
+
+    @property
+    def dir(self):
+        return self.__dir
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def estimate_size(music_track, segment_count, overlay_mode=False, single_pass=False):
+        """Estimates total size (in bytes) of intermediate files needed to process given track
+
+        Args:
+            :music_track Mp3FileInfo
+            :segment_count number of spoken segments
+            :overlay_mode True if only speech overlay is to be produced
+            :single_pass True if clips are mixed directly into music, with no intermediate music/speech WAVs
+        """
+        speech_bytes_per_second = Scratch.SPEECH_SAMPLE_RATE * Scratch.SPEECH_CHANNELS * Scratch.WAV_BYTES_PER_SAMPLE
+
+        # single spoken clips, each of a few seconds long, then joined together
+        clips_size = segment_count * Scratch.SEGMENT_SECONDS * speech_bytes_per_second
+        if overlay_mode:
+            return 2 * clips_size
+        if single_pass:
+            return clips_size
+
+        music_wav_size = music_track.duration_seconds * music_track.sample_rate * music_track.channels * \
+            Scratch.WAV_BYTES_PER_SAMPLE
+        speech_wav_size = music_track.duration_seconds * speech_bytes_per_second
+
+        return int(clips_size + music_wav_size + speech_wav_size)
+
+    @staticmethod
+    def get_free_space(path):
+        """Returns free space (in bytes) available on file system given path is on, or None if unknown
+        """
+        if not hasattr(os, 'statvfs'):
+            return None
+
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize
+
+    def __pick_root(self, estimated_size):
+        """Returns tuple (root directory to create scratch folder in or None for system default, reason)
+        """
+        tmpfs_dir = self.__config.scratch_tmpfs_dir
+        budget = self.__config.scratch_budget * 1024 * 1024
+
+        if budget > 0 and tmpfs_dir is not None and os.path.isdir(tmpfs_dir):
+            if estimated_size <= budget:
+                free_space = self.get_free_space(tmpfs_dir)
+                if free_space is not None and free_space >= estimated_size * self.FREE_SPACE_MARGIN:
+                    return tmpfs_dir, 'fits RAM budget'
+                reason = 'not enough free space on {}'.format(tmpfs_dir)
+            else:
+                reason = 'exceeds RAM budget of {}'.format(Util.format_size(budget))
+        else:
+            reason = 'RAM scratch disabled'
+
+        return self.__config.scratch_dir, reason
+
+    def make_dir(self, estimated_size):
+        """Creates scratch folder for the job
+
+        Args:
+            :estimated_size estimated size (in bytes) of all intermediate files
+
+        Returns:
+            path to created folder
+        """
+        self.__estimated_size = estimated_size
+        root, reason = self.__pick_root(estimated_size)
+
+        if root is not None and not os.path.isdir(root):
+            os.makedirs(root)
+
+        self.__dir = tempfile.mkdtemp(dir=root)
+        Log.d('Tmp dir: {}'.format(self.__dir))
+        Log.v('Scratch: {} (estimated {}, {})'.format(self.__dir, Util.format_size(estimated_size), reason))
+
+        return self.__dir
+
+    def get_used_space(self):
+        """Returns total size (in bytes) of all files currently in scratch folder
+        """
+        total = 0
+        if self.__dir is not None:
+            for path, _, files in os.walk(self.__dir):
+                for file_name in files:
+                    try:
+                        total += os.path.getsize(os.path.join(path, file_name))
+                    except OSError:
+                        # file removed in the meantime
+                        pass
+
+        return total
+
+    def update_high_water_mark(self, stage=None):
+        """Checks scratch space usage and updates the high-water mark. Meant to be called after each stage
+        that produces intermediate files.
+
+        Args:
+            :stage optional name of the stage just finished, for logging purposes
+        """
+        used = self.get_used_space()
+        if used > self.high_water_mark:
+            self.high_water_mark = used
+
+        if stage is not None:
+            Log.d('Scratch usage after {}: {}'.format(stage, Util.format_size(used)))
+
+        return used
+
+    def log_summary(self):
+        Log.v('Scratch high-water mark: {} (estimated {})'.format(
+            Util.format_size(self.high_water_mark), Util.format_size(self.__estimated_size)))
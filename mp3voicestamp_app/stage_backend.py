@@ -0,0 +1,136 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+
+class StageBackend(object):
+    """Interface of backends doing actual audio work of job's stages. Operations are grouped by the stage
+    (Config.BACKEND_STAGE_xxx) they belong to, and backend can be configured for each stage separately
+    (see Config.backends), so i.e. real mixing can be benchmarked with speech synthesis faked.
+
+    Backends are created with Tools instance as the only constructor argument.
+    """
+
+    # Config.BACKEND_xxx
+    NAME = None
+
+    @staticmethod
+    def needs_tools():
+        """Tells if backend runs external tools (so these must be installed and checked first)
+        """
+        return True
+
+    def has_capability(self, cap):
+        """Tells if given feature (Tools.CAP_xxx) is supported
+
+        Returns:
+            bool
+        """
+        raise NotImplementedError
+
+    # ***** synthesize ************************************************************************************************
+
+    def speak_to_wav(self, text, wav_file, speed, no_cleanup=False):
+        """Speaks given text into WAV file
+
+        Args:
+            :text
+            :wav_file
+            :speed speech speed in words per minute
+            :no_cleanup if True, intermediate files (if any) are kept
+
+        Returns:
+            bool True on success
+        """
+        raise NotImplementedError
+
+    # ***** decode ****************************************************************************************************
+
+    def decode_to_wav(self, file_name, wav_file, input_data=None, envelope=False):
+        """Decodes audio file to WAV file
+
+        Args:
+            :file_name file name or "pipe:0" if content is given as input_data
+            :wav_file
+            :input_data optional content of the file
+            :envelope if True, loudness envelope is calculated while decoding
+
+        Returns:
+            LoudnessEnvelope if envelope is True, otherwise None
+        """
+        raise NotImplementedError
+
+    # ***** analyze ***************************************************************************************************
+
+    def calculate_rms_amplitude(self, wav_file):
+        """Returns RMS amplitude (float) of WAV file
+        """
+        raise NotImplementedError
+
+    def calculate_rms_amplitude_of_file(self, file_name, input_data=None):
+        """Returns RMS amplitude (float) of any supported audio file (i.e. MP3)
+        """
+        raise NotImplementedError
+
+    def calculate_sampled_rms_amplitude(self, file_name, duration, windows, window_length, buffer=None):
+        """Returns tuple (RMS amplitude, estimated error in dB) estimated from evenly distributed windows,
+        optionally decoded to given PcmBuffer
+        """
+        raise NotImplementedError
+
+    def calculate_loudness_envelope(self, file_name, input_data=None, wav_file=None):
+        """Returns LoudnessEnvelope of audio file, optionally decoding it to wav_file at the same time
+        """
+        raise NotImplementedError
+
+    # ***** mix *******************************************************************************************************
+
+    def adjust_wav_amplitude(self, wav_file, rms_amplitude):
+        """Adjusts amplitude of WAV file (or each of list of WAV files) to given RMS amplitude
+        """
+        raise NotImplementedError
+
+    def concat_wav_files(self, file_out, wav_files):
+        """Joins given WAV files one after another, without any padding
+        """
+        raise NotImplementedError
+
+    def concat_padded_wav_files(self, file_out, wav_files, lengths):
+        """Joins given WAV files one after another, each padded with silence to given length
+
+        Args:
+            :file_out
+            :wav_files list of WAV files to join
+            :lengths list of lengths (in seconds) matching wav_files
+        """
+        raise NotImplementedError
+
+    def encode_overlay(self, wav_file, file_out):
+        """Encodes speech overlay WAV into compact MP3 file
+        """
+        raise NotImplementedError
+
+    def mix_wav_tracks(self, file_out, output_args, wav_files, metadata_args=None, stdout=None,
+                       metadata_input=None, input_data=None):
+        """Mixes given WAV tracks together into encoded output file
+        """
+        raise NotImplementedError
+
+    def mix_speech_clips(self, file_out, music_input, output_args, clips, metadata_args=None,
+                         input_data=None, stdout=None):
+        """Mixes spoken clips into music track, each at its offset, into encoded output file
+        """
+        raise NotImplementedError
@@ -0,0 +1,375 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+try:
+    # noinspection PyCompatibility
+    from queue import Queue
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from Queue import Queue
+
+from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.util import Util
+
+
+class Staging(object):
+    """Keeps slow (i.e. network) storage away from processing stages. Source files are copied to local staging
+    folder by background thread, a few files ahead of the one being processed, so stages read local copies.
+    Output files are written to staging folder too, and once finished, another background thread copies them
+    to their destination (under temporary name, renamed once complete, so partial files are never seen there).
+
+    Files are prefetched in the order they are planned (see plan() and prefetch()), unless reordered with
+    reorder(), and the order they are acquired in must be the same. Files not planned are read from where they are.
+    """
+
+    # size (in bytes) of chunks files are copied in
+    CHUNK_SIZE = 1024 * 1024
+
+    STATE_PLANNED = 'planned'
+    STATE_COPYING = 'copying'
+    STATE_READY = 'ready'
+    STATE_FAILED = 'failed'
+    # released while still being copied
+    STATE_RELEASED = 'released'
+
+    __STOP = object()
+
+    def __init__(self, config):
+        self.__config = config
+        self.__prefetch_count = config.staging_prefetch
+        self.__bandwidth = config.staging_bandwidth * 1024
+
+        self.__dir = None
+        self.__closed = False
+
+        self.__lock = threading.Lock()
+        self.__state_changed = threading.Condition(self.__lock)
+        # names of planned files, in order they are to be copied
+        self.__planned = deque()
+        # source file name -> dict with "state" and "local" file name
+        self.__entries = {}
+        self.__copied_count = 0
+
+        self.__bandwidth_lock = threading.Lock()
+        self.__bandwidth_free_at = 0.0
+
+        self.__commits = Queue(maxsize=config.staging_commit_queue)
+        self.__committed_count = 0
+        self.__failed_commits = []
+
+        self.__prefetch_thread = None
+        self.__commit_thread = None
+
+    @property
+    def dir(self):
+        return self.__dir
+
+    def start(self):
+        """Creates staging folder and starts background threads
+        """
+        root = self.__config.staging_dir
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.__dir = tempfile.mkdtemp(dir=root)
+        Log.v('Staging folder: {} (prefetch: {}, bandwidth: {})'.format(
+            self.__dir, self.__prefetch_count,
+            '{}/s'.format(Util.format_size(self.__bandwidth)) if self.__bandwidth > 0 else 'unlimited'))
+
+        self.__prefetch_thread = threading.Thread(target=self.__prefetch_worker, name='StagingPrefetch')
+        self.__prefetch_thread.daemon = True
+        self.__prefetch_thread.start()
+
+        self.__commit_thread = threading.Thread(target=self.__commit_worker, name='StagingCommit')
+        self.__commit_thread.daemon = True
+        self.__commit_thread.start()
+
+    def close(self):
+        """Waits for all queued output files to be committed, stops prefetching and removes staging folder
+
+        Returns:
+            list of (output file name, error) tuples of files that failed to be committed
+        """
+        if self.__commit_thread is not None:
+            self.__commits.put(self.__STOP)
+            self.__commit_thread.join()
+
+        with self.__lock:
+            self.__closed = True
+            self.__state_changed.notify_all()
+        if self.__prefetch_thread is not None:
+            self.__prefetch_thread.join()
+
+        if self.__dir is not None:
+            if not self.__config.no_cleanup:
+                shutil.rmtree(self.__dir, ignore_errors=True)
+            Log.v('Staging: {} files prefetched, {} committed, {} failed to commit'.format(
+                self.__copied_count, self.__committed_count, len(self.__failed_commits)))
+
+        return self.__failed_commits
+
+    # *****************************************************************************************************************
+
+    def __throttle(self, size):
+        """Waits as long as transferring given number of bytes takes at configured bandwidth. The bandwidth
+        is shared by all the transfers.
+        """
+        if self.__bandwidth <= 0:
+            return
+
+        with self.__bandwidth_lock:
+            now = time.time()
+            self.__bandwidth_free_at = max(now, self.__bandwidth_free_at) + float(size) / self.__bandwidth
+            delay = self.__bandwidth_free_at - now
+
+        time.sleep(delay)
+
+    def __transfer(self, src, dst, cancellable=False):
+        with open(src, 'rb') as fh_in, open(dst, 'wb') as fh_out:
+            while True:
+                if cancellable and self.__closed:
+                    raise IOError('Transfer cancelled')
+
+                chunk = fh_in.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                fh_out.write(chunk)
+                self.__throttle(len(chunk))
+
+    @staticmethod
+    def __remove(file_name):
+        try:
+            if file_name is not None and os.path.isfile(file_name):
+                os.remove(file_name)
+        except OSError as ex:
+            Log.d('Failed to remove "{}": {}'.format(file_name, ex))
+
+    # *****************************************************************************************************************
+
+    def plan(self, file_name):
+        """Queues given source file to be copied to staging folder. Files planned already, and ones that
+        are not regular files (i.e. stdin) are ignored.
+        """
+        if self.__prefetch_count == 0:
+            return
+        with self.__lock:
+            if file_name in self.__entries:
+                return
+        if not os.path.isfile(file_name):
+            return
+
+        with self.__lock:
+            if file_name not in self.__entries:
+                self.__entries[file_name] = {'state': self.STATE_PLANNED, 'local': None}
+                self.__planned.append(file_name)
+                self.__state_changed.notify_all()
+
+    def reorder(self, file_names):
+        """Moves given planned files, if not being copied yet, to the front of the prefetch queue, in given
+        order. Used when the order files are going to be acquired in changes after they are planned.
+        """
+        with self.__lock:
+            ahead = [file_name for file_name in file_names if file_name in self.__planned]
+            if list(self.__planned)[:len(ahead)] == ahead:
+                return
+            _ = [self.__planned.remove(file_name) for file_name in ahead]
+            self.__planned.extendleft(reversed(ahead))
+
+    def prefetch(self, input_files):
+        """Plans files as they are iterated over, keeping configured number of them planned ahead of
+        the one just yielded.
+
+        Args:
+            :input_files iterable of (file name, output sub directory) tuples
+
+        Yields:
+            the same tuples, in the same order
+        """
+        window = deque()
+        for item in input_files:
+            self.plan(item[0])
+            window.append(item)
+            if len(window) > self.__prefetch_count:
+                yield window.popleft()
+
+        while window:
+            yield window.popleft()
+
+    def is_ready(self, file_name):
+        """Tells if acquire() would return immediately for given file
+        """
+        with self.__lock:
+            entry = self.__entries.get(file_name)
+            return entry is None or entry['state'] not in [self.STATE_PLANNED, self.STATE_COPYING]
+
+    def acquire(self, file_name):
+        """Returns local copy of given source file, waiting for it to be copied if needed
+
+        Returns:
+            local file name or None if the file is to be read from where it is
+        """
+        with self.__lock:
+            entry = self.__entries.get(file_name)
+            while entry is not None and entry['state'] in [self.STATE_PLANNED, self.STATE_COPYING]:
+                self.__state_changed.wait()
+
+            if entry is not None and entry['state'] == self.STATE_READY:
+                return entry['local']
+
+        return None
+
+    def release(self, file_name):
+        """Removes local copy of given source file, once it is no longer needed
+        """
+        local = None
+        with self.__lock:
+            entry = self.__entries.get(file_name)
+            if entry is None:
+                return
+
+            if entry['state'] == self.STATE_COPYING:
+                # prefetch thread removes it once done
+                entry['state'] = self.STATE_RELEASED
+                return
+
+            if entry['state'] == self.STATE_PLANNED:
+                self.__planned.remove(file_name)
+            local = entry['local']
+            del self.__entries[file_name]
+
+        self.__remove(local)
+
+    def __prefetch_worker(self):
+        while True:
+            with self.__lock:
+                while not self.__planned and not self.__closed:
+                    self.__state_changed.wait()
+                if self.__closed:
+                    break
+
+                file_name = self.__planned.popleft()
+                entry = self.__entries[file_name]
+                entry['state'] = self.STATE_COPYING
+                self.__copied_count += 1
+                local = os.path.join(self.__dir, '{}-{}'.format(self.__copied_count, os.path.basename(file_name)))
+
+            Log.d('Prefetching "{}"'.format(file_name))
+            try:
+                self.__transfer(file_name, local, True)
+                state = self.STATE_READY
+            except (IOError, OSError) as ex:
+                if not self.__closed:
+                    Log.w('Failed to prefetch "{}", reading it directly: {}'.format(file_name, ex))
+                self.__remove(local)
+                local = None
+                state = self.STATE_FAILED
+
+            with self.__lock:
+                if entry['state'] == self.STATE_RELEASED:
+                    del self.__entries[file_name]
+                    self.__remove(local)
+                else:
+                    entry['state'] = state
+                    entry['local'] = local
+                self.__state_changed.notify_all()
+
+    # *****************************************************************************************************************
+
+    def get_tmp_file_name(self, file_out):
+        """Returns name of local file the output is to be written to before it is committed
+        """
+        # noinspection PyProtectedMember
+        return os.path.join(self.__dir, next(tempfile._get_candidate_names()) + os.path.splitext(file_out)[1])
+
+    def commit(self, tmp_file, file_out, callback=None, companions=None):
+        """Queues finished output file to be moved to its destination. Waits if the queue is full.
+
+        Args:
+            :tmp_file local file, as named by get_tmp_file_name()
+            :file_out destination file name
+            :callback optional function called from commit thread once done, with exception that made
+                      the commit fail, or None if it succeeded
+            :companions optional list of (tmp_file, file_out) tuples describing files that belong to the output
+                        file. These are committed in given order, right after the output file and only if
+                        it succeeded, so the last one never lands without the others
+        """
+        files = [(tmp_file, file_out)] + (companions if companions is not None else [])
+        self.__commits.put((files, callback))
+
+    def __commit_file(self, tmp_file, file_out):
+        """Moves given local file to its destination
+
+        Returns:
+            :exception that made the commit fail, or None if it succeeded
+        """
+        # noinspection PyProtectedMember
+        remote_tmp_file = os.path.join(os.path.dirname(file_out),
+                                       next(tempfile._get_candidate_names()) + os.path.splitext(file_out)[1])
+        try:
+            self.__transfer(tmp_file, remote_tmp_file)
+            if os.path.exists(file_out) and sys.platform == 'win32':
+                os.remove(file_out)
+            os.rename(remote_tmp_file, file_out)
+            self.__committed_count += 1
+            Log.d('Committed "{}"'.format(file_out))
+        except (IOError, OSError) as ex:
+            Log.e('Failed to write "{}": {}'.format(file_out, ex))
+            self.__failed_commits.append((file_out, ex))
+            self.__remove(remote_tmp_file)
+            return ex
+        finally:
+            self.__remove(tmp_file)
+
+        return None
+
+    def wait_for_commits(self):
+        """Waits until all the output files queued so far are committed (or failed to)
+        """
+        self.__commits.join()
+
+    def __commit_worker(self):
+        while True:
+            item = self.__commits.get()
+            if item is self.__STOP:
+                self.__commits.task_done()
+                break
+
+            files, callback = item
+            error = None
+            for tmp_file, file_out in files:
+                if error is None:
+                    error = self.__commit_file(tmp_file, file_out)
+                else:
+                    # files that belong to failed one are not worth having
+                    self.__remove(tmp_file)
+
+            file_out = files[0][1]
+            if callback is not None:
+                try:
+                    callback(error)
+                except Exception as ex:
+                    # must not stop remaining files from being committed
+                    Log.e('Failed to report commit of "{}": {}'.format(file_out, ex))
+
+            self.__commits.task_done()
@@ -0,0 +1,85 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+
+class StampResult(object):
+    """Outcome of voice stamping single file, as returned by Api
+    """
+
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    # output file is up to date already (see RenderPlan)
+    STATUS_SKIPPED = 'skipped'
+
+    def __init__(self, source):
+        """
+        Args:
+            :source name of the source file
+        """
+        self.source = source
+        self.success = False
+        self.skipped = False
+        # message describing why processing failed
+        self.error = None
+        # class name of the exception that made processing fail
+        self.error_type = None
+
+        # name of the output file, None if content is returned in data
+        self.output = None
+        # content (bytes) of the output file, if it was requested to be returned in memory
+        self.data = None
+        # content of overlay's JSON sidecar file (overlay mode, in memory output only)
+        self.sidecar = None
+        # size (in bytes) of written output file
+        self.output_size = None
+
+        # duration (in seconds) of the source track
+        self.duration = None
+        # total processing wall time (in seconds)
+        self.wall_time = 0.0
+        # wall time (in seconds) of each of processing stages, keyed by JobListener.STAGE_xxx
+        self.timings = {}
+        # other job details: pipeline used, number of spoken segments, peak size of temporary files
+        self.stats = {}
+
+    @property
+    def status(self):
+        """One of STATUS_xxx
+        """
+        if not self.success:
+            return self.STATUS_FAILED
+        return self.STATUS_SKIPPED if self.skipped else self.STATUS_SUCCESS
+
+    def to_dict(self):
+        """Returns the result as JSON serializable dict
+        """
+        segments = self.stats.get('segments')
+        return {
+            'source': self.source,
+            'output': self.output,
+            'status': self.status,
+            'error': {'class': self.error_type, 'message': self.error} if self.error is not None else None,
+            'duration_minutes': round(self.duration / 60.0, 2) if self.duration is not None else None,
+            # first segment is the title
+            'ticks': max(segments - 1, 0) if segments else None,
+            'timings': {stage: round(elapsed, 3) for stage, elapsed in self.timings.items()},
+            'wall_time': round(self.wall_time, 3),
+            'output_size': self.output_size,
+        }
+
+    def __repr__(self):
+        return 'StampResult({}, success={})'.format(self.source, self.success)
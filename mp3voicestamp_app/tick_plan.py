@@ -0,0 +1,159 @@
+# coding=utf8
+
+"""
+
+ MP3 Voice Stamp
+
+ Athletes' companion: adds synthetized voice overlay with various
+ info and on-going timer to your audio files
+
+ Copyright ©2018 Marcin Orlowski <mail [@] MarcinOrlowski.com>
+
+ https://github.com/MarcinOrlowski/Mp3VoiceStamp
+
+"""
+
+from __future__ import print_function
+
+import math
+import re
+
+from mp3voicestamp_app.util import Util
+
+
+class TickPlan(object):
+    """Plan of segments to be spoken over the track: track title first, followed by time ticks.
+
+    Title and tick formats are compiled once, with all the track related placeholders already substituted,
+    so rendering each tick is just joining few strings. Events are generated lazily, as (offset in seconds,
+    text) tuples, and their number is known upfront, so even plans of many thousands of ticks cost next to
+    nothing to build or count.
+    """
+
+    PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+    # placeholders which value changes with each tick
+    KEY_MINUTES = 'minutes'
+    KEY_MINUTES_DIGITS = 'minutes_digits'
+    KEY_SECONDS = 'seconds'
+    DYNAMIC_KEYS = [KEY_MINUTES, KEY_MINUTES_DIGITS, KEY_SECONDS]
+
+    def __init__(self, config, music_track):
+        """
+        Args:
+            :config
+            :music_track Mp3FileInfo
+        """
+        self.__config = config
+        self.__duration = music_track.duration_seconds
+        self.__interval = self.get_interval_seconds(config)
+        self.__offset = self.get_offset_seconds(config)
+        self.__tick_count = self.get_tick_count(config, music_track)
+
+        placeholders = Util.merge_dicts(music_track.get_placeholders(), {'config_name': config.name})
+        self.__title = Util.prepare_for_speak(self.__render(self.compile(config.title_format, placeholders), {}))
+        self.__tick_template = self.compile(config.tick_format, placeholders)
+
+    @staticmethod
+    def compile(fmt, placeholders):
+        """Splits format string into list of parts. Known static placeholders are substituted right away,
+        adjacent literals merged, so only placeholders from DYNAMIC_KEYS are left to be filled per tick.
+        Unknown placeholders are left as they are.
+
+        Args:
+            :fmt format string
+            :placeholders dict of static placeholders
+
+        Returns:
+            list of (literal text, dynamic key) tuples, with one of the two set to None
+        """
+        parts = []
+
+        def add_literal(text):
+            if not text:
+                return
+            if parts and parts[-1][0] is not None:
+                parts[-1] = (parts[-1][0] + text, None)
+            else:
+                parts.append((text, None))
+
+        last_end = 0
+        for match in TickPlan.PLACEHOLDER_RE.finditer(fmt):
+            add_literal(fmt[last_end:match.start()])
+            key = match.group(1)
+            if key in placeholders:
+                add_literal(str(placeholders[key]))
+            elif key in TickPlan.DYNAMIC_KEYS:
+                parts.append((None, key))
+            else:
+                add_literal(match.group(0))
+            last_end = match.end()
+        add_literal(fmt[last_end:])
+
+        return parts
+
+    @staticmethod
+    def __render(template, values):
+        return ''.join(text if text is not None else values[key] for text, key in template)
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def get_interval_seconds(config):
+        """Returns interval (in seconds) between ticks
+        """
+        return config.tick_interval_secs if config.tick_interval_secs is not None else config.tick_interval * 60
+
+    @staticmethod
+    def get_offset_seconds(config):
+        """Returns offset (in seconds) of the first tick
+        """
+        return config.tick_offset_secs if config.tick_offset_secs is not None else config.tick_offset * 60
+
+    @staticmethod
+    def get_tick_count(config, music_track):
+        """Returns number of ticks to be spoken over given track, without building the plan
+
+        Args:
+            :config
+            :music_track Mp3FileInfo
+        """
+        if config.tick_format == '':
+            return 0
+
+        offset = TickPlan.get_offset_seconds(config)
+        if music_track.duration_seconds <= offset:
+            return 0
+        return int(math.ceil((music_track.duration_seconds - offset) / float(TickPlan.get_interval_seconds(config))))
+
+    # *****************************************************************************************************************
+
+    def __len__(self):
+        """Returns number of events, including track title
+        """
+        return 1 + self.__tick_count
+
+    def get_title(self):
+        """Returns track title, ready to be spoken
+        """
+        return self.__title
+
+    def get_tick(self, offset):
+        """Returns text of the tick to be spoken at given offset (in seconds), ready to be spoken
+        """
+        minutes = offset // 60 + self.__config.tick_add
+        values = {
+            self.KEY_MINUTES: str(minutes),
+            self.KEY_MINUTES_DIGITS: Util.separate_chars(minutes),
+            self.KEY_SECONDS: str(offset % 60),
+        }
+        return Util.prepare_for_speak(self.__render(self.__tick_template, values))
+
+    def __iter__(self):
+        """Yields (offset in seconds, text) tuples, track title first, followed by ticks in chronological order
+        """
+        yield 0, self.__title
+
+        for idx in range(self.__tick_count):
+            offset = self.__offset + idx * self.__interval
+            yield offset, self.get_tick(offset)
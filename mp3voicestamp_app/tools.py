@@ -15,10 +15,14 @@
 
 from __future__ import print_function
 
+import json
+import os
+import re
 import sys
 
 from mp3voicestamp_app.util import Util
 from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.metrics import Metrics
 
 
 class Tools(object):
@@ -27,64 +31,240 @@ class Tools(object):
     KEY_SOX = 'sox'
     KEY_ESPEAK = 'espeak'
 
+    # name of the file (in app's cache folder) resolved tool paths are stored in
+    CACHE_FILE_NAME = 'tools.json'
+    CACHE_VERSION = 1
+
+    # name of the file (in app's cache folder) results of capability probing are stored in
+    CAPS_CACHE_FILE_NAME = 'capabilities.json'
+    CAPS_CACHE_VERSION = 2
+
+    CAP_FFMPEG_LIBMP3LAME = 'ffmpeg_libmp3lame'
+    CAP_FFMPEG_LIBOPUS = 'ffmpeg_libopus'
+    CAP_FFMPEG_AAC = 'ffmpeg_aac'
+    CAP_FFMPEG_ADELAY = 'ffmpeg_adelay'
+    # "all" option of adelay, applying the same delay to all channels (ffmpeg 4.2+)
+    CAP_FFMPEG_ADELAY_ALL = 'ffmpeg_adelay_all'
+    CAP_FFMPEG_ASTATS = 'ffmpeg_astats'
+    CAP_FFMPEG_LOUDNORM = 'ffmpeg_loudnorm'
+    CAP_ESPEAK_NG = 'espeak_ng'
+
     __tools = {}
 
     def __init__(self):
         self.__tools = {}
+        self.__capabilities = None
         self.__check_env_called = False
 
     def ensure_check_env_called(self):
         if not self.__check_env_called:
             raise RuntimeError('check_env() must be called prior using other methods!')
 
+    @staticmethod
+    def get_candidates():
+        """Returns names of binaries we look for, for each tool. First one found in $PATH wins.
+
+        Returns:
+            dict
+        """
+        exe = '.exe' if sys.platform == 'win32' else ''
+        candidates = {
+            Tools.KEY_FFMPEG: ['ffmpeg' + exe],
+            Tools.KEY_SOX: ['sox' + exe],
+            Tools.KEY_ESPEAK: ['espeak' + exe, 'espeak-ng' + exe],
+            Tools.KEY_NORMALIZE: ['normalize' + exe],
+        }
+
+        # sometimes normalize is called normalize-audio (i.e. in Debian/Ubuntu)
+        if sys.platform != 'win32':
+            candidates[Tools.KEY_NORMALIZE].append('normalize-audio')
+
+        return candidates
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __get_cache_file_name():
+        return os.path.join(Util.get_cache_dir(), Tools.CACHE_FILE_NAME)
+
+    @staticmethod
+    def __get_cache_key():
+        # resolved paths depend on where we look for the tools
+        return '{}:{}'.format(sys.platform, os.environ.get('PATH', ''))
+
+    def __load_cache(self):
+        """Returns tool paths resolved by previous run, if these can still be used, otherwise None.
+
+        Cached entry is valid if $PATH did not change and all the cached binaries still exist. This is
+        just a few stat() calls, compared to scanning all $PATH folders for each tool.
+        """
+        try:
+            with open(self.__get_cache_file_name(), 'r') as fh:
+                cache = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if cache.get('version') != self.CACHE_VERSION or cache.get('key') != self.__get_cache_key():
+            return None
+
+        tools = cache.get('tools', {})
+        if set(tools.keys()) != set(self.get_candidates().keys()):
+            return None
+        if not all(Util.is_executable(path) for path in tools.values()):
+            return None
+
+        return tools
+
+    def __save_cache(self, tools):
+        try:
+            cache_file_name = self.__get_cache_file_name()
+            tmp_file_name = '{}.{}'.format(cache_file_name, os.getpid())
+            with open(tmp_file_name, 'w') as fh:
+                json.dump({'version': self.CACHE_VERSION, 'key': self.__get_cache_key(), 'tools': tools}, fh)
+            if os.path.exists(cache_file_name) and sys.platform == 'win32':
+                os.remove(cache_file_name)
+            os.rename(tmp_file_name, cache_file_name)
+        except (IOError, OSError) as ex:
+            # not being able to cache is not a reason to fail
+            Log.d('Failed to save tools cache: {}'.format(ex))
+
     def check_env(self):
         """Checks if all external tools we need are already available and in $PATH
         """
-        if sys.platform == 'win32':
-            self.__tools = {
-                self.KEY_FFMPEG: 'ffmpeg.exe',
-                self.KEY_SOX: 'sox.exe',
-                self.KEY_ESPEAK: 'espeak.exe',
-            }
-        else:
-            self.__tools = {
-                self.KEY_FFMPEG: 'ffmpeg',
-                self.KEY_SOX: 'sox',
-                self.KEY_ESPEAK: 'espeak',
-            }
-
-        for _, tool in self.__tools.items():
-            failed = False
-            if Util.which(tool) is None:
-                Log.e("'{}' not found.".format(tool))
-
-            if failed:
+        tools = self.__load_cache()
+        Metrics.cache_lookup('tools', tools is not None)
+
+        if tools is None:
+            tools = {}
+            missing = []
+            for key, candidates in self.get_candidates().items():
+                for candidate in candidates:
+                    full_path = Util.which(candidate)
+                    if full_path is not None:
+                        tools[key] = full_path
+                        break
+                else:
+                    Log.e("'{}' not found.".format(candidates[0]))
+                    missing.append(key)
+
+            if missing:
                 Util.abort('Required tools not found. See documentation for installation guidelines.')
 
-        # sometimes normalize is called normalize-audio (i.e. in Debian/Ubuntu)
-        # so we do special checks just for this one particular tool
-        normalize_check_result = False
-        if sys.platform == 'win32':
-            normalize = 'normalize.exe'
-            if Util.which(normalize) is not None:
-                self.__tools[self.KEY_NORMALIZE] = normalize
-                normalize_check_result = True
+            self.__save_cache(tools)
         else:
-            normalize = 'normalize'
-            if Util.which(normalize) is not None:
-                self.__tools[self.KEY_NORMALIZE] = normalize
-                normalize_check_result = True
-            else:
-                normalize = 'normalize-audio'
-                if Util.which(normalize) is not None:
-                    self.__tools[self.KEY_NORMALIZE] = normalize
-                    normalize_check_result = True
-
-        if not normalize_check_result:
-            Util.abort('2: "{}" not found. See documentation for installation guidelines.'.format('normalize'))
+            Log.d('Using cached tool paths')
 
+        self.__tools = tools
         self.__check_env_called = True
 
     def get_tool(self, key):
         self.ensure_check_env_called()
         return self.__tools.get(key)
+
+    # *****************************************************************************************************************
+
+    @staticmethod
+    def __to_text(lines):
+        return [line.decode('utf-8', 'replace') if isinstance(line, bytes) else line for line in lines]
+
+    @staticmethod
+    def __probe_ffmpeg(ffmpeg):
+        caps = {}
+
+        rc, out, _ = Util.execute([ffmpeg, '-hide_banner', '-encoders'])
+        encoders = [line.split()[1] for line in Tools.__to_text(out) if len(line.split()) > 2] if rc == 0 else []
+        for cap, name in [(Tools.CAP_FFMPEG_LIBMP3LAME, 'libmp3lame'),
+                          (Tools.CAP_FFMPEG_LIBOPUS, 'libopus'),
+                          (Tools.CAP_FFMPEG_AAC, 'aac')]:
+            caps[cap] = name in encoders
+
+        rc, out, _ = Util.execute([ffmpeg, '-hide_banner', '-filters'])
+        filters = [line.split()[1] for line in Tools.__to_text(out)
+                   if len(line.split()) > 2 and '->' in line.split()[2]] if rc == 0 else []
+        for cap, name in [(Tools.CAP_FFMPEG_ADELAY, 'adelay'),
+                          (Tools.CAP_FFMPEG_ASTATS, 'astats'),
+                          (Tools.CAP_FFMPEG_LOUDNORM, 'loudnorm')]:
+            caps[cap] = name in filters
+
+        # filter options, as listed by filter's help
+        for cap, name, option in [(Tools.CAP_FFMPEG_ADELAY_ALL, 'adelay', 'all')]:
+            caps[cap] = False
+            if name in filters:
+                rc, out, _ = Util.execute([ffmpeg, '-hide_banner', '-h', 'filter={}'.format(name)])
+                option_re = re.compile(r'^\s+{}\s+<'.format(option))
+                caps[cap] = rc == 0 and any(option_re.match(line) for line in Tools.__to_text(out))
+
+        return caps
+
+    @staticmethod
+    def __probe_espeak(espeak):
+        rc, out, err = Util.execute([espeak, '--version'])
+        version = ' '.join(Tools.__to_text(out + err))
+        return {Tools.CAP_ESPEAK_NG: rc == 0 and 'espeak ng' in version.lower()}
+
+    def __get_probes(self):
+        return {
+            self.KEY_FFMPEG: self.__probe_ffmpeg,
+            self.KEY_ESPEAK: self.__probe_espeak,
+        }
+
+    def probe_capabilities(self):
+        """Finds out what features installed tools support. Probing runs external tools, so results are
+        cached on disk, keyed by binary path and its modification time, and the tools are only probed again
+        once replaced or updated.
+
+        Returns:
+            dict with CAP_xxx keys and boolean values
+        """
+        self.ensure_check_env_called()
+
+        if self.__capabilities is not None:
+            return self.__capabilities
+
+        # no usable cache folder means probing every time, but it must not stop the app
+        cache_file_name = None
+        try:
+            cache_file_name = os.path.join(Util.get_cache_dir(), self.CAPS_CACHE_FILE_NAME)
+            with open(cache_file_name, 'r') as fh:
+                cache = json.load(fh)
+            if cache.get('version') != self.CAPS_CACHE_VERSION:
+                cache = {}
+        except (IOError, OSError, ValueError):
+            cache = {}
+
+        binaries = cache.setdefault('binaries', {})
+        cache_changed = False
+
+        capabilities = {}
+        for key, probe in self.__get_probes().items():
+            path = self.get_tool(key)
+            mtime = os.path.getmtime(path)
+
+            entry = binaries.get(path)
+            cache_hit = entry is not None and entry.get('mtime') == mtime
+            Metrics.cache_lookup('capabilities', cache_hit)
+            if not cache_hit:
+                Log.d('Probing capabilities of "{}"'.format(path))
+                entry = {'mtime': mtime, 'caps': probe(path)}
+                binaries[path] = entry
+                cache_changed = True
+
+            capabilities.update(entry['caps'])
+
+        if cache_changed and cache_file_name is not None:
+            cache['version'] = self.CAPS_CACHE_VERSION
+            try:
+                tmp_file_name = '{}.{}'.format(cache_file_name, os.getpid())
+                with open(tmp_file_name, 'w') as fh:
+                    json.dump(cache, fh, indent=2, sort_keys=True)
+                if os.path.exists(cache_file_name) and sys.platform == 'win32':
+                    os.remove(cache_file_name)
+                os.rename(tmp_file_name, cache_file_name)
+            except (IOError, OSError) as ex:
+                Log.d('Failed to save capabilities cache: {}'.format(ex))
+
+        self.__capabilities = capabilities
+        return capabilities
+
+    def has_capability(self, cap):
+        return self.probe_capabilities().get(cap, False)
@@ -14,15 +14,23 @@
 """
 
 from __future__ import print_function
-# noinspection PyCompatibility
-from past.builtins import basestring
 
 import os
 import sys
 from subprocess import Popen, PIPE
 import re
+import tempfile
+import threading
+import time
+
+try:
+    # noinspection PyCompatibility
+    basestring
+except NameError:
+    basestring = str
 
 from mp3voicestamp_app.log import Log
+from mp3voicestamp_app.metrics import Metrics
 
 
 class Util(object):
@@ -62,18 +70,21 @@ class Util(object):
         sys.exit(1)
 
     @staticmethod
-    def execute_rc(cmd_list, working_dir=None, debug=False):
-        rc, _, _ = Util.execute(cmd_list, working_dir, debug)
+    def execute_rc(cmd_list, working_dir=None, debug=False, input_data=None, stdout=None):
+        rc, _, _ = Util.execute(cmd_list, working_dir, debug, input_data, stdout)
         return rc
 
     @staticmethod
-    def execute(cmd_list, working_dir=None, debug=False):
+    def execute(cmd_list, working_dir=None, debug=False, input_data=None, stdout=None):
         """Executes commands from cmd_list changing CWD to working_dir.
 
         Args:
           cmd_list: list with command i.e. ['g4', '-option', ...]
           working_dir: if not None working directory is set to it for cmd exec
           debug: if True, prints executed command string
+          input_data: optional data (bytes) to be fed to command's stdin
+          stdout: optional file object command's stdout should be connected to. If not given,
+                  the output is captured and returned
 
         Returns: rc of executed command (usually 0 == success)
         """
@@ -83,9 +94,17 @@ class Util(object):
 
         Log.d('Executing: {}'.format(' '.join(cmd_list)))
 
-        p = Popen(cmd_list, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdout, err = p.communicate(None)
+        if stdout is not None:
+            stdout.flush()
+
+        started = time.time()
+        p = Popen(cmd_list, stdin=PIPE, stdout=PIPE if stdout is None else stdout, stderr=PIPE)
+        stdout, err = p.communicate(input_data)
         rc = p.returncode
+        Metrics.subprocess_finished(cmd_list[0], rc, time.time() - started)
+
+        if stdout is None:
+            stdout = b''
 
         if rc != 0:
             Log.i([
@@ -118,6 +137,76 @@ class Util(object):
 
         return rc, stdout.splitlines(), err.splitlines()
 
+    @staticmethod
+    def execute_streamed(cmd_list, chunk_handler, input_data=None, chunk_size=65536):
+        """Executes command, passing its output to chunk_handler as soon as it is produced, so the output
+        is never held in memory (or stored) as a whole.
+
+        Args:
+          cmd_list: list with command i.e. ['g4', '-option', ...]
+          chunk_handler: callable invoked with each chunk (bytes) of command's stdout
+          input_data: optional data (bytes) to be fed to command's stdin
+          chunk_size: max size of single chunk (in bytes)
+
+        Returns: rc of executed command (usually 0 == success)
+        """
+        Log.d('Executing: {}'.format(' '.join(cmd_list)))
+
+        started = time.time()
+        with tempfile.TemporaryFile() as err_fh:
+            p = Popen(cmd_list, stdin=PIPE, stdout=PIPE, stderr=err_fh)
+
+            def feed():
+                try:
+                    p.stdin.write(input_data)
+                except (IOError, OSError):
+                    # command does not need all the input, which is fine
+                    pass
+                finally:
+                    p.stdin.close()
+
+            # input is fed from separate thread, otherwise both processes could block on full pipes
+            feeder = None
+            if input_data is not None:
+                feeder = threading.Thread(target=feed)
+                feeder.daemon = True
+                feeder.start()
+            else:
+                p.stdin.close()
+
+            try:
+                while True:
+                    chunk = p.stdout.read(chunk_size)
+                    if not chunk:
+                        break
+                    chunk_handler(chunk)
+            except Exception:
+                p.kill()
+                raise
+            finally:
+                p.stdout.close()
+                rc = p.wait()
+                if feeder is not None:
+                    feeder.join()
+                Metrics.subprocess_finished(cmd_list[0], rc, time.time() - started)
+
+            if rc != 0:
+                err_fh.seek(0)
+                Log.i([
+                    'Command',
+                    '=======',
+                    ' '.join(cmd_list),
+                ])
+                err = err_fh.read().splitlines()
+                if err:
+                    Log.i([
+                        'Command output (stderr)',
+                        '=======================',
+                    ])
+                    _ = [Log.i('%r' % line) for line in err]
+
+        return rc
+
     @staticmethod
     def which(program):
         """Looks for given file (usually binary, executable) in known locations, incl. PATH
@@ -128,21 +217,37 @@ class Util(object):
         Returns full path to known location of given executable or None
         """
 
-        def is_exe(full_path):
-            return os.path.isfile(full_path) and os.access(full_path, os.X_OK)
-
         fpath, _ = os.path.split(program)
         if fpath:
-            if is_exe(program):
+            if Util.is_executable(program):
                 return program
         else:
             for path in os.environ["PATH"].split(os.pathsep):
                 exe_file = os.path.join(path, program)
-                if is_exe(exe_file):
+                if Util.is_executable(exe_file):
                     return exe_file
 
         return None
 
+    @staticmethod
+    def is_executable(full_path):
+        return os.path.isfile(full_path) and os.access(full_path, os.X_OK)
+
+    @staticmethod
+    def get_cache_dir():
+        """Returns path to app's cache folder (created if needed), following XDG spec on Linux.
+        """
+        if sys.platform == 'win32':
+            base = os.getenv('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+
+        cache_dir = os.path.join(base, 'mp3voicestamp')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        return cache_dir
+
     @staticmethod
     def prepare_for_speak(text):
         """ Tries to process provided text for more natural sound when spoken, i.e.
@@ -200,9 +305,53 @@ class Util(object):
 
         return fmt
 
+    @staticmethod
+    def get_available_memory():
+        """Returns memory (in bytes) available for new processes or None if unknown
+        """
+        try:
+            with open('/proc/meminfo', 'r') as fh:
+                for line in fh:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, OSError, ValueError):
+            pass
+
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            return None
+
     @staticmethod
     def split_file_name(file_name):
         base, ext = os.path.splitext(os.path.basename(file_name))
         ext = ext[1:] if ext[0:1] == '.' else ext
 
         return base, ext
+
+    @staticmethod
+    def format_size(size):
+        """Formats given size (in bytes) into human readable form, i.e. "12.3 MiB"
+        """
+        size = float(size)
+        for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+            if abs(size) < 1024 or unit == 'TiB':
+                break
+            size /= 1024
+
+        # noinspection PyUnboundLocalVariable
+        return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{:d} B'.format(int(size))
+
+    @staticmethod
+    def format_duration(seconds):
+        """Formats given number of seconds as "[Hh ]MMm SSs" string
+        """
+        seconds = int(round(seconds))
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+
+        result = '{:02d}m {:02d}s'.format(minutes, seconds)
+        if hours:
+            result = '{}h {}'.format(hours, result)
+
+        return result